@@ -24,6 +24,9 @@ class Elastic(object):
     ANALYZER_STOP = "stop_en"
     BM25 = "BM25"
     SIMILARITY = "sim"  # Used when other similarities are used
+    MTERMVECTORS_CHUNK = 1000  # number of documents per multi term vectors request
+    BULK_MAX_BYTES = 10 * 1024 * 1024  # max size of a bulk request in parallel indexing
+    BULK_MAX_DOCS = 100000  # max number of documents of a bulk request in parallel indexing
 
     def __init__(self, index_name):
         self.__es = Elasticsearch(hosts=ELASTIC_HOSTS)
@@ -107,6 +110,21 @@ class Elastic(object):
         if old_similarity != new_similarity:
             self.__update_settings({"similarity": new_similarity})
 
+    def update_refresh_interval(self, interval):
+        """Updates the refresh interval of the index; "-1" disables refreshing (e.g., during bulk loading).
+
+        :param interval: refresh interval, e.g., "1s" or "-1"
+        """
+        self.__es.indices.put_settings(index=self.__index_name, body={"index": {"refresh_interval": interval}})
+
+    def refresh(self):
+        """Makes the documents added so far searchable."""
+        self.__es.indices.refresh(index=self.__index_name)
+
+    def force_merge(self, max_num_segments=1):
+        """Merges the segments of the index (to be used after bulk loading)."""
+        self.__es.indices.forcemerge(index=self.__index_name, max_num_segments=max_num_segments)
+
     def delete_index(self):
         """Deletes an index."""
         self.__es.indices.delete(index=self.__index_name)
@@ -171,6 +189,25 @@ class Elastic(object):
         if len(actions) > 0:
             helpers.bulk(self.__es, actions)
 
+    def add_docs_parallel(self, docs, thread_count=4, max_chunk_bytes=BULK_MAX_BYTES, chunk_size=BULK_MAX_DOCS):
+        """Adds documents to the index using parallel bulk requests, which are sized by bytes.
+
+        :param docs: iterable of (doc_id, doc) pairs; consumed lazily, so it can be a generator
+        :param thread_count: number of threads sending bulk requests
+        :param max_chunk_bytes: max size of a bulk request (in bytes)
+        :param chunk_size: max number of documents of a bulk request
+        :return: number of indexed documents
+        """
+        actions = ({"_index": self.__index_name, "_type": self.DOC_TYPE, "_id": doc_id, "_source": doc}
+                   for doc_id, doc in docs)
+        num_docs = 0
+        for ok, info in helpers.parallel_bulk(self.__es, actions, thread_count=thread_count, chunk_size=chunk_size,
+                                              max_chunk_bytes=max_chunk_bytes):
+            num_docs += 1
+            if num_docs % 1000000 == 0:
+                print(num_docs / 1000, "K documents indexed.")
+        return num_docs
+
     def add_doc(self, doc_id, contents):
         """Adds a document with the specified contents to the index.
 
@@ -273,10 +310,54 @@ class Elastic(object):
                                    term_statistics=term_stats)
         return tv.get("term_vectors", {}).get(field, {}).get("terms", {})
 
-    def __get_mtermvector(self, doc_list, field, term_stats=False):
-        tv = self.__es.mtermvectors(index=self.__index_name, doc_type=self.DOC_TYPE, ids=doc_list, fields=field,
-                                    term_statistics=term_stats)
-        return tv.get("term_vectors", {}).get(field, {}).get("terms", {})
+    def iter_mtermvectors(self, doc_ids, field, term_stats=False, chunk_size=MTERMVECTORS_CHUNK):
+        """Yields term vectors of multiple documents, using one request per chunk of documents; the term vectors of a
+        chunk are yielded as soon as the chunk is received.
+
+        :param doc_ids: list of document IDs
+        :param field: field name
+        :param term_stats: if True, term statistics are included
+        :param chunk_size: number of documents per request
+        :return: generator of (doc_id, term vector); term vectors are in the same format as get_termvector
+        """
+        doc_ids = [str(doc_id) for doc_id in doc_ids]
+        for i in range(0, len(doc_ids), chunk_size):
+            res = self.__es.mtermvectors(index=self.__index_name, doc_type=self.DOC_TYPE, ids=doc_ids[i:i + chunk_size],
+                                         fields=field, term_statistics=term_stats, field_statistics=False,
+                                         positions=False, offsets=False)
+            for doc in res.get("docs", []):
+                yield doc["_id"], doc.get("term_vectors", {}).get(field, {}).get("terms", {})
+
+    def mtermvectors(self, doc_ids, field, term_stats=False, chunk_size=MTERMVECTORS_CHUNK):
+        """Returns term vectors for multiple documents, using one request per chunk of documents.
+
+        :param doc_ids: list of document IDs
+        :param field: field name
+        :param term_stats: if True, term statistics are included
+        :param chunk_size: number of documents per request
+        :return: dictionary {doc_id: term vector}; term vectors are in the same format as get_termvector
+        """
+        return dict(self.iter_mtermvectors(doc_ids, field, term_stats, chunk_size))
+
+    def mterm_positions(self, doc_ids, field, chunk_size=MTERMVECTORS_CHUNK):
+        """Returns the positions of terms in multiple documents, using one request per chunk of documents.
+
+        :param doc_ids: list of document IDs
+        :param field: field name
+        :param chunk_size: number of documents per request
+        :return: dictionary {doc_id: {term: [positions]}}
+        """
+        doc_ids = [str(doc_id) for doc_id in doc_ids]
+        positions = {}
+        for i in range(0, len(doc_ids), chunk_size):
+            res = self.__es.mtermvectors(index=self.__index_name, doc_type=self.DOC_TYPE, ids=doc_ids[i:i + chunk_size],
+                                         fields=field, term_statistics=False, field_statistics=False,
+                                         positions=True, offsets=False)
+            for doc in res.get("docs", []):
+                terms = doc.get("term_vectors", {}).get(field, {}).get("terms", {})
+                positions[doc["_id"]] = {term: [token["position"] for token in tv.get("tokens", [])]
+                                         for term, tv in terms.items()}
+        return positions
 
     def __get_coll_termvector(self, term, field):
         """Returns a term vector containing collection stats of a term."""
@@ -329,11 +410,16 @@ class Elastic(object):
             term_freqs[term] = val["term_freq"]
         return term_freqs
 
-    def mterm_freqs(self, doc_list, field):
-        tv = self.__get_mtermvector(doc_list, field)
+    def mterm_freqs(self, doc_ids, field, chunk_size=MTERMVECTORS_CHUNK):
+        """Returns term frequencies aggregated over multiple documents.
+        Term vectors are fetched in chunks and aggregated as soon as each chunk is received.
+
+        :return dictionary of terms with their summed frequencies; {term: freq, ...}
+        """
         term_freqs = {}
-        for term, val in tv.items():
-            term_freqs[term] = val["term_freq"]
+        for _, tv in self.iter_mtermvectors(doc_ids, field, chunk_size=chunk_size):
+            for term, val in tv.items():
+                term_freqs[term] = term_freqs.get(term, 0) + val["term_freq"]
         return term_freqs
 
     def term_freq(self, doc_id, field, term):
@@ -0,0 +1,195 @@
+"""
+instrumentation
+---------------
+
+Opt-in instrumentation of index calls (Elastic, ElasticCache, or LocalIndex).
+For each method, it records call counts, latency and response size histograms, and cache hits,
+i.e., calls repeating the arguments of one of the last ``max_tracked_calls`` distinct calls of the method (the calls
+that an LRU cache of that size would answer from memory). Arguments are tracked by their md5 digest; tracking is
+turned off with ``max_tracked_calls=0``.
+
+Usage::
+
+    from nordlys.core.retrieval import instrumentation
+    instrumentation.enable("output/feat_freq")  # indices opened by open_index() are instrumented from now on
+
+At the end of the run, the report is written to ``<prefix>.json`` and ``<prefix>.prom`` (Prometheus text format).
+
+@author: Faegheh Hasibi
+"""
+
+import atexit
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from itertools import accumulate
+
+METHODS = ["search", "search_complex", "search_scroll", "get_termvector", "mtermvectors", "mterm_freqs",
+           "mterm_positions", "analyze_query", "doc_freq", "num_docs"]
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]  # seconds
+SIZE_BUCKETS = [0, 1, 10, 100, 1000, 10000, 100000]  # number of returned items (hits, terms, ...)
+MAX_TRACKED_CALLS = 100000  # distinct calls per method tracked for cache hits
+
+_stats = None
+
+
+def enable(report_prefix=None, max_tracked_calls=MAX_TRACKED_CALLS):
+    """Enables instrumentation; the report is dumped when the program exits.
+
+    :param report_prefix: path prefix of the report files (if None, the report is only written by dump())
+    :param max_tracked_calls: number of distinct calls per method tracked for cache hits (0: no tracking)
+    """
+    global _stats
+    if _stats is None:
+        _stats = Instrumentation(max_tracked_calls)
+        if report_prefix:
+            atexit.register(_stats.dump, report_prefix)
+
+
+def reset():
+    """Discards the calls recorded so far."""
+    if _stats is not None:
+        _stats.reset()
+
+
+def dump(report_prefix):
+    """Writes the report of the calls recorded so far (if instrumentation is enabled)."""
+    if _stats is not None:
+        _stats.dump(report_prefix)
+
+
+def instrument(index):
+    """Wraps the index if instrumentation is enabled; otherwise the index is returned as is."""
+    return InstrumentedIndex(index, _stats) if _stats is not None else index
+
+
+def _response_size(res):
+    if isinstance(res, (dict, list, tuple, set)):
+        return len(res)
+    if isinstance(res, str):
+        return len(res.split())
+    return 1
+
+
+def _call_key(args, kwargs):
+    """Returns the md5 digest of the arguments of a call; arrays (e.g. doc ids) are hashed by content."""
+    m = hashlib.md5()
+    for v in list(args) + [v for _, v in sorted(kwargs.items())]:
+        m.update(v.tobytes() if hasattr(v, "tobytes") else repr(v).encode("utf-8"))
+        m.update(b"\0")
+    m.update(repr(sorted(kwargs)).encode("utf-8"))
+    return m.digest()
+
+
+class MethodStats(object):
+    def __init__(self, max_tracked_calls=MAX_TRACKED_CALLS):
+        self.calls = 0
+        self.cache_hits = 0
+        self.latency_sum = 0.0
+        self.size_sum = 0
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)  # last bucket is +Inf
+        self.size_counts = [0] * (len(SIZE_BUCKETS) + 1)
+        self.__max_tracked_calls = max_tracked_calls
+        self.__tracked = OrderedDict()  # keys of the last distinct calls, least recently used first
+
+    @staticmethod
+    def __bucket(value, buckets):
+        for i, upper in enumerate(buckets):
+            if value <= upper:
+                return i
+        return len(buckets)
+
+    def add(self, key, latency, size):
+        self.calls += 1
+        if key in self.__tracked:
+            self.cache_hits += 1
+            self.__tracked.move_to_end(key)
+        elif self.__max_tracked_calls > 0:
+            self.__tracked[key] = None
+            if len(self.__tracked) > self.__max_tracked_calls:
+                self.__tracked.popitem(last=False)
+        self.latency_sum += latency
+        self.size_sum += size
+        self.latency_counts[self.__bucket(latency, LATENCY_BUCKETS)] += 1
+        self.size_counts[self.__bucket(size, SIZE_BUCKETS)] += 1
+
+    def to_dict(self):
+        return {"calls": self.calls,
+                "latency_sum": self.latency_sum,
+                "latency_avg": self.latency_sum / self.calls if self.calls else 0.0,
+                "latency_histogram": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"],
+                                              accumulate(self.latency_counts))),
+                "size_sum": self.size_sum,
+                "size_avg": self.size_sum / self.calls if self.calls else 0.0,
+                "size_histogram": dict(zip([str(b) for b in SIZE_BUCKETS] + ["+Inf"],
+                                           accumulate(self.size_counts))),
+                "cache_hits": self.cache_hits,
+                "cache_hit_rate": self.cache_hits / self.calls if self.calls else 0.0}
+
+
+class Instrumentation(object):
+    def __init__(self, max_tracked_calls=MAX_TRACKED_CALLS):
+        self.__max_tracked_calls = max_tracked_calls
+        self.__methods = {}
+
+    def reset(self):
+        self.__methods = {}
+
+    def record(self, method, key, latency, size):
+        if method not in self.__methods:
+            self.__methods[method] = MethodStats(self.__max_tracked_calls)
+        self.__methods[method].add(key, latency, size)
+
+    def report(self):
+        """Returns the report as a dictionary {method: stats}."""
+        return {method: stats.to_dict() for method, stats in sorted(self.__methods.items())}
+
+    def prometheus(self):
+        """Returns the report in Prometheus text format."""
+        report = self.report()
+        lines = []
+        for name, key, help_str in [("index_requests_total", "calls", "Number of index calls."),
+                                    ("index_cache_hits_total", "cache_hits", "Number of repeated calls.")]:
+            lines += ["# HELP " + name + " " + help_str, "# TYPE " + name + " counter"]
+            for method, stats in report.items():
+                lines.append("{}{{method=\"{}\"}} {}".format(name, method, stats[key]))
+        for name, key, help_str in [("index_request_duration_seconds", "latency", "Latency of index calls."),
+                                    ("index_response_size", "size", "Number of items returned by index calls.")]:
+            lines += ["# HELP " + name + " " + help_str, "# TYPE " + name + " histogram"]
+            for method, stats in report.items():
+                for le, count in stats[key + "_histogram"].items():
+                    lines.append("{}_bucket{{method=\"{}\",le=\"{}\"}} {}".format(name, method, le, count))
+                lines.append("{}_sum{{method=\"{}\"}} {}".format(name, method, stats[key + "_sum"]))
+                lines.append("{}_count{{method=\"{}\"}} {}".format(name, method, stats["calls"]))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, report_prefix):
+        """Writes the report into <report_prefix>.json and <report_prefix>.prom."""
+        with open(report_prefix + ".json", "w") as f:
+            json.dump(self.report(), f, indent=4)  # keeps the order of histogram buckets
+        with open(report_prefix + ".prom", "w") as f:
+            f.write(self.prometheus())
+        print("Instrumentation report:", report_prefix + ".json")
+
+
+class InstrumentedIndex(object):
+    """Proxy of an index object, which records the calls of the instrumented methods."""
+
+    def __init__(self, index, stats):
+        self.__index = index
+        self.__stats = stats
+
+    def __getattr__(self, name):
+        attr = getattr(self.__index, name)
+        if name not in METHODS or not callable(attr):
+            return attr
+
+        def instrumented(*args, **kwargs):
+            start = time.perf_counter()
+            res = attr(*args, **kwargs)
+            latency = time.perf_counter() - start
+            self.__stats.record(name, _call_key(args, kwargs), latency, _response_size(res))
+            return res
+
+        return instrumented
@@ -0,0 +1,703 @@
+"""
+local_index
+-----------
+
+In-process inverted index, to be used as a drop-in for :class:`Elastic` on read-only collections.
+
+The index is built once with :class:`LocalIndexBuilder` and stored on disk as numpy arrays, one directory per field:
+
+- ``vocab.txt``: terms, one per line, in term id order
+- ``tokens.npy``, ``token_offsets.npy``: term ids of each document by position (-1 for removed stopwords)
+- ``tv_offsets.npy``, ``tv_terms.npy``, ``tv_freqs.npy``: per-document term vectors (CSR, document x term)
+- ``post_offsets.npy``, ``post_docs.npy``, ``post_freqs.npy``: posting lists (CSR, term x document)
+- ``term_ttf.npy``, ``doc_lengths.npy``: collection statistics
+
+:class:`LocalIndex` memory-maps these arrays and answers the subset of the Elastic API used in our pipeline.
+Documents must have integer IDs and be added in increasing ID order.
+
+:func:`compare_backends` indexes a few sentences into both an Elastic index and a local index, and checks that they
+give the same results (search hits, term vectors, positions, and stats). BM25 scores are compared with a tolerance,
+as Lucene encodes document lengths in a single byte. Usage::
+
+    python -m nordlys.core.retrieval.local_index -i <test_index_name> -d <test_index_dir>
+
+@author: Faegheh Hasibi
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+from array import array
+
+import numpy as np
+
+from nordlys.core.retrieval import instrumentation
+from nordlys.core.retrieval.elastic import Elastic
+from nordlys.core.retrieval.elastic_cache import ElasticCache
+
+# Lucene's default English stopwords, i.e., "_english_" in the "stop_en" analyzer
+STOPWORDS_EN = {"a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it", "no",
+                "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these", "they", "this", "to",
+                "was", "will", "with"}
+# Approximates the standard tokenizer: word characters, possibly joined by in-word punctuation (e.g. "u.s", "don't")
+TOKEN_RE = re.compile(r"\w+(?:[.'’]\w+)*")
+
+
+def analyze(text, analyzer=Elastic.ANALYZER_STOP):
+    """Analyzes text with the rules of the "stop_en" analyzer (standard tokenizer, lowercase, English stopwords).
+
+    :param text: raw text
+    :param analyzer: name of analyzer; only ANALYZER_STOP is supported
+    :return: list of (term, position) pairs; stopwords are removed, but keep their positions (as in Elastic)
+    """
+    if analyzer != Elastic.ANALYZER_STOP:
+        print("Error: Analyzer", analyzer, "is not supported by the local index.")
+        exit(0)
+    terms = []
+    for pos, token in enumerate(TOKEN_RE.findall(text.lower())):
+        if token not in STOPWORDS_EN:
+            terms.append((token, pos))
+    return terms
+
+
+def open_index(index_name, local_index_dir=None):
+    """Returns the local index if its directory is given, otherwise the (cached) Elastic index.
+    The index is instrumented if instrumentation is enabled.
+
+    :param index_name: name of the Elastic index
+    :param local_index_dir: directory of the local index (optional)
+    """
+    return instrumentation.instrument(LocalIndex(local_index_dir) if local_index_dir else ElasticCache(index_name))
+
+
+def raw_to_npy(raw_file, npy_file, dtype, chunk_size=1 << 26):
+    """Converts a raw binary file (written incrementally) into a .npy file and removes the raw file."""
+    n = os.path.getsize(raw_file) // np.dtype(dtype).itemsize
+    out = np.lib.format.open_memmap(npy_file, mode="w+", dtype=dtype, shape=(n,))
+    if n > 0:
+        raw = np.memmap(raw_file, dtype=dtype, mode="r")
+        for start in range(0, n, chunk_size):
+            out[start:start + chunk_size] = raw[start:start + chunk_size]
+        del raw
+    out.flush()
+    del out
+    os.remove(raw_file)
+
+
+def _empty():
+    return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+
+def _union(results):
+    """Disjunction of (docs, scores) results; scores of the same document are summed up."""
+    results = [r for r in results if len(r[0]) > 0]
+    if len(results) == 0:
+        return _empty()
+    if len(results) == 1:
+        return results[0]
+    docs, inverse = np.unique(np.concatenate([r[0] for r in results]), return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate([r[1] for r in results]), minlength=len(docs))
+    return docs, scores
+
+
+def _intersect(res1, res2):
+    """Conjunction of two (docs, scores) results; scores are summed up."""
+    docs, idx1, idx2 = np.intersect1d(res1[0], res2[0], assume_unique=True, return_indices=True)
+    return docs, res1[1][idx1] + res2[1][idx2]
+
+
+def concat_ranges(starts, ends):
+    """Returns the concatenation of ranges [start, end) as a single index array."""
+    lens = ends - starts
+    if np.sum(lens) == 0:
+        return np.zeros(0, dtype=np.int64)
+    shifts = np.repeat(starts - np.concatenate([[0], np.cumsum(lens)[:-1]]), lens)
+    return shifts + np.arange(np.sum(lens), dtype=np.int64)
+
+
+def _as_list(clauses):
+    if clauses is None:
+        return []
+    return clauses if isinstance(clauses, list) else [clauses]
+
+
+class LocalIndexBuilder(object):
+    """Builds a local index; documents are streamed to disk and inverted when the builder is closed."""
+    CHUNK_DOCS = 500000  # number of documents processed at once when inverting the index
+
+    def __init__(self, index_dir, mappings):
+        """
+        :param index_dir: directory of the index (created if it does not exist)
+        :param mappings: field mappings, in the same format as for Elastic.create_index
+        """
+        self.__index_dir = index_dir
+        self.__analyzed = {field: mapping.get("index") != "not_analyzed" for field, mapping in mappings.items()}
+        self.__doc_ids = array("q")
+        self.__vocab = {}
+        self.__offsets = {}
+        self.__token_files = {}
+        for field in mappings:
+            os.makedirs(self.__path(field), exist_ok=True)
+            self.__vocab[field] = {}
+            self.__offsets[field] = array("q", [0])
+            self.__token_files[field] = open(self.__path(field, "tokens.tmp"), "wb")
+
+    def __path(self, *names):
+        return os.sep.join([self.__index_dir] + list(names))
+
+    def add_doc(self, doc_id, doc):
+        """Adds a document to the index.
+
+        :param doc_id: integer document ID; must be larger than the ID of the previously added document
+        :param doc: dictionary {field: content}; contents of not analyzed fields may be lists
+        """
+        doc_id = int(doc_id)
+        assert len(self.__doc_ids) == 0 or doc_id > self.__doc_ids[-1], "Document IDs must be increasing"
+        self.__doc_ids.append(doc_id)
+        for field, analyzed in self.__analyzed.items():
+            vocab = self.__vocab[field]
+            tokens = array("i")
+            content = doc.get(field, [])
+            if analyzed:
+                for term, pos in analyze(content):
+                    tokens.extend([-1] * (pos - len(tokens)))  # keeps positions of stopwords
+                    tokens.append(vocab.setdefault(term, len(vocab)))
+            else:
+                for term in ([content] if isinstance(content, str) else content):
+                    tokens.append(vocab.setdefault(term, len(vocab)))
+            self.__token_files[field].write(tokens.tobytes())
+            self.__offsets[field].append(self.__offsets[field][-1] + len(tokens))
+
+    def add_docs_bulk(self, docs):
+        """Adds a set of documents to the index.
+
+        :param docs: dictionary {doc_id: doc}
+        """
+        for doc_id, doc in sorted(docs.items()):
+            self.add_doc(doc_id, doc)
+
+    def close(self):
+        """Inverts the index and writes all the arrays to disk."""
+        num_docs = len(self.__doc_ids)
+        np.save(self.__path("doc_ids.npy"), np.array(self.__doc_ids, dtype=np.int64))
+        for field in self.__analyzed:
+            self.__token_files[field].close()
+            print("Inverting field <" + field + "> ...")
+            self.__write_field(field, num_docs)
+        with open(self.__path("meta.json"), "w") as f:
+            json.dump({"num_docs": num_docs, "analyzed": self.__analyzed}, f, indent=4, sort_keys=True)
+        print("Local index <" + self.__index_dir + "> is created.")
+
+    def __write_field(self, field, num_docs):
+        vocab = self.__vocab[field]
+        num_terms = len(vocab)
+        with open(self.__path(field, "vocab.txt"), "w", encoding="utf-8") as f:
+            for term in sorted(vocab, key=vocab.get):
+                f.write(term + "\n")
+
+        # Tokens
+        token_offsets = np.array(self.__offsets[field], dtype=np.int64)
+        np.save(self.__path(field, "token_offsets.npy"), token_offsets)
+        raw_to_npy(self.__path(field, "tokens.tmp"), self.__path(field, "tokens.npy"), np.int32)
+        tokens = np.load(self.__path(field, "tokens.npy"), mmap_mode="r")
+
+        # Term vectors (document x term), computed for chunks of documents
+        tv_lens = np.zeros(num_docs, dtype=np.int64)
+        doc_lengths = np.zeros(num_docs, dtype=np.int32)
+        with open(self.__path(field, "tv_terms.tmp"), "wb") as f_terms, \
+                open(self.__path(field, "tv_freqs.tmp"), "wb") as f_freqs:
+            for d0 in range(0, num_docs, self.CHUNK_DOCS):
+                d1 = min(d0 + self.CHUNK_DOCS, num_docs)
+                toks = np.asarray(tokens[token_offsets[d0]:token_offsets[d1]], dtype=np.int64)
+                docs = np.repeat(np.arange(d1 - d0, dtype=np.int64), np.diff(token_offsets[d0:d1 + 1]))
+                mask = toks >= 0
+                keys, freqs = np.unique(docs[mask] * num_terms + toks[mask], return_counts=True)
+                tv_lens[d0:d1] = np.bincount(keys // max(num_terms, 1), minlength=d1 - d0)
+                doc_lengths[d0:d1] = np.bincount(docs[mask], minlength=d1 - d0)
+                f_terms.write((keys % max(num_terms, 1)).astype(np.int32).tobytes())
+                f_freqs.write(freqs.astype(np.int32).tobytes())
+        tv_offsets = np.zeros(num_docs + 1, dtype=np.int64)
+        tv_offsets[1:] = np.cumsum(tv_lens)
+        np.save(self.__path(field, "tv_offsets.npy"), tv_offsets)
+        np.save(self.__path(field, "doc_lengths.npy"), doc_lengths)
+        raw_to_npy(self.__path(field, "tv_terms.tmp"), self.__path(field, "tv_terms.npy"), np.int32)
+        raw_to_npy(self.__path(field, "tv_freqs.tmp"), self.__path(field, "tv_freqs.npy"), np.int32)
+        tv_terms = np.load(self.__path(field, "tv_terms.npy"), mmap_mode="r")
+        tv_freqs = np.load(self.__path(field, "tv_freqs.npy"), mmap_mode="r")
+
+        # Collection stats
+        doc_freqs = np.zeros(num_terms, dtype=np.int64)
+        term_ttf = np.zeros(num_terms, dtype=np.int64)
+        for d0 in range(0, num_docs, self.CHUNK_DOCS):
+            start, end = tv_offsets[d0], tv_offsets[min(d0 + self.CHUNK_DOCS, num_docs)]
+            terms = np.asarray(tv_terms[start:end])
+            doc_freqs += np.bincount(terms, minlength=num_terms)
+            term_ttf += np.bincount(terms, weights=tv_freqs[start:end], minlength=num_terms).astype(np.int64)
+        np.save(self.__path(field, "term_ttf.npy"), term_ttf)
+
+        # Posting lists (term x document); documents are scattered in increasing order into each posting list
+        post_offsets = np.zeros(num_terms + 1, dtype=np.int64)
+        post_offsets[1:] = np.cumsum(doc_freqs)
+        np.save(self.__path(field, "post_offsets.npy"), post_offsets)
+        post_docs = np.lib.format.open_memmap(self.__path(field, "post_docs.npy"), mode="w+", dtype=np.int32,
+                                              shape=(len(tv_terms),))
+        post_freqs = np.lib.format.open_memmap(self.__path(field, "post_freqs.npy"), mode="w+", dtype=np.int32,
+                                               shape=(len(tv_terms),))
+        cursor = post_offsets[:-1].copy()
+        for d0 in range(0, num_docs, self.CHUNK_DOCS):
+            d1 = min(d0 + self.CHUNK_DOCS, num_docs)
+            start, end = tv_offsets[d0], tv_offsets[d1]
+            terms = np.asarray(tv_terms[start:end])
+            docs = np.repeat(np.arange(d0, d1, dtype=np.int32), tv_lens[d0:d1])
+            order = np.argsort(terms, kind="stable")
+            sorted_terms = terms[order]
+            rank = np.arange(len(sorted_terms)) - np.searchsorted(sorted_terms, sorted_terms)  # rank within term
+            dest = cursor[sorted_terms] + rank
+            post_docs[dest] = docs[order]
+            post_freqs[dest] = np.asarray(tv_freqs[start:end])[order]
+            cursor += np.bincount(terms, minlength=num_terms)
+        post_docs.flush()
+        post_freqs.flush()
+
+
+class _FieldIndex(object):
+    """Memory-mapped arrays of a single field."""
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, field_dir, analyzed):
+        self.analyzed = analyzed
+        with open(os.sep.join([field_dir, "vocab.txt"]), "r", encoding="utf-8") as f:
+            self.terms = [line.rstrip("\n") for line in f]
+        self.term_ids = {term: i for i, term in enumerate(self.terms)}
+        for name in ["tokens", "token_offsets", "tv_offsets", "tv_terms", "tv_freqs", "post_offsets", "post_docs",
+                     "post_freqs", "term_ttf", "doc_lengths"]:
+            setattr(self, name, np.load(os.sep.join([field_dir, name + ".npy"]), mmap_mode="r"))
+        self.doc_freqs = np.diff(self.post_offsets)
+        self.num_docs = len(self.doc_lengths)
+        self.doc_count = int(np.count_nonzero(self.doc_lengths))
+        self.coll_length = int(np.sum(self.term_ttf))
+        # Lucene (used by ES 2.x) normalizes BM25 by the average length over all documents
+        self.avg_len = self.coll_length / self.num_docs if self.num_docs else 0.0
+
+    def analyze(self, text):
+        """Returns (term, position) pairs; not analyzed fields are indexed as a single term."""
+        return analyze(text) if self.analyzed else [(text, 0)]
+
+    def doc_freq(self, term):
+        term_id = self.term_ids.get(term)
+        return int(self.doc_freqs[term_id]) if term_id is not None else 0
+
+    def coll_term_freq(self, term):
+        term_id = self.term_ids.get(term)
+        return int(self.term_ttf[term_id]) if term_id is not None else 0
+
+    def postings(self, term):
+        """Returns the (docs, freqs) arrays of the posting list of a term."""
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        start, end = self.post_offsets[term_id], self.post_offsets[term_id + 1]
+        return self.post_docs[start:end], self.post_freqs[start:end]
+
+    def idf(self, term):
+        df = self.doc_freq(term)
+        return math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+
+    def bm25(self, docs, freqs, idf):
+        """BM25 scores of documents, given the frequencies of a term (or phrase) and its idf."""
+        freqs = np.asarray(freqs, dtype=np.float64)
+        if self.analyzed and self.avg_len > 0:
+            norm = 1 - self.B + self.B * self.doc_lengths[docs] / self.avg_len
+        else:  # not analyzed fields have no norms
+            norm = 1.0
+        return idf * freqs * (self.K1 + 1) / (freqs + self.K1 * norm)
+
+    def term_scores(self, term):
+        docs, freqs = self.postings(term)
+        return np.asarray(docs, dtype=np.int64), self.bm25(docs, freqs, self.idf(term))
+
+    def phrase_scores(self, terms):
+        """Scores documents containing the given (term, position) pairs at the same relative positions."""
+        if len(terms) == 0:
+            return _empty()
+        if len(terms) == 1:
+            return self.term_scores(terms[0][0])
+        term_ids = [self.term_ids.get(term) for term, _ in terms]
+        if None in term_ids:
+            return _empty()
+        docs = np.asarray(self.postings(terms[0][0])[0])
+        for term, _ in terms[1:]:
+            docs = np.intersect1d(docs, self.postings(term)[0], assume_unique=True)
+        offsets = [pos - terms[0][1] for _, pos in terms]
+        freqs = np.zeros(len(docs), dtype=np.int64)
+        for i, doc in enumerate(docs):
+            tokens = self.tokens[self.token_offsets[doc]:self.token_offsets[doc + 1]]
+            hits = np.flatnonzero(tokens == term_ids[0])
+            for term_id, offset in zip(term_ids[1:], offsets[1:]):
+                hits = hits[hits + offset < len(tokens)]
+                hits = hits[tokens[hits + offset] == term_id]
+            freqs[i] = len(hits)
+        mask = freqs > 0
+        docs = docs[mask].astype(np.int64)
+        return docs, self.bm25(docs, freqs[mask], sum(self.idf(term) for term, _ in terms))
+
+
+class LocalIndex(object):
+    """Read-only, memory-mapped index with the same search and stats methods as :class:`Elastic`."""
+    DOC_TYPE = Elastic.DOC_TYPE
+    ANALYZER_STOP = Elastic.ANALYZER_STOP
+
+    def __init__(self, index_dir):
+        self.__index_dir = index_dir
+        with open(os.sep.join([index_dir, "meta.json"]), "r") as f:
+            meta = json.load(f)
+        self.__doc_ids = np.load(os.sep.join([index_dir, "doc_ids.npy"]), mmap_mode="r")
+        self.__fields = {field: _FieldIndex(os.sep.join([index_dir, field]), analyzed)
+                         for field, analyzed in meta["analyzed"].items()}
+
+    def __field(self, field):
+        assert field in self.__fields, "Unknown field: {}".format(field)
+        return self.__fields[field]
+
+    def __docno(self, doc_id):
+        """Returns the internal document number of a document ID (None if the document does not exist)."""
+        doc_id = int(doc_id)
+        docno = int(np.searchsorted(self.__doc_ids, doc_id))
+        if docno < len(self.__doc_ids) and self.__doc_ids[docno] == doc_id:
+            return docno
+        return None
+
+    def __docnos(self, doc_ids):
+        """Returns internal document numbers of existing document IDs (unknown IDs are dropped)."""
+        doc_ids = np.array([int(doc_id) for doc_id in doc_ids], dtype=np.int64)
+        docnos = np.searchsorted(self.__doc_ids, doc_ids)
+        found = docnos < len(self.__doc_ids)
+        found[found] = self.__doc_ids[docnos[found]] == doc_ids[found]
+        return docnos[found]
+
+    def __hits(self, results, num=None, start=0):
+        """Converts (docs, scores) results to a dictionary of document IDs with scores, sorted by score."""
+        docs, scores = results
+        order = np.lexsort((docs, -scores))
+        order = order[start:start + num] if num is not None else order
+        return {str(self.__doc_ids[docs[i]]): float(scores[i]) for i in order}
+
+    def __query_scores(self, query):
+        """Scores documents for a query clause (bool, term, match, or match_phrase)."""
+        (query_type, spec), = query.items()
+        if query_type == "bool":
+            return self.__bool_scores(spec)
+        (field, value), = spec.items()
+        if isinstance(value, dict):
+            value = value.get("query", value.get("value"))
+        field_index = self.__field(field)
+        if query_type == "term":
+            return field_index.term_scores(value)
+        elif query_type == "match":
+            return _union([field_index.term_scores(term) for term, _ in field_index.analyze(value)])
+        elif query_type == "match_phrase":
+            return field_index.phrase_scores(field_index.analyze(value))
+        print("Error: Query type", query_type, "is not supported by the local index.")
+        exit(0)
+
+    def __bool_scores(self, spec):
+        results = None
+        for clause in _as_list(spec.get("must")):
+            res = self.__query_scores(clause)
+            results = res if results is None else _intersect(results, res)
+        for clause in _as_list(spec.get("filter")):
+            docs = self.__query_scores(clause)[0]
+            res = (docs, np.zeros(len(docs)))
+            results = res if results is None else _intersect(results, res)
+        should = _union([self.__query_scores(clause) for clause in _as_list(spec.get("should"))])
+        if results is None:
+            if len(_as_list(spec.get("should"))) > 0:
+                results = should
+            else:  # only must_not clauses
+                results = np.arange(self.num_docs(), dtype=np.int64), np.ones(self.num_docs())
+        elif len(should[0]) > 0:
+            docs, idx, idx_should = np.intersect1d(results[0], should[0], assume_unique=True, return_indices=True)
+            scores = results[1].copy()
+            scores[idx] += should[1][idx_should]
+            results = results[0], scores
+        for clause in _as_list(spec.get("must_not")):
+            mask = ~np.isin(results[0], self.__query_scores(clause)[0])
+            results = results[0][mask], results[1][mask]
+        return results
+
+    def analyze_query(self, query, analyzer=ANALYZER_STOP):
+        """Analyzes the query.
+
+        :param query: raw query
+        :param analyzer: name of analyzer
+        """
+        return " ".join(term for term, _ in analyze(query, analyzer))
+
+    def search(self, query, field, num=100, fields_return="", start=0):
+        """Searches in a given field using BM25.
+        Only keyword queries are supported (i.e., no query string operators).
+
+        :param query: query string
+        :param field: field to search in
+        :param num: number of hits to return (default: 100)
+        :param fields_return: not used; kept for compatibility with Elastic
+        :param start: starting offset (default: 0)
+        :return: dictionary of document IDs with scores
+        """
+        field_index = self.__field(field)
+        terms = [term for word in query.split() for term, _ in field_index.analyze(word)]
+        return self.__hits(_union([field_index.term_scores(term) for term in terms]), num, start)
+
+    def search_complex(self, body, field, num=100, fields_return="", start=0):
+        """Searches using a query body; bool queries with term, match, and match_phrase clauses are supported.
+
+        :param body: query body
+        :param field: not used; fields are given in the query body
+        :param num: number of hits to return (default: 100)
+        :param fields_return: not used; kept for compatibility with Elastic
+        :param start: starting offset (default: 0)
+        :return: dictionary of document IDs with scores
+        """
+        return self.__hits(self.__query_scores(body.get("query", body)), num, start)
+
+    def search_scroll(self, query, field, num=100, scroll="2m"):
+        """Returns all the documents matching the query (equivalent to scrolling over all results).
+
+        :param query: query string
+        :param field: field to search in
+        :param num: not used; kept for compatibility with Elastic
+        :param scroll: not used; kept for compatibility with Elastic
+        :return: dictionary of document IDs with scores
+        """
+        return self.search(query, field, num=None)
+
+    def get_fields(self):
+        """Returns name of fields in the index."""
+        return list(self.__fields.keys())
+
+    # =========================================
+    # ================= Stats =================
+    # =========================================
+    def get_termvector(self, doc_id, field, term_stats=False):
+        """Returns a term vector for a given document field, in the same format as Elastic.
+
+        :param doc_id: document ID
+        :param field: field name
+        :param term_stats: if True, doc_freq and ttf of terms are included
+        """
+        docno = self.__docno(doc_id)
+        if docno is None:
+            return {}
+        field_index = self.__field(field)
+        start, end = field_index.tv_offsets[docno], field_index.tv_offsets[docno + 1]
+        tv = {}
+        for term_id, tf in zip(field_index.tv_terms[start:end].tolist(), field_index.tv_freqs[start:end].tolist()):
+            stats = {"term_freq": tf}
+            if term_stats:
+                stats["doc_freq"] = int(field_index.doc_freqs[term_id])
+                stats["ttf"] = int(field_index.term_ttf[term_id])
+            tv[field_index.terms[term_id]] = stats
+        return tv
+
+    def iter_mtermvectors(self, doc_ids, field, term_stats=False, chunk_size=None):
+        """Yields term vectors of multiple documents.
+
+        :param doc_ids: list of document IDs
+        :param field: field name
+        :param term_stats: if True, doc_freq and ttf of terms are included
+        :param chunk_size: not used; kept for compatibility with Elastic
+        :return: generator of (doc_id, term vector)
+        """
+        for doc_id in doc_ids:
+            yield str(doc_id), self.get_termvector(doc_id, field, term_stats=term_stats)
+
+    def mtermvectors(self, doc_ids, field, term_stats=False, chunk_size=None):
+        """Returns term vectors for multiple documents.
+
+        :param doc_ids: list of document IDs
+        :param field: field name
+        :param term_stats: if True, doc_freq and ttf of terms are included
+        :param chunk_size: not used; kept for compatibility with Elastic
+        :return: dictionary {doc_id: term vector}
+        """
+        return dict(self.iter_mtermvectors(doc_ids, field, term_stats))
+
+    def mterm_positions(self, doc_ids, field, chunk_size=None):
+        """Returns the positions of terms in multiple documents.
+
+        :param doc_ids: list of document IDs
+        :param field: field name
+        :param chunk_size: not used; kept for compatibility with Elastic
+        :return: dictionary {doc_id: {term: [positions]}}
+        """
+        field_index = self.__field(field)
+        positions = {}
+        for doc_id in doc_ids:
+            docno = self.__docno(doc_id)
+            if docno is None:
+                continue
+            tokens = field_index.tokens[field_index.token_offsets[docno]:field_index.token_offsets[docno + 1]]
+            term_positions = {}
+            for pos, term_id in enumerate(tokens.tolist()):
+                if term_id >= 0:  # skips stopwords
+                    term_positions.setdefault(field_index.terms[term_id], []).append(pos)
+            positions[str(doc_id)] = term_positions
+        return positions
+
+    def mterm_freqs(self, doc_ids, field, chunk_size=None):
+        """Returns term frequencies aggregated over multiple documents (chunk_size is not used; kept for compatibility
+        with Elastic).
+
+        :return dictionary of terms with their summed frequencies; {term: freq, ...}
+        """
+        field_index = self.__field(field)
+        docnos = self.__docnos(doc_ids)
+        idx = concat_ranges(field_index.tv_offsets[docnos], field_index.tv_offsets[docnos + 1])
+        term_ids, inverse = np.unique(field_index.tv_terms[idx], return_inverse=True)
+        freqs = np.bincount(inverse, weights=field_index.tv_freqs[idx], minlength=len(term_ids))
+        return {field_index.terms[term_id]: int(freq) for term_id, freq in zip(term_ids.tolist(), freqs.tolist())}
+
+    def num_docs(self):
+        """Returns the number of documents in the index."""
+        return len(self.__doc_ids)
+
+    def num_fields(self):
+        """Returns number of fields in the index."""
+        return len(self.__fields)
+
+    def doc_count(self, field):
+        """Returns number of documents with at least one term for the given field."""
+        return self.__field(field).doc_count
+
+    def coll_length(self, field):
+        """Returns length of field in the collection."""
+        return self.__field(field).coll_length
+
+    def avg_len(self, field):
+        """Returns average length of a field in the collection."""
+        return self.coll_length(field) / self.doc_count(field)
+
+    def doc_length(self, doc_id, field):
+        """Returns length of a field in a document."""
+        return sum(self.term_freqs(doc_id, field).values())
+
+    def doc_freq(self, term, field):
+        """Returns document frequency for the given term and field."""
+        return self.__field(field).doc_freq(term)
+
+    def coll_term_freq(self, term, field):
+        """ Returns collection term frequency for the given field."""
+        return self.__field(field).coll_term_freq(term)
+
+    def term_freqs(self, doc_id, field):
+        """Returns term frequencies for a given document and field.
+
+        :return dictionary of terms with their frequencies; {term: freq, ...}
+        """
+        return {term: val["term_freq"] for term, val in self.get_termvector(doc_id, field).items()}
+
+    def term_freq(self, doc_id, field, term):
+        """Returns frequency of a term in a given document and field."""
+        return self.term_freqs(doc_id, field).get(term, 0)
+
+
+# Sentences of compare_backends: stopwords, repeated terms, in-word punctuation, and phrases across stopwords
+TEST_DOCS = {
+    1: {"content": "Barack Obama was the president of the United States", "professions": ["politician", "lawyer"]},
+    2: {"content": "Obama studied law at Harvard, and he taught law in Chicago", "professions": ["lawyer"]},
+    3: {"content": "The University of Oslo is the oldest university in Norway", "professions": []},
+    4: {"content": "He don't like the U.S. president; the president likes him", "professions": ["politician"]},
+    5: {"content": "Edvard Munch was a Norwegian painter, and a painter of The Scream", "professions": ["painter"]},
+    6: {"content": "A painter and a lawyer of Oslo", "professions": ["painter", "lawyer"]}
+}
+TEST_QUERIES = ["obama", "president", "law harvard", "painter oslo", "the university", "norwegian painter"]
+TEST_PHRASES = ["University of Oslo", "the president", "painter of the scream", "Norwegian painter", "oslo university"]
+SCORE_RTOL = 0.05  # tolerance on BM25 scores (lossy length norms of Lucene)
+
+
+def compare_backends(index_name, index_dir, docs=TEST_DOCS, field="content", prof_field="professions"):
+    """Indexes the documents into a new Elastic index and a new local index, and compares their results.
+
+    :param index_name: name of the Elastic index (overwritten)
+    :param index_dir: directory of the local index (overwritten)
+    :return: list of differences (empty if the results are the same)
+    """
+    mappings = {field: Elastic.analyzed_field(), prof_field: Elastic.notanalyzed_field()}
+    elastic = Elastic(index_name)
+    elastic.create_index({f: dict(mapping) for f, mapping in mappings.items()}, force=True)
+    elastic.add_docs_bulk(docs)
+    elastic.refresh()
+    builder = LocalIndexBuilder(index_dir, mappings)
+    builder.add_docs_bulk(docs)
+    builder.close()
+    local = LocalIndex(index_dir)
+    diffs = []
+
+    def check(name, res_elastic, res_local):
+        if res_elastic != res_local:
+            diffs.append("{}: elastic={} local={}".format(name, res_elastic, res_local))
+
+    def check_hits(name, hits_elastic, hits_local):
+        check(name + " (hits)", sorted(hits_elastic), sorted(hits_local))
+        for doc_id in set(hits_elastic) & set(hits_local):
+            if not math.isclose(hits_elastic[doc_id], hits_local[doc_id], rel_tol=SCORE_RTOL):
+                check(name + " (score of " + doc_id + ")", hits_elastic[doc_id], hits_local[doc_id])
+
+    doc_ids = [str(doc_id) for doc_id in sorted(docs)]
+    check("num_docs", elastic.num_docs(), local.num_docs())
+    for doc_id in doc_ids:
+        check("term_freqs " + doc_id, elastic.term_freqs(doc_id, field), local.term_freqs(doc_id, field))
+        check("doc_length " + doc_id, elastic.doc_length(doc_id, field), local.doc_length(doc_id, field))
+        check("termvector " + doc_id, {term: {key: stats[key] for key in ["term_freq", "doc_freq", "ttf"]}
+                                       for term, stats in elastic.get_termvector(doc_id, field, True).items()},
+              local.get_termvector(doc_id, field, term_stats=True))
+    positions_elastic = elastic.mterm_positions(doc_ids, field)
+    positions_local = local.mterm_positions(doc_ids, field)
+    check("mterm_positions", {doc_id: {t: sorted(pos) for t, pos in tp.items()}
+                              for doc_id, tp in positions_elastic.items()}, positions_local)
+    check("mterm_freqs", elastic.mterm_freqs(doc_ids, field), local.mterm_freqs(doc_ids, field))
+    for term in sorted(set(t for tp in positions_local.values() for t in tp)):
+        check("doc_freq " + term, elastic.doc_freq(term, field), local.doc_freq(term, field))
+        check("coll_term_freq " + term, elastic.coll_term_freq(term, field), local.coll_term_freq(term, field))
+    for query in TEST_QUERIES:
+        check("analyze_query " + query, elastic.analyze_query(query), local.analyze_query(query))
+        check_hits("search " + query, elastic.search(query, field), local.search(query, field))
+        check("search_scroll " + query, sorted(elastic.search_scroll(query, field)),
+              sorted(local.search_scroll(query, field)))
+    for prof in ["politician", "lawyer", "painter"]:
+        body = {"query": {"bool": {"must": {"term": {prof_field: prof}}}}}
+        check_hits("term " + prof, elastic.search_complex(body, prof_field), local.search_complex(body, prof_field))
+    for phrase in TEST_PHRASES:
+        for person in ["obama", "painter"]:  # as in feat_freq: person term and nationality phrase
+            body = {"query": {"bool": {"must": [{"match": {field: person}},
+                                                {"match_phrase": {field: local.analyze_query(phrase)}}]}}}
+            check_hits("match_phrase " + person + " + " + phrase, elastic.search_complex(body, field),
+                       local.search_complex(body, field))
+        body = {"query": {"match_phrase": {field: phrase}}}
+        check_hits("match_phrase " + phrase, elastic.search_complex(body, field), local.search_complex(body, field))
+    return diffs
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--index_name", help="name of the Elastic test index (overwritten)", type=str,
+                        required=True)
+    parser.add_argument("-d", "--index_dir", help="directory of the local test index (overwritten)", type=str,
+                        required=True)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    diffs = compare_backends(args.index_name, args.index_dir)
+    for diff in diffs:
+        print(diff)
+    assert len(diffs) == 0, "{} differences between Elastic and the local index".format(len(diffs))
+    print("Elastic and the local index give the same results.")
+
+
+if __name__ == "__main__":
+    main(arg_parser())
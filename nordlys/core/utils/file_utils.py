@@ -10,6 +10,7 @@ Utility methods for file handling.
 
 import bz2
 import gzip
+import hashlib
 import json
 import sys
 import os.path as op
@@ -40,6 +41,19 @@ class FileUtils(object):
         with FileUtils.open_file_by_type(filename) as f:
             return [l for l in (line.strip() for line in f) if l]
 
+    @staticmethod
+    def checksum(file_name, block_size=1 << 20):
+        """Returns the MD5 checksum (hex) of the file content.
+
+        :param file_name: name of file
+        :param block_size: number of bytes read at once
+        """
+        md5 = hashlib.md5()
+        with open(op.expanduser(file_name), "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                md5.update(block)
+        return md5.hexdigest()
+
     @staticmethod
     def load_config(config):
         """Loads config file/dictionary.
@@ -5,12 +5,86 @@
 
 import argparse
 import csv
+import heapq
 import json
+import os
+import shutil
+import tempfile
 
 from nordlys.core.wsdmcup_2017.config import *
+from nordlys.core.wsdmcup_2017.feature_matrix import FeatureMatrixBuilder
 from nordlys.core.wsdmcup_2017.wsdmcup_ids import WSDMCupIDs
 
 
+def read_header(file_name):
+    """Returns the header of a feature file, as a list of column names."""
+    with open(file_name, "r") as f:
+        return f.readline().rstrip("\n").split("\t")
+
+
+def read_rows(file_name):
+    """Reads the rows of a feature file (skipping its header line) as (person, item, values) rows, where values are
+    all the columns. The file is opened when the first row is read, and closed when the generator is exhausted or
+    closed.
+
+    :return: row generator
+    """
+    with open(file_name, "r") as f:
+        f.readline()  # header
+        for line in f:
+            values = line.rstrip("\n").split("\t")
+            if len(values) < 2:  # empty line
+                continue
+            yield values[0], values[1], values
+
+
+def is_sorted(file_name):
+    """Checks whether the rows of a feature file are sorted by (person, item)."""
+    last_key = None
+    for person, item, _ in read_rows(file_name):
+        if last_key is not None and (person, item) < last_key:
+            return False
+        last_key = person, item
+    return True
+
+
+def sort_feature_file(file_name, output_file, chunk_size=1000000):
+    """Sorts the rows of a feature file by (person, item) with an external merge sort, keeping the header.
+    The sort is stable, so repeated instances keep their order.
+
+    :param chunk_size: number of rows sorted in memory at once
+    """
+    header, rows = read_header(file_name), read_rows(file_name)
+    run_dir = tempfile.mkdtemp(prefix="sort_", dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        run_files = []
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                run_files.append(_write_run(chunk, run_dir, len(run_files)))
+                chunk = []
+        if chunk or not run_files:
+            run_files.append(_write_run(chunk, run_dir, len(run_files)))
+        runs = [read_rows(run_file) for run_file in run_files]
+        with open(output_file, "w") as f_out:
+            f_out.write("\t".join(header) + "\n")
+            for _, _, values in heapq.merge(*runs, key=lambda row: (row[0], row[1])):
+                f_out.write("\t".join(values) + "\n")
+    finally:
+        shutil.rmtree(run_dir)
+
+
+def _write_run(rows, run_dir, i):
+    """Writes a sorted run of rows (with an empty header) for sort_feature_file."""
+    run_file = os.sep.join([run_dir, "run_{}.tsv".format(i)])
+    with open(run_file, "w") as f:
+        f.write("\n")
+        for _, _, values in sorted(rows, key=lambda row: (row[0], row[1])):
+            f.write("\t".join(values) + "\n")
+    return run_file
+
+
 class AggFeat(object):
     def __init__(self, relation):
         self.__relation = relation
@@ -48,20 +122,112 @@ class AggFeat(object):
                 instances[ins_id] = {"properties": properties, "features": features}
         return instances
 
+    @staticmethod
+    def get_feature_names(feature_files):
+        """Returns the feature names of all the files, in the order of the files and their columns."""
+        feature_names = []
+        for file_name in feature_files:
+            header = read_header(file_name)
+            feature_names += [name for name in header[2:] if name not in feature_names]
+        return feature_names
+
+    def iter_instances(self, feature_files, presorted=False):
+        """Merges the features of all feature files with a k-way merge join over files sorted by (person, item),
+        so that only the current instance of each file is held in memory. As in load_file(), the last row of an
+        instance in a file is kept, and features of later files override those of earlier ones.
+
+        :param feature_files: list of feature files
+        :param presorted: if False, the files which are not sorted are sorted into a temporary directory first
+        :return: generator of (person, item, {feature: value}), sorted by (person, item)
+        """
+        work_dir = None
+        sorted_files = []
+        for file_name in feature_files:
+            if not presorted and not is_sorted(file_name):
+                if work_dir is None:
+                    work_dir = tempfile.mkdtemp(prefix="agg_feat_", dir=os.path.dirname(os.path.abspath(file_name)))
+                print("Sorting file [" + file_name + "] ...")
+                sorted_file = os.sep.join([work_dir, str(len(sorted_files)) + ".tsv"])
+                sort_feature_file(file_name, sorted_file)
+                file_name = sorted_file
+            sorted_files.append(file_name)
+
+        try:
+            readers = []
+            for i, file_name in enumerate(sorted_files):
+                header, rows = read_header(file_name), read_rows(file_name)
+                if header[:2] != ["person", self.__relation]:
+                    raise ValueError("Unexpected header in " + feature_files[i] + ": " + "\t".join(header[:2]))
+                readers.append(self.__tag_rows(rows, header, i, feature_files[i]))
+            key, file_rows = None, {}
+            for row_key, i, features in heapq.merge(*readers):
+                if row_key != key:
+                    if key is not None:
+                        yield key[0], key[1], self.__merge_rows(file_rows)
+                    key, file_rows = row_key, {}
+                file_rows[i] = features  # last row of the file
+            if key is not None:
+                yield key[0], key[1], self.__merge_rows(file_rows)
+        finally:
+            if work_dir is not None:
+                shutil.rmtree(work_dir)
+
+    @staticmethod
+    def __tag_rows(rows, header, i, file_name):
+        """Yields ((person, item), file index, features) rows, checking that they are sorted."""
+        last_key = None
+        for person, item, values in rows:
+            key = person, item
+            if last_key is not None and key < last_key:
+                raise ValueError("File " + file_name + " is not sorted by (person, item)")
+            last_key = key
+            yield key, i, dict(zip(header[2:], values[2:]))
+
+    @staticmethod
+    def __merge_rows(file_rows):
+        features = {}
+        for i in sorted(file_rows):
+            features.update(file_rows[i])
+        return features
+
     def merge_features(self, feature_files):
         """Merges features from all feature files"""
         print("Merging all features ...")
         merged_inss = {}
-        for file in feature_files:
-            instances = self.load_file(file)
-            for ins_id, ins in instances.items():
-                if ins_id not in merged_inss:
-                    merged_inss[ins_id] = ins
-                else:
-                    merged_inss[ins_id]["features"].update(ins["features"])
-                merged_inss.get(ins_id, {}).get("features", {}).update(ins["features"])
+        for person, item, features in self.iter_instances(feature_files):
+            merged_inss[person + "_" + item] = {"properties": {"person": person, self.__relation: item},
+                                                "features": features}
         return merged_inss
 
+    def gen_feature_matrix(self, feature_files, matrix_dir, train=False):
+        """Merges features from all feature files into a feature matrix (see feature_matrix), streaming the merged
+        instances to disk.
+
+        :param feature_files: list of feature files
+        :param matrix_dir: output directory
+        :param train: if True, only the instances in the train file are kept, with their labels in a "target" column
+        """
+        feature_names = self.get_feature_names(feature_files)
+        columns = {name: j for j, name in enumerate(feature_names)}
+        train_labels = self.load_train_labels() if train else None
+        builder = FeatureMatrixBuilder(matrix_dir, self.__relation, feature_names + (["target"] if train else []))
+        found = set()
+        for person, item, features in self.iter_instances(feature_files):
+            if train:
+                target = train_labels.get(person + "_" + item)
+                if target is None:
+                    continue
+                found.add(person + "_" + item)
+            values = [float("nan")] * len(feature_names)
+            for name, val in features.items():
+                values[columns[name]] = float(val) if val != "" else float("nan")
+            builder.add(person, item, values + ([float(target)] if train else []))
+        builder.close()
+        if train:
+            for ins_id in train_labels:
+                if ins_id not in found:
+                    print("WARNING: instance id " + ins_id + "does not exists!")
+
     def gen_train_inss(self, merged_inss):
         """Generates instances in the train file."""
         print("Generating train instances ...")
@@ -82,6 +248,8 @@ def arg_parser():
     parser.add_argument("-t", "--train", help="creates train instances", action="store_true", default=False)
     parser.add_argument("-f", "--feature_files", help="run files, separated with space", nargs="+")
     parser.add_argument("-r", "--relation", help="output file", type=str)
+    parser.add_argument("-m", "--matrix", help="writes a feature matrix instead of json instances",
+                        action="store_true", default=False)
     args = parser.parse_args()
     return args
 
@@ -111,6 +279,14 @@ def main(args):
     if args.feature_files is None:
         args.feature_files = set_feature_files(args.relation)
     merger = AggFeat(args.relation)
+    if args.matrix:
+        if args.relation == REL_PROFESSION:
+            output_dir = PROFESSION_MATRIX_TRAIN if args.train else PROFESSION_MATRIX_ALL
+        else:
+            output_dir = NATIONALITY_MATRIX_TRAIN if args.train else NATIONALITY_MATRIX_ALL
+        merger.gen_feature_matrix(args.feature_files, output_dir, args.train)
+        print("Output directory:", output_dir)
+        return
     merged_inss = merger.merge_features(args.feature_files)
     if args.train:
         train_inss = merger.gen_train_inss(merged_inss)
@@ -52,6 +52,8 @@ PROFESSIONS_IDS_F = sep.join([DATA_DIR, "professions_ids.tsv"])
 NATIONALITIES_IDS_F = sep.join([DATA_DIR, "nationalities_ids.tsv"])
 PROFESSION_TRANSLATIONS_F = sep.join([DATA_DIR, "profession_translations.kb"])
 COUNTRIES_NATIONALITIES_F = sep.join([DATA_DIR, "nationality_adjectives.tsv"])
+NATIONALITY_TRANSLATIONS_F = sep.join([DATA_DIR, "nationality_translations.kb"])  # person_id, nat_id, noun, adj
+NATIONALITY_TRANSLATIONS2_F = sep.join([DATA_DIR, "nationality_translations2.kb"])  # person, + the columns above
 #
 FIRST_WP_ST_F = sep.join([FIRST_WP_ST_DIR, "first_wp_sentences.txt"])  # first WP sentences
 FIRST_WP_PG_F = sep.join([FIRST_WP_ST_DIR, "first_wp_paragraphs.txt"])  # first WP paragraphs
@@ -65,6 +67,12 @@ PROF_W2V_AGGR_COS_SIM_F = sep.join([FEATURES_DIR, "profession_w2v_aggr_cos_sim.t
 #  Indices
 WP_ST_INDEX = "wsdmcup17_wp_sentences_prof"
 WP_ST_INDEX_ID = "wsdmcup17_wp_sentences_prof_id"
+WP_ST_LOCAL_INDEX_DIR = sep.join([DATA_DIR, "wp_sentences_index"])  # local (in-process) index of WP_ST_F
+WP_ST_TF_MATRIX_DIR = sep.join([DATA_DIR, "wp_sentences_tf"])  # sentence x term matrix of WP_ST_F
+PERSON_SENTENCES_DIR = sep.join([DATA_DIR, "person_sentences"])  # person id -> sentence doc ids postings
+PERSON_TF_DIR = sep.join([DATA_DIR, "person_tf"])  # aggregated TF of each person over their sentences
+W2V_MATRIX_DIR = sep.join([DATA_DIR, "w2v_matrix"])  # word2vec vectors of the needed vocabulary
+W2V_CENTROIDS_DIR = sep.join([DATA_DIR, "w2v_centroids"])  # profession w2v vectors (see feat_w2v_sim)
 
 # -----------
 #  Data items utils
@@ -83,9 +91,25 @@ NATIONALITY_INSS_TRAIN = sep.join([DATA_DIR, "nationality_train.json"])
 PROFESSION_INSS_ALL = sep.join([DATA_DIR, "profession_all.json"])
 NATIONALITY_INSS_ALL = sep.join([DATA_DIR, "nationality_all.json"])
 
+# feature matrices (see feature_matrix.py)
+PROFESSION_MATRIX_TRAIN = sep.join([DATA_DIR, "profession_train_matrix"])
+NATIONALITY_MATRIX_TRAIN = sep.join([DATA_DIR, "nationality_train_matrix"])
+
+PROFESSION_MATRIX_ALL = sep.join([DATA_DIR, "profession_all_matrix"])
+NATIONALITY_MATRIX_ALL = sep.join([DATA_DIR, "nationality_all_matrix"])
+
 PROFESSION_MODEL = sep.join([DATA_DIR, "profession.model"])
 NATIONALITY_MODEL = sep.join([DATA_DIR, "nationality.model"])
 
+# models compiled into flat forests (see flat_forest.py)
+PROFESSION_FLAT_MODEL = sep.join([DATA_DIR, "profession_flat_model"])
+NATIONALITY_FLAT_MODEL = sep.join([DATA_DIR, "nationality_flat_model"])
+
+# -----------
+# Pipeline
+
+PIPELINE_STATE_F = sep.join([DATA_DIR, "pipeline_state.json"])  # fingerprints of the last run of each stage
+
 # -----------
 # Miscellaneous
 
@@ -32,6 +32,8 @@ import os
 import re
 import sys
 
+import numpy as np
+
 
 def read_files(filename1, filename2):
     """ Read the two files and check that they adhere to the formatting rules
@@ -118,52 +120,96 @@ def kendall_tau(scores1, scores2, p = 0.5):
     http://www.cs.uiuc.edu/class/fa05/cs591han/sigmodpods04/pods/pdf/P-06.pdf .
     In the test case below, there are three pairs, all transposed.
 
+    Only the order of the scores matters, so instead of enumerating all the
+    pairs, the pairs are counted from the joint count table of the two score
+    lists (see kendall_tau_counts), in O(n + #distinct scores^2).
+
     >>> kendall_tau([1, 2, 3], [6, 5, 4])
     1.0
     """
 
     if len(scores1) == 1:
         return 0.0
-    # The ranks of the scores. Equal 
-    ranks1 = kendall_tau_ranks(scores1)
-    ranks2 = kendall_tau_ranks(scores2)
-    # All possible pairs i, j with i < j.
-    pairs = itertools.combinations(range(0, len(scores1)), 2)
-    penalty = 0.0
-    # Count the number of pairs in the second list (the ground truth), where
-    # pairs with equal scores count only p (default 0.5, see above).
-    num_ordered = 0.0
-    for i, j in pairs:
-        # The ranks of scores i and j in both score lists.
-        a_i = ranks1[i]
-        a_j = ranks1[j]
-        b_i = ranks2[i]
-        b_j = ranks2[j]
-        # CASE 1: Scores i and j are different in both lists. Then there is a
-        # penalty of 1.0 iff the order does not match.
-        if a_i != a_j and b_i != b_j:
-            if (a_i < a_j and b_i < b_j) or (a_i > a_j and b_i > b_j):
-                pass
-            else:
-                penalty += 1
-        # CASE 2: Scores i and j are the same in both lists. Then there is no
-        # penalty.
-        elif a_i == a_j and b_i == b_j:
-            pass
-        # CASE 3: Scores i and j are the same in one list, but different in the
-        # other. Then there is a penalty of p (default value 0.5, see above).
-        else:
-            penalty += p
-        # Count this pair as 1 if the scores in list 2 are different, otherwise
-        # as p (default value 0.5, see above).
-        if b_i != b_j:
-            num_ordered += 1
-        else:
-            num_ordered += p
-    # Return the average penalty.
+    # Table of counts of the (score1, score2) combinations, with the distinct
+    # scores of each list in increasing order.
+    values1 = {s: i for i, s in enumerate(sorted(set(scores1)))}
+    values2 = {s: i for i, s in enumerate(sorted(set(scores2)))}
+    table = [[0] * len(values2) for _ in values1]
+    for s1, s2 in zip(scores1, scores2):
+        table[values1[s1]][values2[s2]] += 1
+    return kendall_tau_counts(table, p)
+
+
+def kendall_tau_counts(table, p = 0.5):
+    """ Compute the p-normalized Kendall Tau (see kendall_tau) from the joint
+    count table of two score lists: table[a][b] is the number of items with
+    the a-th smallest score in the first list and the b-th smallest score in
+    the second list. The test case is kendall_tau([1, 2, 3], [6, 5, 4]).
+
+    >>> kendall_tau_counts([[0, 0, 1], [0, 1, 0], [1, 0, 0]])
+    1.0
+    """
+
+    num_rows, num_cols = len(table), len(table[0])
+    # below[a][b] = number of items with a larger score in the first list and
+    # a smaller score in the second list than the items of table[a][b].
+    below = [[0] * num_cols for _ in range(num_rows)]
+    for a in range(num_rows - 2, -1, -1):
+        prefix = 0
+        for b in range(num_cols):
+            below[a][b] = below[a + 1][b] + prefix
+            prefix += table[a + 1][b]
+    # Pairs ordered differently in the two lists (penalty 1.0), pairs with
+    # equal scores in the first list, in the second list, and in both.
+    discordant = sum(table[a][b] * below[a][b]
+                     for a in range(num_rows) for b in range(num_cols))
+    tied1 = sum(n * (n - 1) // 2 for n in (sum(row) for row in table))
+    tied2 = sum(n * (n - 1) // 2 for n in (sum(col) for col in zip(*table)))
+    tied_both = sum(n * (n - 1) // 2 for row in table for n in row)
+    num = sum(sum(row) for row in table)
+    num_pairs = num * (num - 1) // 2
+    # Scores equal in one list but not in the other have a penalty of p; pairs
+    # with equal scores in the second list (the ground truth) count only p.
+    penalty = discordant + p * (tied1 + tied2 - 2 * tied_both)
+    num_ordered = (num_pairs - tied2) + p * tied2
     return penalty / num_ordered
 
 
+def kendall_tau_groups(scores1, scores2, groups, num_groups, p = 0.5):
+    """ Compute the p-normalized Kendall Tau (see kendall_tau) of many groups
+    at once, with NumPy. The scores must be integers from the range [0..7];
+    groups[i] is the group (from the range [0..num_groups-1]) of the scores
+    scores1[i] and scores2[i]. Returns an array with the tau of each group
+    (0.0 for single-element groups).
+
+    >>> kendall_tau_groups([1, 2, 3, 1], [6, 5, 4, 4], [0, 0, 0, 1], 2).tolist()
+    [1.0, 0.0]
+    """
+
+    scores1 = np.asarray(scores1, dtype=np.int64)
+    scores2 = np.asarray(scores2, dtype=np.int64)
+    groups = np.asarray(groups, dtype=np.int64)
+    # The 8 x 8 count table of each group (see kendall_tau_counts).
+    tables = np.bincount(groups * 64 + scores1 * 8 + scores2,
+                         minlength=num_groups * 64).reshape(num_groups, 8, 8)
+    suffix = np.zeros_like(tables)
+    suffix[:, :-1, :] = np.cumsum(tables[:, :0:-1, :], axis=1)[:, ::-1, :]
+    below = np.zeros_like(tables)
+    below[:, :, 1:] = np.cumsum(suffix[:, :, :-1], axis=2)
+    discordant = (tables * below).sum(axis=(1, 2))
+    rows, cols = tables.sum(axis=2), tables.sum(axis=1)
+    tied1 = (rows * (rows - 1) // 2).sum(axis=1)
+    tied2 = (cols * (cols - 1) // 2).sum(axis=1)
+    tied_both = (tables * (tables - 1) // 2).sum(axis=(1, 2))
+    num = rows.sum(axis=1)
+    num_pairs = num * (num - 1) // 2
+    penalty = discordant + p * (tied1 + tied2 - 2 * tied_both)
+    num_ordered = (num_pairs - tied2) + p * tied2
+    taus = np.zeros(num_groups)
+    np.divide(penalty, num_ordered, out=taus, where=num > 1)
+    return taus
+
+
 def compute_acc(scores1, scores2, delta = 2):
     """ Compute the accuray = the percentage of scores (as a float from [0,1])
     that differ by at most the given delta. If the two score arrays have
@@ -202,6 +248,29 @@ def compute_asd(scores1, scores2):
     return sum_difference / num_all
 
 
+def is_score_groups(scores1, scores2):
+    """ Check that the two score arrays have groups of equal lengths, with
+    scores that are all integers from the range [0..7] (as required by
+    kendall_tau_groups).
+
+    >>> is_score_groups([[1, 2], [7]], [[0, 3], [4]])
+    True
+    >>> is_score_groups([[1.2, 1.7, 1.5]], [[1, 3, 2]])
+    False
+    """
+
+    if len(scores1) == 0 or len(scores1) != len(scores2) or \
+            any(len(g1) != len(g2) for g1, g2 in zip(scores1, scores2)):
+        return False
+    try:
+        flat = np.array([s for group in itertools.chain(scores1, scores2)
+                         for s in group], np.float64)
+    except (TypeError, ValueError):
+        return False
+    return len(flat) > 0 and bool(np.all((flat == np.round(flat)) &
+                                         (flat >= 0) & (flat <= 7)))
+
+
 def compute_tau(scores1, scores2):
     """ Compute the average p-normalited Kendall tau. If the two score arrays have
     different lengths of contain numbers that are not integers in the range
@@ -213,6 +282,14 @@ def compute_tau(scores1, scores2):
     """
 
     num_groups = len(scores1)
+    if is_score_groups(scores1, scores2):
+        lengths = [len(group) for group in scores1]
+        groups = np.repeat(np.arange(num_groups), lengths)
+        flat1 = np.array(list(itertools.chain.from_iterable(scores1)), np.int64)
+        flat2 = np.array(list(itertools.chain.from_iterable(scores2)), np.int64)
+        taus = kendall_tau_groups(flat1, flat2, groups, num_groups)
+        # Summed one after the other, as in the loop below.
+        return float(np.cumsum(taus)[-1]) / num_groups
     sum_tau = 0
     for group1, group2 in zip(scores1, scores2):
         sum_tau += kendall_tau(group1, group2)
@@ -4,9 +4,24 @@ Generating features of freq-person-nationality
 @author Shuo Zhang
 """
 
-from nordlys.core.retrieval.elastic_cache import ElasticCache
+from nordlys.core.retrieval.local_index import open_index
 from nordlys.core.utils.file_utils import FileUtils
 from nordlys.core.wsdmcup_2017.config import WP_ST_INDEX_ID
+from nordlys.core.wsdmcup_2017.person_sentences import PersonSentences
+
+
+def contains_phrase(term_positions, terms):
+    """Checks whether the terms occur at consecutive positions (as in match_phrase queries).
+
+    :param term_positions: analyzed sentence, {term: set of positions}
+    :param terms: analyzed phrase, list of terms
+    """
+    if len(terms) == 0:
+        return False
+    positions = [term_positions.get(term) for term in terms]
+    if None in positions:
+        return False
+    return any(all(start + i in positions[i] for i in range(1, len(terms))) for start in positions[0])
 
 
 class FeaturesTermStats():
@@ -16,18 +31,80 @@ class FeaturesTermStats():
         "into", "is", "it", "no", "not", "of", "on", "or", "such", "that", "the",
         "their", "then", "there", "these", "they", "this", "to", "was", "will", "with"]
 
-    def __init__(self, index_name=WP_ST_INDEX_ID):
-        self.__elastic = ElasticCache(index_name)
+    def __init__(self, index_name=WP_ST_INDEX_ID, local_index_dir=None, person_sentences_dir=None,
+                 local_cooccurrence=False):
+        """
+        :param local_cooccurrence: if True, the analyzed sentences of each person are fetched once and nationality
+            phrases are matched locally, instead of sending phrase queries for each (person, nationality) pair
+        """
+        self.__elastic = open_index(index_name, local_index_dir)
+        self.__person_sentences = PersonSentences(person_sentences_dir) if person_sentences_dir else None
+        self.__local_cooccurrence = local_cooccurrence
         self.__stats = None
+        self.__phrases = {}  # cache of analyzed nationality phrases
+        self.__last_person = (None, None)  # analyzed sentences of the last person
+
+    def __get_person_doc_ids(self, person_id):
+        """Returns the ids of sentences containing person (at most 10,000, unless postings are available)."""
+        if self.__person_sentences:
+            return self.__person_sentences.get_sentences(person_id)
+        body = {
+            "query": {
+                "bool": {
+                    "must": {
+                        "term": {"content": person_id}
+                    }
+                }
+            }
+        }
+        return list(self.__elastic.search_complex(body, self.CONTENT_FIELD, num=10000).keys())
+
+    def __get_analyzed_sentences(self, person_id):
+        """Returns the analyzed sentences containing person, as a list of {term: set of positions}.
+        Sentences are fetched once per person, as the nationalities of a person are in consecutive .kb lines.
+        """
+        if self.__last_person[0] != person_id:
+            positions = self.__elastic.mterm_positions(self.__get_person_doc_ids(person_id), self.CONTENT_FIELD)
+            sentences = [{term: set(term_pos) for term, term_pos in sent.items()} for sent in positions.values()]
+            self.__last_person = person_id, sentences
+        return self.__last_person[1]
+
+    def __get_phrase(self, text):
+        """Returns the analyzed phrase (list of terms); phrases are analyzed once for the whole run."""
+        if text not in self.__phrases:
+            self.__phrases[text] = self.__elastic.analyze_query(text).split()
+        return self.__phrases[text]
+
+    def get_per_nat_tf_local(self, person_id, nats):
+        """Computes freqPerNat, by matching the nationality phrases in the analyzed sentences of the person.
+
+        :param person_id:
+        :param nats: nationality+adj, e.g. Germany, German
+        :return: freqPerNat of noun and adj
+        """
+        sentences = self.__get_analyzed_sentences(person_id)
+        n_s_pe = len(sentences)  # number of sentences containing person
+        if n_s_pe == 0:
+            return 0.0, 0.0
+        noun_terms, adj_terms = self.__get_phrase(nats[0]), self.__get_phrase(nats[1])
+        n_co_noun = sum(1 for sent in sentences if contains_phrase(sent, noun_terms))
+        n_co_adj = sum(1 for sent in sentences if contains_phrase(sent, adj_terms))
+        return n_co_noun / n_s_pe, n_co_adj / n_s_pe
 
     def get_per_nat_tf(self, person_id, nats):
         """
         Compute freqPerNat: \frac{|\{s : pe \in s, nt \in s\}|}{|S(pe)|}
+        Sentences are counted with queries of at most 10,000 hits, for both S(pe) and co-occurrences. If person-sentence
+        postings are available, co-occurrences are counted in the (uncapped) sentences of the postings instead, as in
+        get_per_nat_tf_local, so that both counts come from the same sentences.
         :param person_id:
         :param nats: nationality+adj, e.g. Germany, German
         :return: freqPerNat
         """
 
+        if self.__person_sentences:
+            return self.get_per_nat_tf_local(person_id, nats)
+
         body = {
             "query": {
                 "bool": {
@@ -107,7 +184,10 @@ class FeaturesTermStats():
                 values_noun = [person_id, nat_id]
                 values_adj = [person_id, nat_id]
                 nats = [noun, adj]
-                fpn_noun, fpn_adj = self.get_per_nat_tf(person_id, nats)
+                if self.__local_cooccurrence:
+                    fpn_noun, fpn_adj = self.get_per_nat_tf_local(person_id, nats)
+                else:
+                    fpn_noun, fpn_adj = self.get_per_nat_tf(person_id, nats)
                 values_noun.append(str(fpn_noun))
                 values_adj.append(str(fpn_adj))
                 fout1.write("\t".join(values_noun) + "\n")
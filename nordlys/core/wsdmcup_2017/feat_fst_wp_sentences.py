@@ -1,25 +1,30 @@
 """Implements features about 1st Wikipedia sentences.
 
+``is_{relation}_in_*`` is 1 if the item occurs (as whole words) in the snippet of the person, and
+``is_1st_{relation}_in_*`` is 1 if the item is the first one occurring in the snippet (the longest one, if several
+items start at the same position).
+
 @author: Dario Garigliotti
 """
 
 import os
-import re
 
 from nordlys.core.utils.file_utils import FileUtils
 from nordlys.core.wsdmcup_2017.config import *  # we know this module so no danger, but be careful ;)
+from nordlys.core.wsdmcup_2017.snippet_matcher import SnippetMatcher
 from nordlys.core.wsdmcup_2017.wsdmcup_ids import WSDMCupIDs
 
 OUTPUT_DIR = os.path.expanduser("~/")
 
 
-def main(all_items_fpath, first_snippets_fpath, person_items_fpath, relation):
+def main(all_items_fpath, first_snippets_fpath, person_items_fpath, relation, output_dir=OUTPUT_DIR):
     """Extracts features about 1st Wikipedia sentences and paragraphs.
 
     :param all_items_fpath: path to the file with all items (e.g. 'professions' named file).
     :param first_snippets_fpath:path to the file with first snippets.
     :param person_items_fpath: path to the file with person items (a '.kb'-extension file).
     :param relation: a string in {REL_PROFESSION, REL_NATIONALITY}.
+    :param output_dir: directory of the output tsv files.
     :return:
     """
 
@@ -37,38 +42,16 @@ def main(all_items_fpath, first_snippets_fpath, person_items_fpath, relation):
         persons_snippets[person] = snippet
     print("\t Loaded snippets... OK.")
 
-    # Make dict: person to set of (all possible) items in snippet
+    # Make dicts: person to set of (all possible) items in snippet, and person to first item in snippet
+    # A single scan of each snippet finds all the items, with their first occurrence
+    matcher = SnippetMatcher(all_rel_items)
     person_to_all_snippet_items = {}
-    # person_counter = 0
-    for person, snippet in persons_snippets.items():
-        for item in all_rel_items:
-            # important to lowercase when searching for item
-            match = re.search(r"[,\s\.]({})[,\s\.]".format(item.lower()), snippet)
-            if match:
-                person_to_all_snippet_items.get(person, set()).add(item)
-    print("\t Made 1st dict... OK.")
-
-    # Make dict: person to first item in snippet (among all possible items)
     person_to_first_snippet_item = {}
-    # person_counter = 0
     for person, snippet in persons_snippets.items():
-        fst_item_index = len(snippet) - 1
-        fst_item = ""
-        for item in person_to_all_snippet_items.get(person, set()):
-            # in this case, we use re.search() since we need the string index where the found occurrence starts
-            # important to lowercase when searching for item
-            match = re.search(r"[,\s\.]({})[,\s\.]".format(item.lower()), snippet)
-            if match:
-                # item (e.g. profession) occurs not only as substring, but all its words (sometimes it's multiword)
-                # appear as words in snippet
-                # otherwise, it will count, e.g., "orator" as a profession when it's only a substring of "oratorio"
-                item_index = match.start(1)
-                if item_index < fst_item_index:
-                    fst_item_index = item_index
-                    fst_item = item
-
-        person_to_first_snippet_item[person] = fst_item
-    print("\t Made 2nd dict... OK.")
+        item_positions = matcher.match(snippet)
+        person_to_all_snippet_items[person] = set(item_positions)
+        person_to_first_snippet_item[person] = matcher.first(item_positions)
+    print("\t Made 1st and 2nd dicts... OK.")
 
     # Make final feature mappings
     is_item_in = {}  # e.g. person-to-profession-to-yes_or_no mapping
@@ -83,7 +66,7 @@ def main(all_items_fpath, first_snippets_fpath, person_items_fpath, relation):
 
         if person not in is_1st_item_in:
             is_1st_item_in[person] = {}
-        feat_value = "1" if item in person_to_first_snippet_item.get(person, set()) else "0"
+        feat_value = "1" if item == person_to_first_snippet_item.get(person) else "0"
         is_1st_item_in[person][item] = feat_value
 
     print("\t Main for-loop running... OK.")
@@ -93,14 +76,14 @@ def main(all_items_fpath, first_snippets_fpath, person_items_fpath, relation):
     persons_snippets.clear()
     wcup_ids = WSDMCupIDs()
 
-    with open(os.sep.join([OUTPUT_DIR,
+    with open(os.sep.join([output_dir,
                            "is_{}_in_{}.tsv".format(relation, snippet_basename)]), "w") as f_is_item_in:
         f_is_item_in.write("person\t{}\tis_{}_in_{}\n".format(relation, relation, snippet_basename))
         for person, item_val in sorted(is_item_in.items()):
             for item, val in sorted(item_val.items()):
                 f_is_item_in.write("{}\t{}\t{}\n".format(wcup_ids.get_id_from_person(person),
                                                          wcup_ids.get_id_from_prof(item), val))
-    with open(os.sep.join([OUTPUT_DIR,
+    with open(os.sep.join([output_dir,
                            "is_1st_{}_in_{}.tsv".format(relation, snippet_basename)]), "w") as f_is_item_in:
         f_is_item_in.write("person\t{}\tis_the_1st_{}_in_{}\n".format(relation, relation, snippet_basename))
         for person, item_val in sorted(is_1st_item_in.items()):
@@ -1,28 +1,30 @@
 """Implements features about 1st Wikipedia sentences.
 
+For both the nationality nouns and adjectives, ``is_{relation}_in_*`` is 1 if the item occurs (as whole words) in the
+snippet of the person, and ``is_1st_{relation}_in_*`` is 1 if the item is the first one occurring in the snippet (the
+longest one, if several items start at the same position).
+
 @author: Shuo Zhang
 """
 
 import os
-import re
-import json
-
-import pprint
 
 from nordlys.core.utils.file_utils import FileUtils
 from nordlys.core.wsdmcup_2017.config import *
+from nordlys.core.wsdmcup_2017.snippet_matcher import SnippetMatcher
 from nordlys.core.wsdmcup_2017.wsdmcup_ids import WSDMCupIDs
 
 OUTPUT_DIR = os.path.expanduser("features")
 
 
-def main(all_items_fpath, first_snippets_fpath, person_items_fpath, relation):
+def main(all_items_fpath, first_snippets_fpath, person_items_fpath, relation, output_dir=OUTPUT_DIR):
     """Extracts features about 1st Wikipedia sentences and paragraphs.
 
         :param all_items_fpath: path to the file with all items (e.g. 'nationality' named file).
         :param first_snippets_fpath:path to the file with first snippets.
         :param person_items_fpath: path to the file with person items (a '.kb'-extension file).
         :param relation: a string in {REL_PROFESSION, REL_NATIONALITY}.
+        :param output_dir: directory of the output tsv files.
         :return:
         """
     snippet_basename = os.path.basename(first_snippets_fpath).split(".txt")[0]  # for creating dump filename
@@ -49,109 +51,48 @@ def main(all_items_fpath, first_snippets_fpath, person_items_fpath, relation):
         persons_snippets[person] = snippet
 
     print("\t Loaded snippets... OK.")
-    person_to_all_snippet_items_adj = {}
-    for person, snippet in persons_snippets.items():
-        # print(snippet)
-        for item in adj:
-            # important to lowercase when searching for item
-            match = re.search(r"[,\s\.]({})[,\s\.]".format(item.lower()), snippet.lower())
-            if match:
-                if person not in person_to_all_snippet_items_adj.keys():
-                    person_to_all_snippet_items_adj[person] = []
-                    person_to_all_snippet_items_adj[person].append(item)
-                else:
-                    person_to_all_snippet_items_adj[person].append(item)
-
-    print("\t Made 1st dict... OK.")
-
-    # Make dict: person to set of (all possible) items in snippet
+
+    # Make dicts: person to all items and to first item in snippet, for nouns and adjectives
+    # A single scan of each (lowercased) snippet finds both nouns and adjectives, with their first occurrence
+    matcher = SnippetMatcher(set(noun) | set(adj))
+    noun_set, adj_set = set(noun), set(adj)
     person_to_all_snippet_items_noun = {}
-    for person, snippet in persons_snippets.items():
-        for item in noun:
-            # important to lowercase when searching for item
-            match = re.search(r"[,\s\.]({})[,\s\.]".format(item.lower()), snippet.lower())
-            if match:
-                if person not in person_to_all_snippet_items_noun.keys():
-                    person_to_all_snippet_items_noun[person] = []
-                    person_to_all_snippet_items_noun[person].append(item)
-                else:
-                    person_to_all_snippet_items_noun[person].append(item)
-
-    # Make dict: person to first item in snippet (among all possible items)
+    person_to_all_snippet_items_adj = {}
     person_to_first_snippet_item_noun = {}
-    for person, snippet in persons_snippets.items():
-        fst_item_index = len(snippet) - 1
-        fst_item = ""
-        for item in person_to_all_snippet_items_noun.get(person, []):
-            # in this case, we use re.search() since we need the string index where the found occurrence starts
-            # important to lowercase when searching for item
-            match = re.search(r"[,\s\.]({})[,\s\.]".format(item.lower()), snippet.lower())
-            if match:
-                # item (e.g. profession) occurs not only as substring, but all its words (sometimes it's multiword)
-                # appear as words in snippet
-                # otherwise, it will count "orator" as a profession when it's only a substring of "oratorio"
-                item_index = match.start(1)
-                if item_index < fst_item_index:
-                    fst_item_index = item_index
-                    fst_item = item
-
-        person_to_first_snippet_item_noun[person] = fst_item
-    print("\t Made 2nd dict... OK.")
-
-    # Make dict: person to first item in snippet (among all possible items)
     person_to_first_snippet_item_adj = {}
     for person, snippet in persons_snippets.items():
-        fst_item_index = len(snippet) - 1
-        fst_item = ""
-        for item in person_to_all_snippet_items_adj.get(person, []):
-            # in this case, we use re.search() since we need the string index where the found occurrence starts
-            # important to lowercase when searching for item
-            match = re.search(r"[,\s\.]({})[,\s\.]".format(item.lower()), snippet.lower())
-            if match:
-                # item (e.g. profession) occurs not only as substring, but all its words (sometimes it's multiword)
-                # appear as words in snippet
-                # otherwise, it will count "orator" as a profession when it's only a substring of "oratorio"
-                item_index = match.start(1)
-                if item_index < fst_item_index:
-                    fst_item_index = item_index
-                    fst_item = item
-
-        person_to_first_snippet_item_adj[person] = fst_item
-    print("\t Made 2nd dict... OK.")
-
-    # Make final feature mappings
-    is_item_in_noun = {}  # e.g. person-to-profession-to-yes_or_no mapping
-    is_1st_item_in_noun = {}  # e.g. person-to-profession-to-yes_or_no mapping
-    for line in FileUtils.read_file_as_list(person_items_fpath):
-        person, _, _, item, _ = line.strip().split("\t")
-
-        if person not in is_item_in_noun:
-            is_item_in_noun[person] = {}
-        feat_value = "1" if item in person_to_all_snippet_items_noun.get(person, []) else "0"
-        is_item_in_noun[person][item] = feat_value
-
-        if person not in is_1st_item_in_noun:
-            is_1st_item_in_noun[person] = {}
-        feat_value = "1" if item in person_to_first_snippet_item_noun.get(person, []) else "0"
-        is_1st_item_in_noun[person][item] = feat_value
-
-    print("\t Main for was ran... OK.")
-
-    # Make final feature mappings
-    is_item_in_adj = {}  # e.g. person-to-profession-to-yes_or_no mapping
-    is_1st_item_in_adj = {}  # e.g. person-to-profession-to-yes_or_no mapping
-    for line in FileUtils.read_file_as_list(person_items_fpath):
-        person, _, _, nat, item = line.strip().split("\t")
-
-        if person not in is_item_in_adj:
-            is_item_in_adj[person] = {}
-        feat_value = "1" if item in person_to_all_snippet_items_adj.get(person, []) else "0"
-        is_item_in_adj[person][nat] = feat_value
-
-        if person not in is_1st_item_in_adj:
-            is_1st_item_in_adj[person] = {}
-        feat_value = "1" if item in person_to_first_snippet_item_adj.get(person, []) else "0"
-        is_1st_item_in_adj[person][nat] = feat_value
+        # important to lowercase when searching for item
+        item_positions = matcher.match(snippet.lower())
+        noun_positions = {item: pos for item, pos in item_positions.items() if item in noun_set}
+        adj_positions = {item: pos for item, pos in item_positions.items() if item in adj_set}
+        person_to_all_snippet_items_noun[person] = set(noun_positions)
+        person_to_all_snippet_items_adj[person] = set(adj_positions)
+        person_to_first_snippet_item_noun[person] = matcher.first(noun_positions)
+        person_to_first_snippet_item_adj[person] = matcher.first(adj_positions)
+    print("\t Made 1st and 2nd dicts... OK.")
+
+    # Make final feature mappings, in a single pass over the .kb file
+    is_item_in_noun = {}  # e.g. person-to-nationality-to-yes_or_no mapping
+    is_1st_item_in_noun = {}  # e.g. person-to-nationality-to-yes_or_no mapping
+    is_item_in_adj = {}
+    is_1st_item_in_adj = {}
+    with FileUtils.open_file_by_type(person_items_fpath) as f:
+        for line in f:
+            if len(line.strip()) == 0:
+                continue
+            person, _, _, nat, item_adj = line.strip().split("\t")
+
+            if person not in is_item_in_noun:
+                is_item_in_noun[person] = {}
+                is_1st_item_in_noun[person] = {}
+                is_item_in_adj[person] = {}
+                is_1st_item_in_adj[person] = {}
+            is_item_in_noun[person][nat] = "1" if nat in person_to_all_snippet_items_noun.get(person, set()) else "0"
+            is_1st_item_in_noun[person][nat] = "1" if nat == person_to_first_snippet_item_noun.get(person) else "0"
+            is_item_in_adj[person][nat] = "1" if item_adj in person_to_all_snippet_items_adj.get(person, set()) \
+                else "0"
+            is_1st_item_in_adj[person][nat] = "1" if item_adj == person_to_first_snippet_item_adj.get(person) \
+                else "0"
 
     print("\t Main for was ran... OK.")
 
@@ -161,14 +102,14 @@ def main(all_items_fpath, first_snippets_fpath, person_items_fpath, relation):
     persons_snippets.clear()
     wcup_ids = WSDMCupIDs()
 
-    with open(os.sep.join([OUTPUT_DIR,
+    with open(os.sep.join([output_dir,
                            "is_{}_in_{}_Noun.tsv".format(relation, snippet_basename)]), "w") as f_is_item_in:
         f_is_item_in.write("person\t{}\tis_{}_in_{}_noun\n".format(relation, relation, snippet_basename))
         for person, item_val in sorted(is_item_in_noun.items()):
             for item, val in sorted(item_val.items()):
                 f_is_item_in.write("{}\t{}\t{}\n".format(wcup_ids.get_id_from_person(person),
                                                          wcup_ids.get_id_from_nation(item), val))
-    with open(os.sep.join([OUTPUT_DIR,
+    with open(os.sep.join([output_dir,
                            "is_1st_{}_in_{}_Noun.tsv".format(relation, snippet_basename)]), "w") as f_is_item_in:
         f_is_item_in.write("person\t{}\tis_the_1st_{}_in_{}_noun\n".format(relation, relation, snippet_basename))
         for person, item_val in sorted(is_1st_item_in_noun.items()):
@@ -176,14 +117,14 @@ def main(all_items_fpath, first_snippets_fpath, person_items_fpath, relation):
                 f_is_item_in.write("{}\t{}\t{}\n".format(wcup_ids.get_id_from_person(person),
                                                          wcup_ids.get_id_from_nation(item), val))
 
-    with open(os.sep.join([OUTPUT_DIR,
+    with open(os.sep.join([output_dir,
                            "is_{}_in_{}_Adj.tsv".format(relation, snippet_basename)]), "w") as f_is_item_in:
         f_is_item_in.write("person\t{}\tis_{}_in_{}_adj\n".format(relation, relation, snippet_basename))
         for person, item_val in sorted(is_item_in_adj.items()):
             for item, val in sorted(item_val.items()):
                 f_is_item_in.write("{}\t{}\t{}\n".format(wcup_ids.get_id_from_person(person),
                                                          wcup_ids.get_id_from_nation(item), val))
-    with open(os.sep.join([OUTPUT_DIR,
+    with open(os.sep.join([output_dir,
                            "is_1st_{}_in_{}_Adj.tsv".format(relation, snippet_basename)]), "w") as f_is_item_in:
         f_is_item_in.write("person\t{}\tis_the_1st_{}_in_{}_adj\n".format(relation, relation, snippet_basename))
         for person, item_val in sorted(is_1st_item_in_adj.items()):
@@ -5,11 +5,14 @@ Generating features related to term statistics
 @author Shuo Zhang
 """
 
-from nordlys.core.retrieval.elastic_cache import ElasticCache
+import argparse
 from nordlys.core.utils.file_utils import FileUtils
 from math import sqrt
 
+import numpy as np
+
 from nordlys.core.wsdmcup_2017.config import WP_ST_INDEX_ID
+from nordlys.core.wsdmcup_2017.person_tf import PersonTFSource
 
 
 def square_rooted_sum(v):
@@ -23,6 +26,19 @@ def cos_sim(v1, v2):
     return res
 
 
+def masked_sums(values, mask):
+    """Sums up the values selected by each row of the mask.
+    Values are added up sequentially, in the given order, so that the sums are identical to a for-loop.
+
+    :param values: array of n values
+    :param mask: boolean array of m x n
+    :return: array of m sums
+    """
+    if len(values) == 0:
+        return np.zeros(mask.shape[0])
+    return np.cumsum(np.where(mask, values, 0.0), axis=1)[:, -1]
+
+
 class FeaturesTermStats():
     CONTENT_FIELD = "content"
     PROF_FIELD = "professions"
@@ -40,13 +56,17 @@ class FeaturesTermStats():
                  "now"]
     MAX_K = max(K_VALUES)
 
-    def __init__(self, index_name=WP_ST_INDEX_ID):
-        self.__elastic = ElasticCache(index_name)
+    def __init__(self, index_name=WP_ST_INDEX_ID, local_index_dir=None, tf_matrix_dir=None,
+                 person_sentences_dir=None, person_tf_dir=None):
+        self.__person_tfs = PersonTFSource(index_name, local_index_dir, tf_matrix_dir, person_sentences_dir,
+                                           person_tf_dir)
         self.__stats = None
+        self.__prof_terms_cache = {}
 
     def load_termstats(self, input_file):
         """load term statistics from file"""
         self.__stats = {}
+        self.__prof_terms_cache = {}
         with FileUtils.open_file_by_type(input_file) as f_in:
             rank = 0
             last_prof = None
@@ -70,14 +90,57 @@ class FeaturesTermStats():
         :param person_id: dict with TFs
         :return:
         """
-        doc_ids = self.__elastic.search(person_id, self.CONTENT_FIELD, num=10000).keys()
-        print(person_id, "with", len(doc_ids), "sentences")
-        tf_agg = {}
-        for doc_id in doc_ids:
-            tv = self.__elastic.get_termvector(doc_id, self.CONTENT_FIELD)  # , term_stats=True)
-            for t, val in tv.items():
-                tf_agg[t] = tf_agg.get(t, 0) + val["term_freq"]
-        return tf_agg, len(doc_ids)
+        tf_agg, num_sent = self.__person_tfs.get_person_tf(person_id)
+        print(person_id, "with", num_sent, "sentences")
+        return tf_agg, num_sent
+
+    def __prof_terms(self, prof_id):
+        """Returns the profession terms within the top-MAX_K, as (term positions, ranks, tfidf, idf) arrays.
+        Terms keep the order of the stats, which is the order their values are added up by cos_sim().
+        """
+        if prof_id not in self.__prof_terms_cache:
+            terms = [(term, s) for term, s in self.__stats.get(prof_id, {}).items() if s["rank"] <= self.MAX_K]
+            positions = {term: i for i, (term, _) in enumerate(terms)}
+            ranks = np.array([s["rank"] for _, s in terms], dtype=np.int64)
+            tfidf = np.array([s["tfidf"] for _, s in terms], dtype=np.float64)
+            tf = np.array([s["tf"] for _, s in terms], dtype=np.float64)
+            self.__prof_terms_cache[prof_id] = positions, ranks, tfidf, tfidf / tf  # back-generated IDF
+        return self.__prof_terms_cache[prof_id]
+
+    def get_features(self, person_tf, prof_id):
+        """Computes sumProfTerms_k and simCos_k for all K values at once.
+
+        :param person_tf: aggregated TF of the person
+        :param prof_id: profession
+        :return: list of feature values (as strings), in the order of the header
+        """
+        positions, ranks, tfidf, idf = self.__prof_terms(prof_id)
+        k_values = np.array(self.K_VALUES)[:, None]
+
+        # Compute sumProfTerms: \sum_{t \in T_k(pr)}\sum_{s \in S(pe)} tf(t,s) w(t,pr)
+        # where w(t,pe )= TFIDF(t,pr) = \frac{\sum_{s \in S(pr)} tf(t,s)}
+        # person terms are added up in the order of person_tf
+        matched = [(positions[term], tf) for term, tf in person_tf.items() if term in positions]
+        rows = np.array([i for i, _ in matched], dtype=np.int64)
+        in_top_k = ranks[rows][None, :] <= k_values
+        sum_prof_terms = masked_sums(np.array([tf for _, tf in matched], dtype=np.float64) * tfidf[rows], in_top_k)
+        num_matched = in_top_k.sum(axis=1)
+
+        # compute simCosK, where K is the top-K terms for the profession
+        # the prof vector is tfidf, and the person vector is TF * IDF
+        in_top_k = ranks[None, :] <= k_values
+        vec_pe = np.array([person_tf.get(term, 0) for term in positions], dtype=np.float64) * idf
+        numerator = masked_sums(tfidf * vec_pe, in_top_k).tolist()
+        norm_pr = masked_sums(tfidf * tfidf, in_top_k).tolist()
+        norm_pe = masked_sums(vec_pe * vec_pe, in_top_k).tolist()
+
+        values = []
+        for i in range(len(self.K_VALUES)):
+            values.append(str(float(sum_prof_terms[i])) if num_matched[i] > 0 else "0")
+            denominator = sqrt(norm_pr[i]) * sqrt(norm_pe[i])
+            # the profession may not have any sentences
+            values.append(str(numerator[i] / denominator) if denominator != 0 else "0")
+        return values
 
     def generate_features(self, kb_file, output_file):
         """Generating features related to term statistics"""
@@ -98,34 +161,7 @@ class FeaturesTermStats():
 
                 person_tf, num_sent = self.get_person_tf(person_id)
 
-                for k in self.K_VALUES:
-                    # we take top-K profession terms
-
-                    # Compute sumProfTerms: \sum_{t \in T_k(pr)}\sum_{s \in S(pe)} tf(t,s) w(t,pr)
-                    # where w(t,pe )= TFIDF(t,pr) = \frac{\sum_{s \in S(pr)} tf(t,s)}
-                    sum_prof_terms = 0
-                    for term, tf in person_tf.items():
-                        pt = self.__stats.get(prof_id, {}).get(term, {})
-                        if pt.get("rank", 100000) > k:  # skip term if not in top-K
-                            continue
-                        sum_prof_terms += tf * pt.get("tfidf", 0)
-                    values.append(str(sum_prof_terms))
-
-                    # compute simCosK
-                    # where K is the top-K terms for the profession
-                    vec_pr = []  # construct prof vector
-                    vec_pe = []  # construct person vector
-
-                    if prof_id in self.__stats:
-                        for term, s in self.__stats[prof_id].items():
-                            if s["rank"] <= k:
-                                vec_pr.append(s["tfidf"])
-                                idf = s["tfidf"] / s["tf"]  # we back-generate IDF from profession's TF-IDF
-                                vec_pe.append(person_tf.get(term, 0) * idf)
-                        cos = cos_sim(vec_pr, vec_pe)
-                    else:
-                        cos = 0  # in some exceptional cases the profession does not have any sentences
-                    values.append(str(cos))
+                values += self.get_features(person_tf, prof_id)
 
                 fout.write("\t".join(values) + "\n")
                 print(values)
@@ -133,12 +169,29 @@ class FeaturesTermStats():
         fout.close()
 
 
-def main():
-    fts = FeaturesTermStats()
-    fts.load_termstats("/data/scratch/wsdm-cup-2017/data/tf_idf.tsv")
-    fts.generate_features("/data/scratch/wsdm-cup-2017/data/profession_translations.kb",
-                          "/data/scratch/wsdm-cup-2017/data/features_termstats_prof.tsv")
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--stats_file", help="term statistics", type=str,
+                        default="/data/scratch/wsdm-cup-2017/data/tf_idf.tsv")
+    parser.add_argument("-k", "--kb_file", help=".kb file", type=str,
+                        default="/data/scratch/wsdm-cup-2017/data/profession_translations.kb")
+    parser.add_argument("-o", "--output_file", help="output file", type=str,
+                        default="/data/scratch/wsdm-cup-2017/data/features_termstats_prof.tsv")
+    parser.add_argument("-l", "--local_index_dir", help="uses the local index in this directory", type=str)
+    parser.add_argument("-m", "--tf_matrix_dir", help="uses the sentence-term matrix in this directory", type=str)
+    parser.add_argument("-p", "--person_sentences_dir", help="uses the person-sentence postings in this directory",
+                        type=str)
+    parser.add_argument("-t", "--person_tf_dir", help="uses the person TF store in this directory", type=str)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    fts = FeaturesTermStats(local_index_dir=args.local_index_dir, tf_matrix_dir=args.tf_matrix_dir,
+                            person_sentences_dir=args.person_sentences_dir, person_tf_dir=args.person_tf_dir)
+    fts.load_termstats(args.stats_file)
+    fts.generate_features(args.kb_file, args.output_file)
 
 
 if __name__ == "__main__":
-    main()
+    main(arg_parser())
@@ -7,10 +7,17 @@ Generating feature for cos sim of person vector vs profession vector, using for
 
 """
 
-from nordlys.core.retrieval.elastic_cache import ElasticCache
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
 from nordlys.core.utils.file_utils import FileUtils
 from nordlys.core.wsdmcup_2017.feat_w2v_sim_approx import FeaturesW2VSimApprox
-from nordlys.core.wsdmcup_2017.feat_termstats import cos_sim
+from nordlys.core.wsdmcup_2017.person_tf import PersonTFSource
+from nordlys.core.wsdmcup_2017.w2v_matrix import W2VMatrix, vec_cos_sim
 from nordlys.core.wsdmcup_2017.config import *
 
 
@@ -31,12 +38,25 @@ class FeaturesW2VSim(object):
     K_VALUES = [10, 50, 100, 200, 500, 1000]
     MAX_K = max(K_VALUES)
 
-    def __init__(self, index_name=WP_ST_INDEX_ID):
-        self.__elastic = ElasticCache(index_name)
+    def __init__(self, index_name=WP_ST_INDEX_ID, local_index_dir=None, tf_matrix_dir=None,
+                 person_sentences_dir=None, person_tf_dir=None, w2v_matrix_dir=None,
+                 centroids_dir=W2V_CENTROIDS_DIR):
+        self.__person_tfs = PersonTFSource(index_name, local_index_dir, tf_matrix_dir, person_sentences_dir,
+                                           person_tf_dir)
+        self.__w2v_matrix_dir = w2v_matrix_dir
+        self.__centroids_dir = centroids_dir
         self.__stats = None
+        self.__stats_checksum = None
+        self.__w2v_matrix = None
+        self.__prof_terms_cache = {}
+        self.__prof_centroids = None
 
     def load_termstats(self, input_file):
         self.__stats = {}
+        self.__stats_checksum = FileUtils.checksum(input_file)
+        self.__w2v_matrix = None
+        self.__prof_terms_cache = {}
+        self.__prof_centroids = None
         with FileUtils.open_file_by_type(input_file) as f_in:
             rank = 0
             last_prof = None
@@ -60,14 +80,74 @@ class FeaturesW2VSim(object):
         :param person_id: dict with TFs.
         :return:
         """
-        doc_ids = self.__elastic.search(person_id, self.CONTENT_FIELD, num=10000).keys()
+        return self.__person_tfs.get_person_tf(person_id)
+
+    def __prof_terms(self, prof_id):
+        """Returns the top-MAX_K profession terms having a w2v vector, sorted by rank.
 
-        tf_agg = {}
-        for doc_id in doc_ids:
-            tv = self.__elastic.get_termvector(doc_id, self.CONTENT_FIELD)  # , term_stats=True)
-            for t, val in tv.items():
-                tf_agg[t] = tf_agg.get(t, 0) + val["term_freq"]
-        return tf_agg, len(doc_ids)
+        :return: terms, and arrays of ranks, tfidf, idf, and w2v matrix rows
+        """
+        if prof_id not in self.__prof_terms_cache:
+            terms = sorted([(term, s) for term, s in self.__stats.get(prof_id, {}).items() if s["rank"] <= self.MAX_K],
+                           key=lambda t: t[1]["rank"])
+            rows = self.__w2v_matrix.get_rows([term for term, _ in terms])
+            terms = [t for t, row in zip(terms, rows) if row >= 0]  # terms without vector do not contribute
+            ranks = np.array([s["rank"] for _, s in terms], dtype=np.int64)
+            tfidf = np.array([s["tfidf"] for _, s in terms], dtype=np.float64)
+            idf = tfidf / np.array([s["tf"] for _, s in terms], dtype=np.float64)  # back-generated from TF-IDF
+            self.__prof_terms_cache[prof_id] = [term for term, _ in terms], ranks, tfidf, idf, rows[rows >= 0]
+        return self.__prof_terms_cache[prof_id]
+
+    def __get_vectors(self, ranks, weights, rows):
+        """Computes the weighted sum of w2v vectors of top-K terms for all K values at once, using cumulative sums
+        over the rank-ordered terms (accumulated in float64).
+
+        :return: matrix with the vector of each K in a row
+        """
+        vectors = np.zeros((len(self.K_VALUES), self.__w2v_matrix.dimension), dtype=np.float64)
+        nonzero = np.flatnonzero(weights)
+        if len(nonzero) == 0:
+            return vectors
+        cum_vectors = np.cumsum(self.__w2v_matrix.vectors[rows[nonzero]].astype(np.float64) *
+                                weights[nonzero, None], axis=0)
+        cutoffs = np.searchsorted(ranks[nonzero], self.K_VALUES, side="right")  # number of terms with rank <= K
+        vectors[cutoffs > 0] = cum_vectors[cutoffs[cutoffs > 0] - 1]
+        return vectors
+
+    def __get_centroids_key(self):
+        """Returns the cache key of the profession vectors: the checksums of the term statistics and the word2vec
+        vectors, and the K values.
+        """
+        m = hashlib.md5(self.__stats_checksum.encode("utf-8"))
+        m.update(self.__w2v_matrix.checksum().encode("utf-8"))
+        m.update(json.dumps(self.K_VALUES).encode("utf-8"))
+        return m.hexdigest()
+
+    def load_prof_centroids(self):
+        """Loads the profession vectors of all K values, which are computed and saved if they are not cached for the
+        term statistics, word2vec vectors, and K values. The cache file holds the professions, K values and vectors.
+        """
+        centroids_file = os.sep.join([self.__centroids_dir, "prof_centroids_" + self.__get_centroids_key() + ".npz"])
+        if os.path.exists(centroids_file):
+            with np.load(centroids_file) as data:
+                assert data["k_values"].tolist() == self.K_VALUES
+                profs = data["profs"].tolist()
+                centroids = data["centroids"]
+            print("Loaded profession vectors from", centroids_file)
+        else:
+            profs = sorted(self.__stats)
+            centroids = np.zeros((len(profs), len(self.K_VALUES), self.__w2v_matrix.dimension), dtype=np.float64)
+            for i, prof_id in enumerate(profs):
+                _, ranks, tfidf, _, rows = self.__prof_terms(prof_id)
+                centroids[i] = self.__get_vectors(ranks, tfidf, rows)
+            # written to a temp file and renamed, as parallel workers may compute the same vectors
+            os.makedirs(self.__centroids_dir, exist_ok=True)
+            tmp_file = centroids_file + ".tmp" + str(os.getpid())
+            with open(tmp_file, "wb") as f:
+                np.savez(f, profs=np.array(profs, dtype=str), k_values=np.array(self.K_VALUES), centroids=centroids)
+            os.replace(tmp_file, centroids_file)
+            print("Saved profession vectors to", centroids_file)
+        self.__prof_centroids = {prof_id: centroids[i] for i, prof_id in enumerate(profs)}
 
     def generate_features(self, kb_file, output_file):
         """Core function for generating into output_file the features, with person-item data from kb_file.
@@ -76,7 +156,16 @@ class FeaturesW2VSim(object):
         :param output_file:
         :return:
         """
-        feat_w2v_approx = FeaturesW2VSimApprox()
+        if self.__w2v_matrix is None:  # loaded once for the term statistics
+            feat_w2v_approx = FeaturesW2VSimApprox(self.__w2v_matrix_dir)
+            self.__w2v_matrix = feat_w2v_approx.w2v_matrix
+            if self.__w2v_matrix is None:  # fetches the vectors of all profession terms from Mongo, once
+                terms = {term for prof_stats in self.__stats.values() for term, s in prof_stats.items()
+                         if s["rank"] <= self.MAX_K}
+                self.__w2v_matrix = W2VMatrix.from_word2vec(feat_w2v_approx.word2vec, terms)
+            self.__prof_terms_cache = {}
+        if self.__prof_centroids is None:
+            self.load_prof_centroids()
 
         with open(output_file, "w") as f_out:
             # write tsv header
@@ -91,36 +180,45 @@ class FeaturesW2VSim(object):
 
                 person_tf, num_sent = self.get_person_tf(person_id)
 
-                for k in self.K_VALUES:
-                    # we take top-K profession terms
-
-                    # compute simCosK
-                    # where K is the top-K terms for the profession
-                    term_weights_pr = {}  # dict from top-K profession terms to their tfidf weights
-                    term_weights_pe = {}  # dict from top-K person terms to their tfidf weights
+                # compute simCosK for all K, where K is the top-K terms for the profession
+                if prof_id in self.__stats:
+                    terms, ranks, _, idf, rows = self.__prof_terms(prof_id)
+                    weights_pe = np.array([person_tf.get(term, 0) for term in terms], dtype=np.float64) * idf
+                    vectors_pe = self.__get_vectors(ranks, weights_pe, rows)
+                    vectors_pr = self.__prof_centroids[prof_id]
+                    for i in range(len(self.K_VALUES)):
+                        values.append(str(vec_cos_sim(vectors_pr[i], vectors_pe[i])))
+                else:
+                    # in some exceptional cases the profession does not have any sentences
+                    values += ["0"] * len(self.K_VALUES)
 
-                    if prof_id in self.__stats:
-                        for term, s in self.__stats[prof_id].items():
-                            if s["rank"] <= k:
-                                term_weights_pr[term] = float(s["tfidf"])
-                                idf = s["tfidf"] / s["tf"]  # we back-generate IDF from profession's TF-IDF
-                                term_weights_pe[term] = person_tf.get(term, 0) * idf
+                f_out.write("\t".join(values) + "\n")
 
-                        vec_pr = feat_w2v_approx.get_vector(term_weights_pr)
-                        vec_pe = feat_w2v_approx.get_vector(term_weights_pe)
-                        cos = cos_sim(vec_pr, vec_pe)
-                    else:
-                        cos = 0  # in some exceptional cases the profession does not have any sentences
-                    values.append(str(cos))
 
-                f_out.write("\t".join(values) + "\n")
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--stats_file", help="term statistics", type=str, default=TF_IDF_F)
+    parser.add_argument("-k", "--kb_file", help=".kb file", type=str, default=PROFESSION_TRANSLATIONS_F)
+    parser.add_argument("-o", "--output_file", help="output file", type=str, default=PROF_W2V_AGGR_COS_SIM_F)
+    parser.add_argument("-l", "--local_index_dir", help="uses the local index in this directory", type=str)
+    parser.add_argument("-m", "--tf_matrix_dir", help="uses the sentence-term matrix in this directory", type=str)
+    parser.add_argument("-p", "--person_sentences_dir", help="uses the person-sentence postings in this directory",
+                        type=str)
+    parser.add_argument("-t", "--person_tf_dir", help="uses the person TF store in this directory", type=str)
+    parser.add_argument("-w", "--w2v_matrix_dir", help="uses the word2vec matrix in this directory", type=str)
+    parser.add_argument("-c", "--centroids_dir", help="cache directory of the profession vectors (per K value)",
+                        type=str, default=W2V_CENTROIDS_DIR)
+    args = parser.parse_args()
+    return args
 
 
-def main():
-    fts = FeaturesW2VSim()
-    fts.load_termstats(TF_IDF_F)
-    fts.generate_features(PROFESSION_TRANSLATIONS_F, PROF_W2V_AGGR_COS_SIM_F)
+def main(args):
+    fts = FeaturesW2VSim(local_index_dir=args.local_index_dir, tf_matrix_dir=args.tf_matrix_dir,
+                         person_sentences_dir=args.person_sentences_dir, person_tf_dir=args.person_tf_dir,
+                         w2v_matrix_dir=args.w2v_matrix_dir, centroids_dir=args.centroids_dir)
+    fts.load_termstats(args.stats_file)
+    fts.generate_features(args.kb_file, args.output_file)
 
 
 if __name__ == "__main__":
-    main()
+    main(arg_parser())
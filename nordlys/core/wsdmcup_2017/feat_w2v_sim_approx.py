@@ -3,6 +3,7 @@
 @author: Dario Garigliotti
 """
 
+import argparse
 from collections import Counter
 from operator import itemgetter
 
@@ -13,10 +14,38 @@ from nordlys.core.utils.file_utils import FileUtils
 from nordlys.core.wsdmcup_2017.config import *  # we know this module so no danger, but be careful ;)
 from nordlys.core.wsdmcup_2017.wsdmcup_ids import WSDMCupIDs
 from nordlys.core.wsdmcup_2017.feat_termstats import cos_sim
+from nordlys.core.wsdmcup_2017.w2v_matrix import W2VMatrix, vec_cos_sim
 
 WP_PREFIX = "wikipedia_"
 
 
+def snippet_term_weights(snippet):
+    """Weights of the significant terms of a snippet, i.e., their normalized TF (only terms with TF >= 2)."""
+    c = {k: v for k, v in Counter(snippet.split()).items() if k not in STOPWORDS and v >= 2}  # min freq = 2
+    total = sum([v for k, v in c.items()])
+    return {k: round(v / total, 4) for k, v in c.items()}
+
+
+def build_w2v_matrix(matrix_dir, items_tfidf_fpath=TF_IDF_F, first_snippets_fpath=FIRST_WP_PG_F):
+    """Builds the word2vec matrix for the vocabulary of the item tf-idf stats and the first snippets.
+
+    :param matrix_dir: output directory
+    :param items_tfidf_fpath: path to the file with item tf-idf stats.
+    :param first_snippets_fpath: path to the file with first snippets.
+    """
+    terms = set()
+    for line in FileUtils.read_file_as_list(items_tfidf_fpath):
+        terms.add(line.split("\t", maxsplit=2)[1])  # raw terms, as used by FeaturesW2VSim
+    for term_weights in FeaturesW2VSimApprox.load_items_stats(items_tfidf_fpath).values():
+        terms.update(term_weights)  # cleaned terms
+    for line in FileUtils.read_file_as_list(first_snippets_fpath):
+        terms.update(snippet_term_weights(line.split("\t")[1]))
+    print("Vocabulary:", len(terms), "terms")
+
+    word2vec = Word2Vec(Mongo(MONGO_HOST, MONGO_DB, MONGO_COLLECTION_WORD2VEC))
+    W2VMatrix.from_word2vec(word2vec, terms).save(matrix_dir)
+
+
 class FeaturesW2VSimApprox(object):
     """Implements our simCosW2VPG feature, i.e., the cosine similarity between the profession \
     (centroid of TFIDF-weighted word2vec vectors of top-K profession terms) and person \
@@ -30,14 +59,25 @@ class FeaturesW2VSimApprox(object):
 	# $$\vec{t}^{w2v}_{pr, k} = \sum_{t \in T_k(pr)} w(t, pr) w2v(t)$$
 	# (note that using these unnormalized sums in the computation of $cos()$ is equivalent to use the actual centroids).
 
-    def __init__(self):
-        mongo = Mongo(MONGO_HOST, MONGO_DB, MONGO_COLLECTION_WORD2VEC)
-        self.__word2vec = Word2Vec(mongo)
+    def __init__(self, w2v_matrix_dir=None):
+        """
+        :param w2v_matrix_dir: directory of the word2vec matrix; if None, vectors are read from Mongo
+        """
+        self.__w2v_matrix = W2VMatrix.load(w2v_matrix_dir) if w2v_matrix_dir else None
+        if self.__w2v_matrix is None:
+            mongo = Mongo(MONGO_HOST, MONGO_DB, MONGO_COLLECTION_WORD2VEC)
+            self.__word2vec = Word2Vec(mongo)
+        else:
+            self.__word2vec = self.__w2v_matrix
 
     @property
     def word2vec(self):
         return self.__word2vec
 
+    @property
+    def w2v_matrix(self):
+        return self.__w2v_matrix
+
     def __increase(self, v, term, weight):
         """Increases v by weight times term.
 
@@ -51,7 +91,8 @@ class FeaturesW2VSimApprox(object):
             for i in range(len(v)):
                 v[i] += term_v[i] * weight
 
-    def __load_items_stats(self, items_tfidf_fpath):
+    @staticmethod
+    def load_items_stats(items_tfidf_fpath):
         """Loads pre-computed tf-idf stats for items.
 
         :param items_tfidf_fpath:
@@ -85,6 +126,9 @@ class FeaturesW2VSimApprox(object):
         :param terms_weights: dict from terms to their weights.
         :return:
         """
+        if self.__w2v_matrix:  # gather + matrix-vector product
+            return self.__w2v_matrix.weighted_sum(terms_weights)
+
         v = self.word2vec.get_zeros_vector(self.word2vec.dimension)
 
         for term, weight in terms_weights.items():
@@ -92,6 +136,19 @@ class FeaturesW2VSimApprox(object):
 
         return v
 
+    def get_vectors(self, terms_weights_list):
+        """Gets the vectors of a list of term-weight dicts (computed at once with the word2vec matrix).
+
+        :param terms_weights_list: list of dicts from terms to their weights.
+        :return: list of vectors
+        """
+        if self.__w2v_matrix:
+            return list(self.__w2v_matrix.weighted_sums(terms_weights_list))
+        return [self.get_vector(terms_weights) for terms_weights in terms_weights_list]
+
+    def cos_sim(self, v1, v2):
+        return vec_cos_sim(v1, v2) if self.__w2v_matrix else cos_sim(v1, v2)
+
     def get_all_features_approx(self, all_items_fpath, items_tfidf_fpath, first_snippets_fpath, person_items_fpath,
                                 dest_fpath):
         """Core function for generating into output_file the features, with person-item data from kb_file.
@@ -109,16 +166,14 @@ class FeaturesW2VSimApprox(object):
         # Get persons vectors
 
         # Load person-to-snippet mapping
-        persons_to_vec = {}
+        persons = []
+        persons_weights = []
         for line in FileUtils.read_file_as_list(first_snippets_fpath):
             person, snippet = line.split("\t")
             person = person.split("<{}".format(DBPEDIA_URI_PREFIX))[-1].split(">")[0].replace("_", " ")
-
-            c = {k: v for k, v in Counter(snippet.split()).items() if k not in STOPWORDS and v >= 2}  # min freq = 2
-            total = sum([v for k, v in c.items()])
-            c = {k: round(v / total, 4) for k, v in c.items()}
-            v = self.get_vector(c)
-            persons_to_vec[person] = v
+            persons.append(person)
+            persons_weights.append(snippet_term_weights(snippet))
+        persons_to_vec = dict(zip(persons, self.get_vectors(persons_weights)))
         print("Get persons vectors... OK.")
 
         # -------
@@ -126,22 +181,18 @@ class FeaturesW2VSimApprox(object):
 
         # Load professions tf-idf
         # dict from each item (e.g. professions) to its term-to-weight dict
-        item_term_weights = self.__load_items_stats(items_tfidf_fpath)
-        prof_to_vec = {}
-        for raw_item in FileUtils.read_file_as_list(all_items_fpath):
-            # for professions
-            item = wcup_ids.get_id_from_prof(raw_item)  # DON'T FORGET!
-            v = self.get_vector(item_term_weights.get(item, {}))
-
-            # ---
-            # Alternative vector version, using the w2v vector when it exists, without top-K terms
-            #
-            # if not self.word2vec.contains_word(item):  # build our own vector with top-K terms for that item
-            #     v = self.get_vector(item_term_weights.get(item, {}))
-            # else:  # take advantage of an already well-represented vector present in the w2v collection
-            #     v = self.word2vec.get_vector(item)
-            # ---
-            prof_to_vec[item] = v
+        item_term_weights = self.load_items_stats(items_tfidf_fpath)
+        # for professions
+        items = [wcup_ids.get_id_from_prof(raw_item) for raw_item in FileUtils.read_file_as_list(all_items_fpath)]
+        # ---
+        # Alternative vector version, using the w2v vector when it exists, without top-K terms
+        #
+        # if not self.word2vec.contains_word(item):  # build our own vector with top-K terms for that item
+        #     v = self.get_vector(item_term_weights.get(item, {}))
+        # else:  # take advantage of an already well-represented vector present in the w2v collection
+        #     v = self.word2vec.get_vector(item)
+        # ---
+        prof_to_vec = dict(zip(items, self.get_vectors([item_term_weights.get(item, {}) for item in items])))
         print("Get profession vectors... OK.")
 
         # -------
@@ -157,7 +208,7 @@ class FeaturesW2VSimApprox(object):
             person_vec = persons_to_vec.get(person, self.word2vec.get_zeros_vector(self.word2vec.dimension))
             prof_vec = prof_to_vec.get(item, self.word2vec.get_zeros_vector(self.word2vec.dimension))
 
-            feat_value = cos_sim(person_vec, prof_vec)
+            feat_value = self.cos_sim(person_vec, prof_vec)
             person_to_prof_to_cos[person][item] = feat_value
         pass
 
@@ -168,12 +219,24 @@ class FeaturesW2VSimApprox(object):
                     f_out.write("{}\t{}\t{}\n".format(wcup_ids.get_id_from_person(person), item, sim))
 
 
-def main():
-    feat = FeaturesW2VSimApprox()
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--w2v_matrix_dir", help="reads word2vec vectors from the matrix in this directory, "
+                                                       "instead of Mongo", type=str)
+    parser.add_argument("-b", "--build", help="builds the word2vec matrix into w2v_matrix_dir", action="store_true")
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    if args.build:
+        build_w2v_matrix(args.w2v_matrix_dir or W2V_MATRIX_DIR)
+        return
+    feat = FeaturesW2VSimApprox(args.w2v_matrix_dir)
     items_tfidf_fpath = TF_IDF_F  # professions (no var is needed, just to be able to comment what items are about :P)
     feat.get_all_features_approx(PROFESSIONS_F, items_tfidf_fpath, FIRST_WP_PG_F, PROF_KB_F,
                                  PROF_APPROX_W2V_AGGR_COS_SIM_F)
 
 
 if __name__ == '__main__':
-    main()
+    main(arg_parser())
@@ -0,0 +1,178 @@
+"""
+Feature matrix
+--------------
+
+Compact numeric store of the aggregated features of (person, item) instances, as an alternative to the JSON
+instance files. Files:
+
+- ``columns.txt``: column names, one per line: person, relation (item), and then the feature names
+- ``persons.txt``, ``items.txt``: person and item ids, one per line, in integer code order
+- ``ids.npy``: int32 matrix of #instances x 2, with the person and item codes of each instance
+- ``features.npy``: float32 matrix of #instances x #features (NaN for missing feature values)
+- ``index_keys.npy``, ``index_rows.npy``: sorted instance keys (person code * #items + item code) and their rows
+
+Rows are written incrementally (so the matrix is never held in memory) and are memory-mapped when loaded.
+Looking up instances is a binary search over the key index, and reads only the rows of the found instances.
+
+@author: Faegheh Hasibi
+"""
+
+import os
+from array import array
+
+import numpy as np
+
+
+class FeatureMatrix(object):
+    """Reads the feature matrix."""
+
+    def __init__(self, matrix_dir):
+        with open(os.sep.join([matrix_dir, "columns.txt"]), "r") as f:
+            self.__columns = [line.rstrip("\n") for line in f]
+        with open(os.sep.join([matrix_dir, "persons.txt"]), "r") as f:
+            self.__persons = [line.rstrip("\n") for line in f]
+        with open(os.sep.join([matrix_dir, "items.txt"]), "r") as f:
+            self.__items = [line.rstrip("\n") for line in f]
+        self.__ids = np.load(os.sep.join([matrix_dir, "ids.npy"]), mmap_mode="r")
+        self.__features = np.load(os.sep.join([matrix_dir, "features.npy"]), mmap_mode="r")
+        self.__index_keys = np.load(os.sep.join([matrix_dir, "index_keys.npy"]), mmap_mode="r")
+        self.__index_rows = np.load(os.sep.join([matrix_dir, "index_rows.npy"]), mmap_mode="r")
+        self.__person_codes = None  # built when needed
+        self.__item_codes = None
+
+    @property
+    def columns(self):
+        return self.__columns
+
+    @property
+    def feature_names(self):
+        return self.__columns[2:]
+
+    @property
+    def persons(self):
+        return self.__persons
+
+    @property
+    def items(self):
+        return self.__items
+
+    @property
+    def ids(self):
+        return self.__ids
+
+    @property
+    def features(self):
+        return self.__features
+
+    @property
+    def num_rows(self):
+        return self.__ids.shape[0]
+
+    def get_instance_id(self, row):
+        """Returns the instance id (person_item) of a row."""
+        person_code, item_code = self.__ids[row].tolist()
+        return self.__persons[person_code] + "_" + self.__items[item_code]
+
+    def get_rows(self, person_items):
+        """Looks up the rows of instances.
+
+        :param person_items: list of (person id, item id) pairs
+        :return: array of rows (-1 for the instances not in the matrix)
+        """
+        if self.__person_codes is None:
+            self.__person_codes = {person: i for i, person in enumerate(self.__persons)}
+            self.__item_codes = {item: i for i, item in enumerate(self.__items)}
+        keys = np.array([self.__person_codes[person] * len(self.__items) + self.__item_codes[item]
+                         if person in self.__person_codes and item in self.__item_codes else -1
+                         for person, item in person_items], dtype=np.int64)
+        if len(self.__index_keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.__index_keys, keys), len(self.__index_keys) - 1)
+        found = (keys >= 0) & (self.__index_keys[pos] == keys)
+        return np.where(found, self.__index_rows[pos], -1)
+
+    def get_feature_matrix(self, rows, feature_names):
+        """Reads the given features of the given rows (in ascending row order, as get_features).
+
+        :param rows: array of rows
+        :param feature_names: list of feature names (NaN columns for the features not in the matrix)
+        :return: float32 matrix of #rows x #feature_names
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.argsort(rows, kind="stable")
+        columns = {name: j for j, name in enumerate(self.feature_names)}
+        res = np.full((len(rows), len(feature_names)), np.nan, dtype=np.float32)
+        values = np.empty((len(rows), len(self.feature_names)), dtype=np.float32)
+        values[order] = self.__features[rows[order]]
+        for j, name in enumerate(feature_names):
+            if name in columns:
+                res[:, j] = values[:, columns[name]]
+        return res
+
+    def get_features(self, rows):
+        """Reads the features of the given rows, in ascending row order so that the memory-mapped matrix is read
+        sequentially.
+
+        :param rows: array of rows
+        :return: list of {feature name: value} dicts, without the missing (NaN) values
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.argsort(rows, kind="stable")
+        values = np.empty((len(rows), len(self.feature_names)), dtype=np.float32)
+        values[order] = self.__features[rows[order]]
+        return [{name: val for name, val in zip(self.feature_names, row_values) if val == val}  # skips NaN
+                for row_values in values.tolist()]
+
+
+class FeatureMatrixBuilder(object):
+    """Writes the feature matrix; rows are written to raw files as they are added."""
+
+    def __init__(self, matrix_dir, relation, feature_names):
+        """
+        :param matrix_dir: output directory
+        :param relation: name of the item column (e.g. "profession")
+        :param feature_names: list of feature names, in column order
+        """
+        os.makedirs(matrix_dir, exist_ok=True)
+        self.__matrix_dir = matrix_dir
+        self.__columns = ["person", relation] + list(feature_names)
+        self.__persons = {}
+        self.__items = {}
+        self.__num_rows = 0
+        self.__f_ids = open(os.sep.join([matrix_dir, "ids.tmp"]), "wb")
+        self.__f_features = open(os.sep.join([matrix_dir, "features.tmp"]), "wb")
+
+    def add(self, person, item, values):
+        """Adds a row.
+
+        :param values: list of feature values, in column order (NaN for missing values)
+        """
+        self.__f_ids.write(array("i", [self.__persons.setdefault(person, len(self.__persons)),
+                                       self.__items.setdefault(item, len(self.__items))]).tobytes())
+        self.__f_features.write(array("f", values).tobytes())
+        self.__num_rows += 1
+
+    def close(self):
+        self.__f_ids.close()
+        self.__f_features.close()
+        num_features = len(self.__columns) - 2
+        for name, dtype, num_cols in [("ids", np.int32, 2), ("features", np.float32, num_features)]:
+            raw_file = os.sep.join([self.__matrix_dir, name + ".tmp"])
+            if self.__num_rows * num_cols == 0:
+                arr = np.zeros((self.__num_rows, num_cols), dtype=dtype)
+            else:
+                arr = np.memmap(raw_file, dtype=dtype, mode="r").reshape(-1, num_cols)
+            np.save(os.sep.join([self.__matrix_dir, name + ".npy"]), arr)
+            del arr
+            os.remove(raw_file)
+        ids = np.load(os.sep.join([self.__matrix_dir, "ids.npy"]))
+        keys = ids[:, 0].astype(np.int64) * len(self.__items) + ids[:, 1]
+        rows = np.argsort(keys, kind="stable")
+        np.save(os.sep.join([self.__matrix_dir, "index_keys.npy"]), keys[rows])
+        np.save(os.sep.join([self.__matrix_dir, "index_rows.npy"]), rows)
+        for file_name, values in [("columns.txt", self.__columns), ("persons.txt", self.__persons),
+                                  ("items.txt", self.__items)]:
+            with open(os.sep.join([self.__matrix_dir, file_name]), "w") as f:
+                for value in values:  # dicts are in code order
+                    f.write(value + "\n")
+        print("Feature matrix:", self.__num_rows, "instances,", num_features, "features")
@@ -0,0 +1,268 @@
+"""
+Flat forest
+-----------
+
+Inference engine for the regression forests of TripleScorer (scikit-learn RandomForestRegressor), with all the trees
+compiled into flat arrays of nodes:
+
+- ``feature.npy``, ``threshold.npy``: split feature and threshold of each node
+- ``left.npy``, ``right.npy``: children of each node; leaves point to themselves
+- ``missing_left.npy``: whether missing (NaN) values go to the left child
+- ``value.npy``: prediction of each node (used for leaves)
+- ``roots.npy``: root node of each tree
+- ``feature_names.txt``: feature names, in the column order of ``ML.train_model`` (sorted feature names)
+
+A batch of instances is pushed down all the trees at once, one level per step, with array operations. Splits and the
+averaging of tree predictions follow scikit-learn (float32 features, ``x <= threshold`` goes left, tree predictions
+added up in tree order), so that predictions are identical. As with ``ML.apply_model``, instances must have all the
+features of the model (a missing feature is an error, not a NaN).
+
+A compiled model is only saved if its predictions are the same as ``ML.apply_model`` on a sample of the train
+instances; the benchmark (``-b``) checks the same on the instances to score, and fails on any difference.
+
+Usage::
+
+    python -m nordlys.core.wsdmcup_2017.flat_forest -r profession [-b]
+
+@author: Faegheh Hasibi
+"""
+
+import argparse
+import os
+import pickle
+import time
+
+import numpy as np
+
+from nordlys.core.wsdmcup_2017.config import *
+
+
+class FlatForest(object):
+    def __init__(self, feature, threshold, left, right, missing_left, value, roots, feature_names):
+        self.__feature = feature
+        self.__threshold = threshold
+        self.__left = left
+        self.__right = right
+        self.__missing_left = missing_left
+        self.__value = value
+        self.__roots = roots
+        self.__feature_names = feature_names
+        # number of steps from the roots to the deepest leaf
+        self.__max_depth = self.__get_max_depth()
+
+    @staticmethod
+    def from_sklearn(model, feature_names):
+        """Compiles a fitted forest (or a single tree) of scikit-learn.
+
+        :param model: RandomForestRegressor (or any model with estimators_ having a tree_)
+        :param feature_names: feature names, in the column order of the training data
+        """
+        estimators = model.estimators_ if hasattr(model, "estimators_") else [model]
+        features, thresholds, lefts, rights, missing_lefts, values, roots = [], [], [], [], [], [], []
+        offset = 0
+        for estimator in estimators:
+            tree = estimator.tree_
+            n = tree.node_count
+            is_leaf = tree.children_left < 0
+            ids = np.arange(offset, offset + n, dtype=np.int64)
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            thresholds.append(np.asarray(tree.threshold, dtype=np.float64))
+            lefts.append(np.where(is_leaf, ids, tree.children_left + offset))
+            rights.append(np.where(is_leaf, ids, tree.children_right + offset))
+            if hasattr(tree, "missing_go_to_left"):
+                missing_lefts.append(np.asarray(tree.missing_go_to_left, dtype=bool))
+            else:  # trees without missing value support: NaN fails the split test, and goes right
+                missing_lefts.append(np.zeros(n, dtype=bool))
+            values.append(np.asarray(tree.value, dtype=np.float64).reshape(n, -1)[:, 0])
+            roots.append(offset)
+            offset += n
+        return FlatForest(np.concatenate(features), np.concatenate(thresholds), np.concatenate(lefts),
+                          np.concatenate(rights), np.concatenate(missing_lefts), np.concatenate(values),
+                          np.array(roots, dtype=np.int64), list(feature_names))
+
+    @staticmethod
+    def load(model_dir):
+        arrays = [np.load(os.sep.join([model_dir, name + ".npy"])) for name in
+                  ["feature", "threshold", "left", "right", "missing_left", "value", "roots"]]
+        with open(os.sep.join([model_dir, "feature_names.txt"]), "r") as f:
+            feature_names = [line.rstrip("\n") for line in f]
+        return FlatForest(*arrays, feature_names)
+
+    def save(self, model_dir):
+        os.makedirs(model_dir, exist_ok=True)
+        for name, arr in [("feature", self.__feature), ("threshold", self.__threshold), ("left", self.__left),
+                          ("right", self.__right), ("missing_left", self.__missing_left), ("value", self.__value),
+                          ("roots", self.__roots)]:
+            np.save(os.sep.join([model_dir, name + ".npy"]), arr)
+        with open(os.sep.join([model_dir, "feature_names.txt"]), "w") as f:
+            for name in self.__feature_names:
+                f.write(name + "\n")
+        print("Flat forest:", self.num_trees, "trees,", len(self.__value), "nodes, max depth", self.__max_depth)
+
+    @property
+    def feature_names(self):
+        return self.__feature_names
+
+    @property
+    def num_trees(self):
+        return len(self.__roots)
+
+    def __get_max_depth(self):
+        depth = 0
+        nodes = self.__roots
+        while True:
+            children = np.concatenate([self.__left[nodes], self.__right[nodes]])
+            nodes = np.unique(children[children != np.concatenate([nodes, nodes])])
+            if len(nodes) == 0:
+                return depth
+            depth += 1
+
+    def apply(self, x):
+        """Returns the leaf of each instance in each tree.
+
+        :param x: feature matrix of #instances x #features
+        :return: matrix of #instances x #trees
+        """
+        x = np.asarray(x, dtype=np.float32)
+        nodes = np.tile(self.__roots, (x.shape[0], 1))
+        for _ in range(self.__max_depth):
+            x_node = np.take_along_axis(x, self.__feature[nodes], axis=1)
+            go_left = (x_node <= self.__threshold[nodes]) | (np.isnan(x_node) & self.__missing_left[nodes])
+            nodes = np.where(go_left, self.__left[nodes], self.__right[nodes])
+        return nodes
+
+    def predict(self, x, batch_size=1000):
+        """Predicts the instances, as the average of the tree predictions.
+
+        :param x: feature matrix of #instances x #features (in the order of feature_names)
+        :param batch_size: number of instances pushed down the trees at once
+        :return: array of predictions
+        """
+        res = np.zeros(len(x), dtype=np.float64)
+        for start in range(0, len(x), batch_size):
+            leaf_values = self.__value[self.apply(x[start:start + batch_size])]
+            y = np.zeros(leaf_values.shape[0], dtype=np.float64)
+            for t in range(leaf_values.shape[1]):  # added up in tree order, as scikit-learn does
+                y += leaf_values[:, t]
+            res[start:start + batch_size] = y / self.num_trees
+        return res
+
+
+def get_model_files(relation):
+    """Returns the pickled model file and the flat model directory of the relation."""
+    if relation == REL_PROFESSION:
+        return PROFESSION_MODEL, PROFESSION_FLAT_MODEL
+    return NATIONALITY_MODEL, NATIONALITY_FLAT_MODEL
+
+
+def get_feature_names(inss):
+    """Returns the feature names in the column order of ML.train_model: the sorted feature names of the first
+    instance (all the instances have the same features, as ML requires).
+
+    :param inss: Instances
+    """
+    return sorted(inss.get_all()[0].features.keys())
+
+
+def get_feature_matrix(inss, feature_names):
+    """Converts instances to a feature matrix, as ML.apply_model does (KeyError if an instance lacks a feature).
+
+    :param inss: list of Instance
+    """
+    return np.array([[ins.features[name] for name in feature_names] for ins in inss],
+                    dtype=np.float64).reshape(-1, len(feature_names))
+
+
+def check_predictions(relation, forest, model, inss):
+    """Checks that the flat forest predicts the instances exactly as ML.apply_model does with the model.
+
+    :param inss: Instances
+    :return: running times of ML.apply_model and of the flat forest
+    """
+    from nordlys.core.ml.ml import ML
+    from nordlys.core.wsdmcup_2017.triple_scorer import TripleScorer
+    t = time.time()
+    ML(TripleScorer.gen_ml_config(relation)).apply_model(inss, model)
+    time_ml = time.time() - t
+    y_ml = np.array([ins.score for ins in inss.get_all()], dtype=np.float64)
+
+    x = get_feature_matrix(inss.get_all(), forest.feature_names)
+    t = time.time()
+    y_flat = forest.predict(x)
+    time_flat = time.time() - t
+    diff = np.flatnonzero(y_ml != y_flat)
+    if len(diff) > 0:
+        raise AssertionError("{} of {} predictions of the flat forest differ from ML.apply_model, e.g. {} != {}".format(
+            len(diff), len(y_ml), y_flat[diff[0]], y_ml[diff[0]]))
+    return time_ml, time_flat
+
+
+def get_sample(inss, num_instances):
+    """Returns the first instances, as Instances."""
+    from nordlys.core.ml.instances import Instances
+    sample = Instances()
+    for ins in list(inss.get_all())[:num_instances]:
+        sample.add_instance(ins)
+    return sample
+
+
+def compile_model(relation, num_instances=1000):
+    """Compiles the trained model of the relation into a flat forest, and saves it if its predictions are the same
+    as ML.apply_model on the first train instances.
+    """
+    from nordlys.core.ml.instances import Instances
+    model_file, flat_model_dir = get_model_files(relation)
+    train_file = PROFESSION_INSS_TRAIN if relation == REL_PROFESSION else NATIONALITY_INSS_TRAIN
+    inss = Instances.from_json(train_file)
+    feature_names = get_feature_names(inss)
+    model = pickle.load(open(model_file, "rb"))
+    if hasattr(model, "n_features_in_"):
+        assert model.n_features_in_ == len(feature_names), "#features of the model != #features of the instances"
+    forest = FlatForest.from_sklearn(model, feature_names)
+    check_predictions(relation, forest, model, get_sample(inss, num_instances))
+    forest.save(flat_model_dir)
+    return forest
+
+
+def benchmark(relation, num_instances=1000):
+    """Compares the flat forest with the ML.apply_model path on the first instances of the relation, in running time;
+    an AssertionError is raised if any prediction differs.
+    """
+    from nordlys.core.ml.instances import Instances
+    model_file, flat_model_dir = get_model_files(relation)
+    inss_file = PROFESSION_INSS_ALL if relation == REL_PROFESSION else NATIONALITY_INSS_ALL
+
+    inss = get_sample(Instances.from_json(inss_file), num_instances)
+    t = time.time()
+    model = pickle.load(open(model_file, "rb"))
+    print("Unpickling model: {:.3f}s".format(time.time() - t))
+    t = time.time()
+    forest = FlatForest.load(flat_model_dir)
+    print("Loading flat forest: {:.3f}s".format(time.time() - t))
+
+    time_ml, time_flat = check_predictions(relation, forest, model, inss)
+    print("{} instances, {} trees, identical predictions".format(len(inss.get_all()), forest.num_trees))
+    print("ML.apply_model: {:.3f}s\tflat forest: {:.3f}s\tspeed-up: {:.1f}x".format(time_ml, time_flat,
+                                                                                     time_ml / max(time_flat, 1e-9)))
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--relation", help="relation", choices=VALID_RELS, required=True)
+    parser.add_argument("-b", "--benchmark", help="benchmarks the compiled model against ML.apply_model",
+                        action="store_true", default=False)
+    parser.add_argument("-n", "--num_instances", help="number of instances checked against ML.apply_model", type=int,
+                        default=1000)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    if args.benchmark:
+        benchmark(args.relation, args.num_instances)
+    else:
+        compile_model(args.relation, args.num_instances)
+
+
+if __name__ == "__main__":
+    main(arg_parser())
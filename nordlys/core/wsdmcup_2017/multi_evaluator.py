@@ -0,0 +1,168 @@
+"""
+Multi-run evaluator
+-------------------
+
+Evaluates many runs against the same ground truth, with the measures of evaluator.py (accuracy, average score
+difference, average Kendall's tau). The truth file is read and validated once, into arrays of scores and subject
+groups. A run file is then read as raw bytes and compared with the truth bytes at once: it is valid if it differs only
+in the score bytes, and these are all in [0..7]. Runs that do not pass this check are read and validated with
+evaluator.read_files, which gives the same results (or the same AssertionError) as evaluator.py. Runs are evaluated in
+parallel, and results are written as a single table.
+
+Usage::
+
+    python -m nordlys.core.wsdmcup_2017.multi_evaluator -t <truth_file> -r <run_file> [<run_file> ...] [-o <output>]
+
+@author: Faegheh Hasibi
+"""
+
+import argparse
+import os
+import re
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from nordlys.core.wsdmcup_2017.evaluator import read_files, kendall_tau_groups
+
+
+class Truth(object):
+    """Ground truth scores, grouped by subject."""
+
+    def __init__(self, truth_file):
+        """Reads and validates the truth file (with the formatting rules of evaluator.py)."""
+        self.__truth_file = truth_file
+        self.__data = np.fromfile(truth_file, dtype=np.uint8)
+        score_offsets, groups = [], []
+        last_subject, offset = None, 0
+        with open(truth_file, "rb") as f:
+            for i, line in enumerate(f, 1):
+                cols = line.split(b"\t")
+                line_str = ", at line " + str(i)
+                assert len(cols) == 3, "#columns != 3 in truth file" + line_str
+                assert re.match(b"^[0-7]$", cols[2].rstrip()), "score not [0..7] in truth file" + line_str
+                if cols[0] != last_subject:
+                    last_subject = cols[0]
+                    groups.append(0)
+                groups[-1] += 1
+                score_offsets.append(offset + len(cols[0]) + len(cols[1]) + 2)
+                offset += len(line)
+        self.__score_offsets = np.array(score_offsets, dtype=np.int64)
+        self.__scores = (self.__data[self.__score_offsets] - ord("0")).astype(np.int64)
+        self.__num_groups = len(groups)
+        self.__groups = np.repeat(np.arange(self.__num_groups), groups)
+
+    @property
+    def truth_file(self):
+        return self.__truth_file
+
+    @property
+    def num_triples(self):
+        return len(self.__scores)
+
+    @property
+    def num_subjects(self):
+        return self.__num_groups
+
+    def read_run(self, run_file):
+        """Reads the scores of a run, and checks that it matches the truth file.
+
+        :return: array of scores
+        """
+        data = np.fromfile(run_file, dtype=np.uint8)
+        if len(data) == len(self.__data):
+            diff = np.flatnonzero(data != self.__data)
+            pos = np.searchsorted(self.__score_offsets, diff)
+            if np.all(self.__score_offsets[np.minimum(pos, len(self.__score_offsets) - 1)] == diff):
+                scores = data[self.__score_offsets].astype(np.int64) - ord("0")
+                if np.all((scores >= 0) & (scores <= 7)):
+                    return scores
+        # not byte-identical apart from the scores: reads it with the (slower) checks of evaluator.py
+        scores, _ = read_files(run_file, self.__truth_file)
+        return np.array([score for group in scores for score in group], dtype=np.int64)
+
+    def evaluate(self, scores):
+        """Computes the measures of a run.
+
+        :param scores: array of run scores (see read_run)
+        :return: dictionary with acc, asd, and tau
+        """
+        diff = np.abs(scores - self.__scores)
+        taus = kendall_tau_groups(scores, self.__scores, self.__groups, self.__num_groups)
+        # same operations as evaluator.py (integer sums, taus added one after the other)
+        return {"acc": int(np.count_nonzero(diff <= 2)) / self.num_triples,
+                "asd": int(diff.sum()) / self.num_triples,
+                "tau": float(np.cumsum(taus)[-1]) / self.num_subjects}
+
+    def get_subject_measures(self, scores):
+        """Computes the measures of a run per subject.
+
+        :param scores: array of run scores (see read_run)
+        :return: dictionary of arrays, with the number of triples ("triples"), the number of accurate triples ("acc"),
+            the sum of score differences ("asd"), and the Kendall's tau ("tau") of each subject
+        """
+        diff = np.abs(scores - self.__scores)
+        return {"triples": np.bincount(self.__groups, minlength=self.__num_groups),
+                "acc": np.bincount(self.__groups, weights=diff <= 2, minlength=self.__num_groups),
+                "asd": np.bincount(self.__groups, weights=diff, minlength=self.__num_groups),
+                "tau": kendall_tau_groups(scores, self.__scores, self.__groups, self.__num_groups)}
+
+
+def _init_worker(truth):
+    global _truth
+    _truth = truth
+
+
+def _evaluate_run(run_file):
+    """Evaluates a run in a worker process; formatting errors are returned instead of raised."""
+    try:
+        return run_file, _truth.evaluate(_truth.read_run(run_file))
+    except AssertionError as e:
+        return run_file, {"error": str(e)}
+
+
+def evaluate_runs(truth_file, run_files, num_workers=cpu_count()):
+    """Evaluates the runs against the truth file.
+
+    :return: list of (run file, results) pairs, in the order of run_files; results have acc, asd, and tau, or an error
+    """
+    truth = Truth(truth_file)
+    print("Truth: {} triples, {} subjects".format(truth.num_triples, truth.num_subjects))
+    if num_workers > 1 and len(run_files) > 1:
+        with Pool(min(num_workers, len(run_files)), initializer=_init_worker, initargs=(truth,)) as pool:
+            return pool.map(_evaluate_run, run_files)
+    _init_worker(truth)
+    return [_evaluate_run(run_file) for run_file in run_files]
+
+
+def write_results(run_results, output_file=None):
+    """Prints the results as a table (and writes them to the output file, if given)."""
+    lines = ["\t".join(["run", "acc", "asd", "tau"])]
+    for run_file, res in run_results:
+        if "error" in res:
+            lines.append("\t".join([run_file, "error: " + res["error"]]))
+        else:
+            lines.append("\t".join([run_file] + ["{:.4f}".format(res[m]) for m in ["acc", "asd", "tau"]]))
+    print("\n".join(lines))
+    if output_file:
+        with open(output_file, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        print("Output file:", output_file)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", "--truth", help="ground truth file", type=str, required=True)
+    parser.add_argument("-r", "--runs", help="run files", nargs="+", required=True)
+    parser.add_argument("-n", "--num_workers", help="number of worker processes", type=int, default=cpu_count())
+    parser.add_argument("-o", "--output_file", help="writes the results to this file", type=str)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    write_results(evaluate_runs(args.truth, args.runs, args.num_workers), args.output_file)
+
+
+if __name__ == "__main__":
+    main(arg_parser())
@@ -0,0 +1,207 @@
+"""
+Parallel cross-validation
+-------------------------
+
+Person-based k-fold cross-validation of the triple scorer, with the folds trained and applied concurrently on a pool of
+worker processes. The train instances are read once, before the pool is created, and are inherited by the workers
+(fork), which only receive the instance ids of their fold. Each fold is trained and applied with ``ML.train_model`` and
+``ML.apply_model``, so features are converted to the model input (column order, missing values) exactly as in
+``ML.run()``; the splits are created by ``CrossValidation`` with the person split strategy, as in ``ML.run()``.
+
+Splits are stored as ``{fold: {"training": [instance ids], "testing": [instance ids]}}``.
+
+With ``-v``, the predictions are checked against ``ML.run()`` on the same splits (the random state of the models is
+seeded in the same way in both runs), and an AssertionError is raised if any of them differs.
+
+Usage::
+
+    python -m nordlys.core.wsdmcup_2017.parallel_cv -r profession [-n 5] [-c] [-v]
+
+@author: Faegheh Hasibi
+"""
+
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from nordlys.core.wsdmcup_2017.config import *
+
+SPLITS_F = sep.join([DATA_DIR, "splits.json"])
+
+
+def get_train_file(relation):
+    return PROFESSION_INSS_TRAIN if relation == REL_PROFESSION else NATIONALITY_INSS_TRAIN
+
+
+def load_train_instances(relation):
+    """Reads the train instances of the relation."""
+    from nordlys.core.ml.instances import Instances
+    return Instances.from_json(get_train_file(relation))
+
+
+def load_splits(inss, splits_file=SPLITS_F, k=5, create=False):
+    """Loads the splits, or creates (and saves) them if asked or if the splits file does not exist.
+    Splits are created by CrossValidation, with the person split strategy of TripleScorer.
+
+    :return: dictionary {fold: {"training": [instance ids], "testing": [instance ids]}}
+    """
+    if create or not os.path.exists(splits_file):
+        from nordlys.core.ml.cross_validation import CrossValidation
+        cv = CrossValidation(k, inss, None, None)
+        cv.create_folds(group_by="person")
+        cv.save_folds(splits_file)
+        print("Splits file:", splits_file)
+    return json.load(open(splits_file, "r"))
+
+
+def get_folds(splits):
+    """Returns the folds as a list of (fold, training instance ids, testing instance ids), in fold order."""
+    return [(fold, splits[fold]["training"], splits[fold]["testing"]) for fold in sorted(splits, key=int)]
+
+
+def get_instances(inss, ins_ids):
+    """Returns the instances with the given ids, as Instances."""
+    from nordlys.core.ml.instances import Instances
+    res = Instances()
+    for ins_id in ins_ids:
+        res.add_instance(inss.get_instance(ins_id))
+    return res
+
+
+def train_apply_fold(ml_config, inss, train_ids, test_ids, seed=None):
+    """Trains a model on the training instances and applies it to the testing instances, with ML.
+
+    :param seed: if given, the random state of numpy is seeded before training (see verify)
+    :return: array of the scores of the testing instances, in the order of test_ids
+    """
+    from nordlys.core.ml.ml import ML
+    ml = ML({key: val for key, val in ml_config.items() if key != "save_model"})  # folds are not saved
+    if seed is not None:
+        np.random.seed(seed)
+    model = ml.train_model(get_instances(inss, train_ids))
+    test_inss = ml.apply_model(get_instances(inss, test_ids), model)
+    return np.array([ins.score for ins in test_inss.get_all()], dtype=np.float64)
+
+
+def _init_worker(inss):
+    global _inss
+    _inss = inss
+
+
+def run_fold(task, inss):
+    """Runs a (task id, ML config, training ids, testing ids, seed) task.
+
+    :return: task id, predictions, running time
+    """
+    task_id, ml_config, train_ids, test_ids, seed = task
+    t = time.time()
+    predictions = train_apply_fold(ml_config, inss, train_ids, test_ids, seed)
+    return task_id, predictions, time.time() - t
+
+
+def _run_fold(task):
+    """Runs a task in a worker process, on the inherited train instances."""
+    return run_fold(task, _inss)
+
+
+def run_tasks(tasks, inss, num_workers):
+    """Runs (task id, ML config, training ids, testing ids, seed) tasks on a pool of workers sharing the instances.
+
+    :return: generator of (task id, predictions, running time), in order of completion
+    """
+    with Pool(min(num_workers, len(tasks)) or 1, initializer=_init_worker, initargs=(inss,)) as pool:
+        for res in pool.imap_unordered(_run_fold, tasks):
+            yield res
+
+
+def cross_validate(relation, ml_config, num_workers=5, k=5, splits_file=SPLITS_F, create_splits=True, seed=None):
+    """Performs person-based cross-validation, running the folds in parallel.
+
+    :param relation: relation of the train instances
+    :param ml_config: ML config of the model (see TripleScorer.gen_ml_config)
+    :param num_workers: number of worker processes (1 runs the folds one at a time, in this process)
+    :param k: number of folds
+    :param splits_file: splits file
+    :param create_splits: if True, creates new splits; otherwise, the splits of the splits file are used
+    :param seed: if given, the random state is seeded with it before training each fold
+    :return: dictionary {(person id, item id): score}
+    """
+    t = time.time()
+    inss = load_train_instances(relation)
+    print("Train instances: {} ({:.1f}s)".format(len(inss.get_all()), time.time() - t))
+    tasks = [(fold, ml_config, train_ids, test_ids, seed)
+             for fold, train_ids, test_ids in get_folds(load_splits(inss, splits_file, k, create_splits))]
+    test_ids = {fold: ids for fold, _, _, ids, _ in tasks}
+
+    if num_workers > 1:
+        results = run_tasks(tasks, inss, num_workers)
+    else:
+        results = (run_fold(task, inss) for task in tasks)
+    scores = {}
+    for fold, predictions, fold_time in results:
+        print("Fold {} done ({:.1f}s)".format(fold, fold_time))
+        for ins_id, score in zip(test_ids[fold], predictions.tolist()):
+            ins = inss.get_instance(ins_id)
+            scores[(ins.get_property("person"), ins.get_property(relation))] = score
+    print("Cross-validation: {:.1f}s".format(time.time() - t))
+    return scores
+
+
+def verify(relation, ml_config, num_workers=5, splits_file=SPLITS_F, seed=0):
+    """Checks that the parallel cross-validation gives the same predictions as ML.run(), on the splits of the splits
+    file (created if it does not exist). The random state is seeded with the same seed before training each fold.
+
+    :return: number of checked predictions
+    """
+    from nordlys.core.ml.ml import ML
+
+    class SeededML(ML):
+        def train_model(self, instances):
+            np.random.seed(seed)
+            return super(SeededML, self).train_model(instances)
+
+    splits = load_splits(load_train_instances(relation), splits_file)
+    config = dict(ml_config)
+    config["cross_validation"] = {"create_splits": False, "splits_file": splits_file, "k": len(splits),
+                                  "split_strategy": "person"}
+    config["training_set"] = get_train_file(relation)
+    expected = {(ins.get_property("person"), ins.get_property(relation)): ins.score
+                for ins in SeededML(config).run().get_all()}
+    scores = cross_validate(relation, ml_config, num_workers, splits_file=splits_file, create_splits=False, seed=seed)
+    assert scores.keys() == expected.keys(), "scored instances differ from ML.run()"
+    diffs = [key for key, score in scores.items() if score != expected[key]]
+    if diffs:
+        raise AssertionError("{} of {} predictions differ from ML.run(), e.g. {}: {} != {}".format(
+            len(diffs), len(scores), diffs[0], scores[diffs[0]], expected[diffs[0]]))
+    print("Predictions of", len(scores), "instances are the same as ML.run()")
+    return len(scores)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--relation", help="relation", choices=VALID_RELS, required=True)
+    parser.add_argument("-n", "--num_workers", help="number of worker processes", type=int, default=5)
+    parser.add_argument("-k", "--folds", help="number of folds", type=int, default=5)
+    parser.add_argument("-c", "--create_splits", help="creates new splits", action="store_true", default=False)
+    parser.add_argument("-v", "--verify", help="checks the predictions against ML.run() on the existing splits",
+                        action="store_true", default=False)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    from nordlys.core.wsdmcup_2017.triple_scorer import TripleScorer
+    if args.verify:
+        verify(args.relation, TripleScorer.gen_ml_config(args.relation), args.num_workers)
+        return
+    scorer = TripleScorer(args.relation)
+    scored_items = scorer.cross_validate(args.num_workers, args.folds, args.create_splits)
+    print(len(scored_items), "instances scored")
+
+
+if __name__ == "__main__":
+    main(arg_parser())
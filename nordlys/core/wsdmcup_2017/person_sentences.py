@@ -0,0 +1,69 @@
+"""
+Person sentences
+----------------
+
+Postings from person ids to the (sorted) doc ids of the Wikipedia sentences linking to them.
+They are written by the sentence indexer, so that the sentences of a person are looked up without querying the index
+(and without the 10,000-hit limit of Elastic searches). Files:
+
+- ``person_ids.txt``: person ids, one per line, in the order of their postings
+- ``offsets.npy``: start of each person's postings in ``sentences.npy`` (plus the total length)
+- ``sentences.npy``: concatenated postings of sentence doc ids
+
+@author: Shuo Zhang
+"""
+
+import os
+from array import array
+
+import numpy as np
+
+from nordlys.core.wsdmcup_2017.config import PERSON_SENTENCES_DIR
+
+
+class PersonSentences(object):
+    def __init__(self, postings_dir=PERSON_SENTENCES_DIR):
+        with open(os.sep.join([postings_dir, "person_ids.txt"]), "r") as f:
+            self.__rows = {line.rstrip("\n"): i for i, line in enumerate(f)}
+        self.__offsets = np.load(os.sep.join([postings_dir, "offsets.npy"]), mmap_mode="r")
+        self.__sentences = np.load(os.sep.join([postings_dir, "sentences.npy"]), mmap_mode="r")
+
+    def get_sentences(self, person_id):
+        """Returns the sorted doc ids of sentences containing the person (empty array for unknown persons)."""
+        row = self.__rows.get(person_id)
+        if row is None:
+            return np.zeros(0, dtype=np.int32)
+        return self.__sentences[self.__offsets[row]:self.__offsets[row + 1]]
+
+    def num_sentences(self, person_id):
+        row = self.__rows.get(person_id)
+        return int(self.__offsets[row + 1] - self.__offsets[row]) if row is not None else 0
+
+
+class PersonSentencesBuilder(object):
+    """Collects postings while indexing; doc ids must be added in increasing order."""
+
+    def __init__(self):
+        self.__postings = {}
+
+    def add(self, doc_id, person_ids):
+        for person_id in person_ids:
+            postings = self.__postings.setdefault(person_id, array("i"))
+            if len(postings) == 0 or postings[-1] != doc_id:  # a person may be linked twice in a sentence
+                postings.append(doc_id)
+
+    def save(self, postings_dir=PERSON_SENTENCES_DIR):
+        os.makedirs(postings_dir, exist_ok=True)
+        person_ids = sorted(self.__postings)
+        offsets = np.zeros(len(person_ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(self.__postings[person_id]) for person_id in person_ids])
+        sentences = np.lib.format.open_memmap(os.sep.join([postings_dir, "sentences.npy"]), mode="w+",
+                                              dtype=np.int32, shape=(int(offsets[-1]),))
+        for i, person_id in enumerate(person_ids):
+            sentences[offsets[i]:offsets[i + 1]] = np.frombuffer(self.__postings[person_id], dtype=np.int32)
+        sentences.flush()
+        np.save(os.sep.join([postings_dir, "offsets.npy"]), offsets)
+        with open(os.sep.join([postings_dir, "person_ids.txt"]), "w") as f:
+            for person_id in person_ids:
+                f.write(person_id + "\n")
+        print("Person sentences:", len(person_ids), "persons,", offsets[-1], "postings")
@@ -0,0 +1,187 @@
+"""
+Person term frequencies
+-----------------------
+
+Aggregated term frequencies of persons over the Wikipedia sentences linking to them, shared by the feature generators
+(feat_termstats, feat_w2v_sim, ...). They are computed once per person and stored as sparse arrays:
+
+- ``person_ids.txt``: person ids, one per line, in the order of their entries
+- ``vocab.txt``: terms, one per line, in term id order
+- ``offsets.npy``: start of each person's entries in ``term_ids.npy`` and ``freqs.npy`` (plus the total length)
+- ``term_ids.npy``, ``freqs.npy``: concatenated term ids and aggregated frequencies
+- ``num_sentences.npy``: number of sentences of each person
+
+Persons not in the store are aggregated from the sentence index (or the sentence-term matrix and person postings).
+
+@author: Shuo Zhang
+"""
+
+import argparse
+import os
+from array import array
+
+import numpy as np
+
+from nordlys.core.retrieval.local_index import open_index, raw_to_npy
+from nordlys.core.utils.file_utils import FileUtils
+from nordlys.core.wsdmcup_2017.config import WP_ST_INDEX_ID, PERSON_TF_DIR, PROFESSION_TRANSLATIONS_F
+from nordlys.core.wsdmcup_2017.person_sentences import PersonSentences
+from nordlys.core.wsdmcup_2017.sentence_term_matrix import SentenceTermMatrix
+
+
+class PersonTF(object):
+    """Reads the person TF store."""
+
+    def __init__(self, store_dir=PERSON_TF_DIR):
+        with open(os.sep.join([store_dir, "person_ids.txt"]), "r") as f:
+            self.__rows = {line.rstrip("\n"): i for i, line in enumerate(f)}
+        with open(os.sep.join([store_dir, "vocab.txt"]), "r", encoding="utf-8") as f:
+            self.__terms = [line.rstrip("\n") for line in f]
+        self.__offsets = np.load(os.sep.join([store_dir, "offsets.npy"]), mmap_mode="r")
+        self.__term_ids = np.load(os.sep.join([store_dir, "term_ids.npy"]), mmap_mode="r")
+        self.__freqs = np.load(os.sep.join([store_dir, "freqs.npy"]), mmap_mode="r")
+        self.__num_sentences = np.load(os.sep.join([store_dir, "num_sentences.npy"]), mmap_mode="r")
+
+    def __contains__(self, person_id):
+        return person_id in self.__rows
+
+    def get_tf(self, person_id):
+        """Returns the aggregated TF of the person, {term: freq, ...}, and the number of their sentences.
+
+        :return: (tf_agg, num_sent), or None if the person is not in the store
+        """
+        row = self.__rows.get(person_id)
+        if row is None:
+            return None
+        start, end = self.__offsets[row], self.__offsets[row + 1]
+        tf_agg = {self.__terms[term_id]: freq for term_id, freq in
+                  zip(self.__term_ids[start:end].tolist(), self.__freqs[start:end].tolist())}
+        return tf_agg, int(self.__num_sentences[row])
+
+
+class PersonTFBuilder(object):
+    """Writes the person TF store; entries are written to raw files as they are added."""
+
+    def __init__(self, store_dir=PERSON_TF_DIR):
+        os.makedirs(store_dir, exist_ok=True)
+        self.__store_dir = store_dir
+        self.__vocab = {}
+        self.__person_ids = []
+        self.__offsets = array("q", [0])
+        self.__num_sentences = array("q")
+        self.__f_term_ids = open(os.sep.join([store_dir, "term_ids.tmp"]), "wb")
+        self.__f_freqs = open(os.sep.join([store_dir, "freqs.tmp"]), "wb")
+
+    def add(self, person_id, tf_agg, num_sent):
+        self.__f_term_ids.write(array("i", [self.__vocab.setdefault(term, len(self.__vocab))
+                                            for term in tf_agg]).tobytes())
+        self.__f_freqs.write(array("q", [int(freq) for freq in tf_agg.values()]).tobytes())
+        self.__person_ids.append(person_id)
+        self.__offsets.append(self.__offsets[-1] + len(tf_agg))
+        self.__num_sentences.append(num_sent)
+
+    def close(self):
+        self.__f_term_ids.close()
+        self.__f_freqs.close()
+        raw_to_npy(os.sep.join([self.__store_dir, "term_ids.tmp"]), os.sep.join([self.__store_dir, "term_ids.npy"]),
+                   np.int32)
+        raw_to_npy(os.sep.join([self.__store_dir, "freqs.tmp"]), os.sep.join([self.__store_dir, "freqs.npy"]),
+                   np.int64)
+        np.save(os.sep.join([self.__store_dir, "offsets.npy"]), np.array(self.__offsets, dtype=np.int64))
+        np.save(os.sep.join([self.__store_dir, "num_sentences.npy"]), np.array(self.__num_sentences, dtype=np.int64))
+        with open(os.sep.join([self.__store_dir, "vocab.txt"]), "w", encoding="utf-8") as f:
+            for term in sorted(self.__vocab, key=self.__vocab.get):
+                f.write(term + "\n")
+        with open(os.sep.join([self.__store_dir, "person_ids.txt"]), "w") as f:
+            for person_id in self.__person_ids:
+                f.write(person_id + "\n")
+        print("Person TF:", len(self.__person_ids), "persons,", len(self.__vocab), "terms,", self.__offsets[-1],
+              "entries")
+
+
+class PersonTFSource(object):
+    """Aggregated TF of persons, read from the store if available, otherwise computed from the sentences.
+    The last person is memoized, as .kb files list the items of a person in consecutive lines.
+    """
+    CONTENT_FIELD = "content"
+
+    def __init__(self, index_name=WP_ST_INDEX_ID, local_index_dir=None, tf_matrix_dir=None,
+                 person_sentences_dir=None, person_tf_dir=None):
+        self.__index_name = index_name
+        self.__local_index_dir = local_index_dir
+        self.__elastic = None  # opened when needed
+        self.__tf_matrix = SentenceTermMatrix(tf_matrix_dir) if tf_matrix_dir else None
+        self.__person_sentences = PersonSentences(person_sentences_dir) if person_sentences_dir else None
+        self.__person_tf = PersonTF(person_tf_dir) if person_tf_dir else None
+        self.__last = (None, None)
+
+    @property
+    def elastic(self):
+        if self.__elastic is None:
+            self.__elastic = open_index(self.__index_name, self.__local_index_dir)
+        return self.__elastic
+
+    def aggregate(self, person_id):
+        """Aggregates the TF of a person over their sentences.
+
+        :return: (tf_agg, num_sent)
+        """
+        if self.__person_sentences:  # all the person's sentences, without the 10,000-hit limit
+            doc_ids = self.__person_sentences.get_sentences(person_id)
+        else:
+            doc_ids = self.elastic.search(person_id, self.CONTENT_FIELD, num=10000).keys()
+        if self.__tf_matrix:  # sparse row-sum over the person's sentences
+            tf_agg = self.__tf_matrix.term_freqs(doc_ids)
+        else:
+            tf_agg = self.elastic.mterm_freqs(doc_ids, self.CONTENT_FIELD)
+        return tf_agg, len(doc_ids)
+
+    def get_person_tf(self, person_id):
+        """Returns the aggregated TF of a person, {term: freq, ...}, and the number of their sentences."""
+        if self.__last[0] != person_id:
+            res = self.__person_tf.get_tf(person_id) if self.__person_tf else None
+            self.__last = person_id, res if res is not None else self.aggregate(person_id)
+        return self.__last[1]
+
+
+def build(kb_files, store_dir=PERSON_TF_DIR, local_index_dir=None, tf_matrix_dir=None, person_sentences_dir=None):
+    """Builds the person TF store for all the persons of the given .kb files.
+
+    :param kb_files: list of .kb files, with person ids in the first column
+    :param store_dir: output directory
+    """
+    person_ids = set()
+    for kb_file in kb_files:
+        for line in FileUtils.read_file_as_list(kb_file):
+            person_ids.add(line.split("\t", maxsplit=1)[0])
+    print(len(person_ids), "persons")
+
+    source = PersonTFSource(local_index_dir=local_index_dir, tf_matrix_dir=tf_matrix_dir,
+                            person_sentences_dir=person_sentences_dir)
+    builder = PersonTFBuilder(store_dir)
+    for i, person_id in enumerate(sorted(person_ids), 1):
+        tf_agg, num_sent = source.aggregate(person_id)
+        builder.add(person_id, tf_agg, num_sent)
+        if i % 10000 == 0:
+            print(i / 1000, "K persons processed.")
+    builder.close()
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", "--kb_files", help=".kb files with the persons", nargs="+",
+                        default=[PROFESSION_TRANSLATIONS_F])
+    parser.add_argument("-o", "--output_dir", help="output directory", type=str, default=PERSON_TF_DIR)
+    parser.add_argument("-l", "--local_index_dir", help="local index directory (instead of Elastic)", type=str)
+    parser.add_argument("-m", "--tf_matrix_dir", help="sentence-term matrix directory", type=str)
+    parser.add_argument("-p", "--person_sentences_dir", help="person-sentence postings directory", type=str)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    build(args.kb_files, args.output_dir, args.local_index_dir, args.tf_matrix_dir, args.person_sentences_dir)
+
+
+if __name__ == "__main__":
+    main(arg_parser())
@@ -0,0 +1,439 @@
+"""
+Pipeline
+--------
+
+Declarative runner of the data generation steps (see scripts.md): each stage declares its input and output files
+(or directories), the arguments it is called with, and the modules implementing it. A stage is re-run only if it is
+stale, i.e., any of its outputs is missing or its fingerprint differs from the one recorded in its last successful
+run. The fingerprint of a stage is the hash of:
+
+- the content (md5) of its inputs; checksums are cached by file size and modification time,
+- its arguments,
+- the source code of its modules, so that changing parameters defined in code (e.g. ``FeaturesTermStats.K_VALUES``,
+  ``ProfStats.K``) invalidates the stage.
+
+Stages depend on the stages producing their inputs, and independent stages are run in parallel.
+Note that the Elastic index is not fingerprinted; stages read it only if they are not given a local index or
+sentence-term matrix directory.
+
+Usage::
+
+    python -m nordlys.core.wsdmcup_2017.pipeline -r profession -n 4 [-t <stage> ...] [-d]
+
+@author: Dario Garigliotti
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from nordlys.core.utils.file_utils import FileUtils
+from nordlys.core.wsdmcup_2017.agg_feat import set_feature_files
+from nordlys.core.wsdmcup_2017.config import *
+
+PKG = "nordlys.core.wsdmcup_2017."
+REL_PREFIXES = {REL_PROFESSION: "prof", REL_NATIONALITY: "nat"}  # for stage names
+
+
+class Stage(object):
+    def __init__(self, name, func, inputs, outputs, kwargs=None, modules=None):
+        """
+        :param name: stage name
+        :param func: module-level function running the stage, called as func(**kwargs)
+        :param inputs: list of input files or directories
+        :param outputs: list of output files or directories
+        :param kwargs: arguments of func
+        :param modules: names of the modules implementing the stage (default: the module of func)
+        """
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.kwargs = kwargs or {}
+        self.modules = modules or [func.__module__]
+
+
+class Pipeline(object):
+    def __init__(self, stages, state_file=PIPELINE_STATE_F):
+        self.__stages = {}
+        producers = {}  # output -> stage name
+        for stage in stages:
+            assert stage.name not in self.__stages, "Duplicate stage " + stage.name
+            self.__stages[stage.name] = stage
+            for output in stage.outputs:
+                assert output not in producers, "Output " + output + " produced by more than one stage"
+                producers[output] = stage.name
+        self.__deps = {stage.name: {producers[i] for i in stage.inputs if i in producers} for stage in stages}
+        self.__order = self.__sort()
+        self.__state_file = state_file
+        self.__state = {"stages": {}, "checksums": {}}
+        if os.path.exists(state_file):
+            with open(state_file, "r") as f:
+                self.__state = json.load(f)
+
+    def __sort(self):
+        """Returns the stage names in topological order."""
+        order, visiting, visited = [], set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            assert name not in visiting, "Cycle in the pipeline at stage " + name
+            visiting.add(name)
+            for dep in sorted(self.__deps[name]):
+                visit(dep)
+            visiting.remove(name)
+            visited.add(name)
+            order.append(name)
+
+        for name in self.__stages:
+            visit(name)
+        return order
+
+    def __select(self, targets):
+        """Returns the target stages and all the stages they depend on, in topological order."""
+        if not targets:
+            return list(self.__order)
+        selected = set()
+        to_visit = list(targets)
+        while to_visit:
+            name = to_visit.pop()
+            if name not in self.__stages:
+                raise KeyError("Unknown stage " + name)
+            if name not in selected:
+                selected.add(name)
+                to_visit += self.__deps[name]
+        return [name for name in self.__order if name in selected]
+
+    def __file_checksum(self, path):
+        """Returns the md5 of a file, cached by its size and modification time."""
+        st = os.stat(path)
+        cached = self.__state["checksums"].get(path)
+        if cached is None or cached[:2] != [st.st_size, st.st_mtime_ns]:
+            cached = [st.st_size, st.st_mtime_ns, FileUtils.checksum(path)]
+            self.__state["checksums"][path] = cached
+        return cached[2]
+
+    def checksum(self, path):
+        """Returns the content hash of a file, or of all the files in a directory (with their relative paths)."""
+        if not os.path.isdir(path):
+            return self.__file_checksum(path)
+        md5 = hashlib.md5()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file_name in sorted(files):
+                file_path = os.sep.join([root, file_name])
+                md5.update((os.path.relpath(file_path, path) + "\t" + self.__file_checksum(file_path) + "\n").encode())
+        return md5.hexdigest()
+
+    def fingerprint(self, stage):
+        """Computes the fingerprint of a stage; all its inputs must exist."""
+        md5 = hashlib.md5()
+        md5.update(stage.func.__module__.encode() + b"." + stage.func.__name__.encode())
+        for path in stage.inputs:
+            if not os.path.exists(path):
+                raise FileNotFoundError("Missing input " + path)
+            md5.update((path + "\t" + self.checksum(path) + "\n").encode())
+        md5.update(json.dumps(stage.kwargs, sort_keys=True, default=str).encode())
+        for module in sorted(stage.modules):
+            with open(importlib.util.find_spec(module).origin, "rb") as f:
+                md5.update(f.read())
+        return md5.hexdigest()
+
+    def is_fresh(self, stage, fingerprint):
+        """Checks whether a stage has been run with this fingerprint and its outputs still exist."""
+        return (self.__state["stages"].get(stage.name) == fingerprint and
+                all(os.path.exists(output) for output in stage.outputs))
+
+    def __save_state(self):
+        tmp_file = self.__state_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.__state, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.__state_file)
+
+    def __finish(self, stage, fingerprint):
+        """Records a successful run of a stage."""
+        missing = [output for output in stage.outputs if not os.path.exists(output)]
+        if missing:
+            raise FileNotFoundError("Stage " + stage.name + " did not produce " + ", ".join(missing))
+        self.__state["stages"][stage.name] = fingerprint
+        self.__save_state()
+
+    def run(self, targets=None, num_workers=1, force=False, dry_run=False):
+        """Runs the stale stages needed for the targets (all stages by default).
+
+        :param targets: list of stage names
+        :param num_workers: number of stages run in parallel (in worker processes if > 1)
+        :param force: runs the stages even if they are fresh
+        :param dry_run: only reports which stages would be run
+        :return: dict from stage names to status: fresh, stale (dry run), done, failed, or blocked
+        """
+        pending = self.__select(targets)
+        status = {}
+        running = {}  # future -> (stage, fingerprint)
+        executor = ProcessPoolExecutor(num_workers) if num_workers > 1 and not dry_run else None
+        try:
+            while pending or running:
+                ready = [name for name in pending if all(dep in status for dep in self.__deps[name])]
+                for name in ready:
+                    pending.remove(name)
+                    stage = self.__stages[name]
+                    deps_status = {status[dep] for dep in self.__deps[name]}
+                    if deps_status & {"failed", "blocked"}:
+                        status[name] = "blocked"
+                        print("Blocked:", name)
+                        continue
+                    if "stale" in deps_status:  # dry run: the inputs would be regenerated
+                        status[name] = "stale"
+                        print("Stale:", name)
+                        continue
+                    try:
+                        fingerprint = self.fingerprint(stage)
+                    except FileNotFoundError as e:
+                        status[name] = "failed"
+                        print("Failed:", name, "-", e)
+                        continue
+                    if not force and self.is_fresh(stage, fingerprint):
+                        status[name] = "fresh"
+                        print("Fresh:", name)
+                    elif dry_run:
+                        status[name] = "stale"
+                        print("Stale:", name)
+                    elif executor is None:
+                        print("Running:", name)
+                        status[name] = self.__run_stage(stage, fingerprint)
+                    else:
+                        print("Running:", name)
+                        running[executor.submit(_run_stage, stage.func, stage.kwargs)] = stage, fingerprint
+                if ready or not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, fingerprint = running.pop(future)
+                    status[stage.name] = self.__run_stage(stage, fingerprint, future)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            self.__save_state()  # keeps the input checksums computed so far
+        return status
+
+    def __run_stage(self, stage, fingerprint, future=None):
+        """Runs a stage (or gets the result of its run in a worker) and records it.
+
+        :return: status of the stage
+        """
+        try:
+            if future is None:
+                _run_stage(stage.func, stage.kwargs)
+            else:
+                future.result()
+            self.__finish(stage, fingerprint)
+        except Exception as e:
+            print("Failed:", stage.name, "-", repr(e))
+            return "failed"
+        print("Done:", stage.name)
+        return "done"
+
+
+def _run_stage(func, kwargs):
+    func(**kwargs)
+
+
+# -------
+# Stage functions; modules are imported when the stage is run, so that only the dependencies of the run stages are
+# needed (e.g. the ML ones are not needed for generating features).
+
+def gen_tf_idf(output_file, local_index_dir=None, tf_matrix_dir=None):
+    from nordlys.core.wsdmcup_2017.prof_stats import ProfStats, get_profs
+    prof_stats = ProfStats(local_index_dir=local_index_dir, tf_matrix_dir=tf_matrix_dir)
+    profs = get_profs(PROFESSIONS_F)
+    if tf_matrix_dir:
+        prof_stats.gen_all_stats(profs, output_file)
+        return
+    open(output_file, "w").write("")
+    for prof in profs:
+        prof_stats.gen_stats(prof, output_file)
+
+
+def gen_termstats(stats_file, kb_file, output_file, local_index_dir=None, tf_matrix_dir=None, person_tf_dir=None):
+    from nordlys.core.wsdmcup_2017.feat_termstats import FeaturesTermStats
+    fts = FeaturesTermStats(local_index_dir=local_index_dir, tf_matrix_dir=tf_matrix_dir, person_tf_dir=person_tf_dir)
+    fts.load_termstats(stats_file)
+    fts.generate_features(kb_file, output_file)
+
+
+def gen_w2v_matrix(matrix_dir, items_tfidf_fpath, first_snippets_fpath):
+    from nordlys.core.wsdmcup_2017.feat_w2v_sim_approx import build_w2v_matrix
+    build_w2v_matrix(matrix_dir, items_tfidf_fpath, first_snippets_fpath)
+
+
+def gen_w2v_sim(stats_file, kb_file, output_file, local_index_dir=None, tf_matrix_dir=None, person_tf_dir=None,
+                w2v_matrix_dir=None):
+    from nordlys.core.wsdmcup_2017.feat_w2v_sim import FeaturesW2VSim
+    fts = FeaturesW2VSim(local_index_dir=local_index_dir, tf_matrix_dir=tf_matrix_dir, person_tf_dir=person_tf_dir,
+                         w2v_matrix_dir=w2v_matrix_dir)
+    fts.load_termstats(stats_file)
+    fts.generate_features(kb_file, output_file)
+
+
+def gen_w2v_sim_approx(all_items_fpath, items_tfidf_fpath, first_snippets_fpath, person_items_fpath, output_file,
+                       w2v_matrix_dir=None):
+    from nordlys.core.wsdmcup_2017.feat_w2v_sim_approx import FeaturesW2VSimApprox
+    feat = FeaturesW2VSimApprox(w2v_matrix_dir)
+    feat.get_all_features_approx(all_items_fpath, items_tfidf_fpath, first_snippets_fpath, person_items_fpath,
+                                 output_file)
+
+
+def gen_fst_wp_features(all_items_fpath, first_snippets_fpath, person_items_fpath, relation, output_dir):
+    if relation == REL_PROFESSION:
+        from nordlys.core.wsdmcup_2017.feat_fst_wp_sentences import main
+    else:
+        from nordlys.core.wsdmcup_2017.feat_fst_wp_sentences_nationality import main
+    os.makedirs(output_dir, exist_ok=True)
+    main(all_items_fpath, first_snippets_fpath, person_items_fpath, relation, output_dir)
+
+
+def gen_freq(kb_file, output_file_noun, output_file_adj, local_index_dir=None, person_sentences_dir=None):
+    from nordlys.core.wsdmcup_2017.feat_freq import FeaturesTermStats
+    fts = FeaturesTermStats(local_index_dir=local_index_dir, person_sentences_dir=person_sentences_dir,
+                            local_cooccurrence=True)
+    fts.generate_features(kb_file, output_file_noun, output_file_adj)
+
+
+def gen_instances(relation, feature_files, output_file, train=False):
+    from nordlys.core.wsdmcup_2017.agg_feat import AggFeat
+    merger = AggFeat(relation)
+    inss = merger.merge_features(feature_files)
+    if train:
+        inss = merger.gen_train_inss(inss)
+    json.dump(inss, open(output_file, "w"), indent=4, sort_keys=True)
+
+
+def train_model(relation):
+    from nordlys.core.wsdmcup_2017.triple_scorer import TripleScorer
+    TripleScorer(relation).train()
+
+
+# -------
+# Stages of each relation
+
+def fst_wp_stages(relation, all_items_fpath, person_items_fpath):
+    stages = []
+    for first_snippets_fpath in [FIRST_WP_ST_F, FIRST_WP_PG_F]:
+        snippet_basename = os.path.basename(first_snippets_fpath).split(".txt")[0]
+        suffixes = [""] if relation == REL_PROFESSION else ["_Noun", "_Adj"]
+        outputs = [os.sep.join([FEATURES_DIR, "is_{}{}_in_{}{}.tsv".format(prefix, relation, snippet_basename, s)])
+                   for prefix in ["", "1st_"] for s in suffixes]
+        module = "feat_fst_wp_sentences" if relation == REL_PROFESSION else "feat_fst_wp_sentences_nationality"
+        stages.append(Stage("{}_{}".format(REL_PREFIXES[relation], snippet_basename.replace("first_wp_", "fst_wp_")),
+                            gen_fst_wp_features,
+                            [all_items_fpath, first_snippets_fpath, person_items_fpath, PERSONS_IDS_F,
+                             PROFESSIONS_IDS_F, NATIONALITIES_IDS_F], outputs,
+                            {"all_items_fpath": all_items_fpath, "first_snippets_fpath": first_snippets_fpath,
+                             "person_items_fpath": person_items_fpath, "relation": relation,
+                             "output_dir": FEATURES_DIR},
+                            [PKG + module, PKG + "snippet_matcher", PKG + "wsdmcup_ids"]))
+    return stages
+
+
+def ml_stages(relation):
+    """Aggregating features into instances, and training."""
+    feature_files = set_feature_files(relation)  # the ones aggregated into instances
+    train_f, inss_train, inss_all, model = (PROFESSION_TRAIN_F, PROFESSION_INSS_TRAIN, PROFESSION_INSS_ALL,
+                                            PROFESSION_MODEL) if relation == REL_PROFESSION else \
+        (NATIONALITY_TRAIN_F, NATIONALITY_INSS_TRAIN, NATIONALITY_INSS_ALL, NATIONALITY_MODEL)
+    modules = [PKG + "agg_feat", PKG + "wsdmcup_ids"]
+    return [
+        Stage(REL_PREFIXES[relation] + "_train_inss", gen_instances, feature_files + [train_f, PERSONS_IDS_F],
+              [inss_train],
+              {"relation": relation, "feature_files": feature_files, "output_file": inss_train, "train": True},
+              modules),
+        Stage(REL_PREFIXES[relation] + "_all_inss", gen_instances, feature_files, [inss_all],
+              {"relation": relation, "feature_files": feature_files, "output_file": inss_all}, modules),
+        Stage(REL_PREFIXES[relation] + "_model", train_model, [inss_train], [model], {"relation": relation},
+              [PKG + "triple_scorer"])
+    ]
+
+
+def profession_stages(local_index_dir=None, tf_matrix_dir=None, person_tf_dir=None, w2v_matrix_dir=None):
+    index_inputs = [d for d in [local_index_dir, tf_matrix_dir, person_tf_dir] if d]
+    person_kwargs = {"local_index_dir": local_index_dir, "tf_matrix_dir": tf_matrix_dir,
+                     "person_tf_dir": person_tf_dir}
+    termstats_f = os.sep.join([FEATURES_DIR, "profession_termstats.tsv"])
+    stages = [
+        Stage("tf_idf", gen_tf_idf, [PROFESSIONS_F] + [d for d in [local_index_dir, tf_matrix_dir] if d], [TF_IDF_F],
+              {"output_file": TF_IDF_F, "local_index_dir": local_index_dir, "tf_matrix_dir": tf_matrix_dir},
+              [PKG + "prof_stats", PKG + "sentence_term_matrix"]),
+        Stage("termstats", gen_termstats, [TF_IDF_F, PROFESSION_TRANSLATIONS_F] + index_inputs, [termstats_f],
+              dict(person_kwargs, stats_file=TF_IDF_F, kb_file=PROFESSION_TRANSLATIONS_F, output_file=termstats_f),
+              [PKG + "feat_termstats", PKG + "person_tf"]),
+        Stage("w2v_sim", gen_w2v_sim, [TF_IDF_F, PROFESSION_TRANSLATIONS_F] + index_inputs +
+              ([w2v_matrix_dir] if w2v_matrix_dir else []), [PROF_W2V_AGGR_COS_SIM_F],
+              dict(person_kwargs, stats_file=TF_IDF_F, kb_file=PROFESSION_TRANSLATIONS_F,
+                   output_file=PROF_W2V_AGGR_COS_SIM_F, w2v_matrix_dir=w2v_matrix_dir),
+              [PKG + "feat_w2v_sim", PKG + "w2v_matrix", PKG + "person_tf"]),
+        Stage("w2v_sim_approx", gen_w2v_sim_approx,
+              [PROFESSIONS_F, TF_IDF_F, FIRST_WP_PG_F, PROF_KB_F] + ([w2v_matrix_dir] if w2v_matrix_dir else []),
+              [PROF_APPROX_W2V_AGGR_COS_SIM_F],
+              {"all_items_fpath": PROFESSIONS_F, "items_tfidf_fpath": TF_IDF_F, "first_snippets_fpath": FIRST_WP_PG_F,
+               "person_items_fpath": PROF_KB_F, "output_file": PROF_APPROX_W2V_AGGR_COS_SIM_F,
+               "w2v_matrix_dir": w2v_matrix_dir},
+              [PKG + "feat_w2v_sim_approx", PKG + "w2v_matrix"])
+    ]
+    if w2v_matrix_dir:
+        stages.append(Stage("w2v_matrix", gen_w2v_matrix, [TF_IDF_F, FIRST_WP_PG_F], [w2v_matrix_dir],
+                            {"matrix_dir": w2v_matrix_dir, "items_tfidf_fpath": TF_IDF_F,
+                             "first_snippets_fpath": FIRST_WP_PG_F},
+                            [PKG + "feat_w2v_sim_approx", PKG + "w2v_matrix"]))
+    return stages + fst_wp_stages(REL_PROFESSION, PROFESSIONS_F, PROF_KB_F) + ml_stages(REL_PROFESSION)
+
+
+def nationality_stages(local_index_dir=None, person_sentences_dir=None):
+    freq_noun_f, freq_adj_f = [os.sep.join([FEATURES_DIR, "nat_features_freq_" + s + ".tsv"]) for s in ["Noun", "Adj"]]
+    stages = [
+        Stage("freq", gen_freq, [NATIONALITY_TRANSLATIONS_F] + [d for d in [local_index_dir, person_sentences_dir]
+                                                                if d], [freq_noun_f, freq_adj_f],
+              {"kb_file": NATIONALITY_TRANSLATIONS_F, "output_file_noun": freq_noun_f, "output_file_adj": freq_adj_f,
+               "local_index_dir": local_index_dir, "person_sentences_dir": person_sentences_dir},
+              [PKG + "feat_freq", PKG + "person_sentences"])
+    ]
+    return stages + fst_wp_stages(REL_NATIONALITY, COUNTRIES_NATIONALITIES_F, NATIONALITY_TRANSLATIONS2_F) + \
+        ml_stages(REL_NATIONALITY)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--relation", help="relation", choices=VALID_RELS + ["all"], default="all")
+    parser.add_argument("-t", "--targets", help="stages to bring up to date (default: all)", nargs="+")
+    parser.add_argument("-n", "--num_workers", help="number of stages run in parallel", type=int, default=1)
+    parser.add_argument("-f", "--force", help="runs the stages even if they are fresh", action="store_true",
+                        default=False)
+    parser.add_argument("-d", "--dry_run", help="only shows the stale stages", action="store_true", default=False)
+    parser.add_argument("-s", "--state_file", help="pipeline state file", type=str, default=PIPELINE_STATE_F)
+    parser.add_argument("-l", "--local_index_dir", help="uses the local index in this directory", type=str)
+    parser.add_argument("-m", "--tf_matrix_dir", help="uses the sentence-term matrix in this directory", type=str)
+    parser.add_argument("-p", "--person_sentences_dir", help="uses the person-sentence postings in this directory",
+                        type=str)
+    parser.add_argument("-u", "--person_tf_dir", help="uses the person TF store in this directory", type=str)
+    parser.add_argument("-w", "--w2v_matrix_dir", help="builds and uses the word2vec matrix in this directory",
+                        type=str)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    stages = []
+    if args.relation in [REL_PROFESSION, "all"]:
+        stages += profession_stages(args.local_index_dir, args.tf_matrix_dir, args.person_tf_dir, args.w2v_matrix_dir)
+    if args.relation in [REL_NATIONALITY, "all"]:
+        stages += nationality_stages(args.local_index_dir, args.person_sentences_dir)
+    status = Pipeline(stages, args.state_file).run(args.targets, args.num_workers, args.force, args.dry_run)
+    for name, s in status.items():
+        print("{}\t{}".format(name, s))
+
+
+if __name__ == "__main__":
+    main(arg_parser())
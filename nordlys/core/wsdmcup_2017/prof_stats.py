@@ -6,8 +6,13 @@
 
 import argparse
 import math
-from nordlys.core.retrieval.elastic_cache import ElasticCache
+
+import numpy as np
+
+from nordlys.core.retrieval import instrumentation
+from nordlys.core.retrieval.local_index import open_index
 from nordlys.core.wsdmcup_2017.config import WP_ST_INDEX_ID, PROFESSIONS_F
+from nordlys.core.wsdmcup_2017.sentence_term_matrix import SentenceTermMatrix
 
 
 class ProfStats():
@@ -15,8 +20,9 @@ class ProfStats():
     PROF_FIELD = "professions"
     K = 30000  # keep top-K profession terms
 
-    def __init__(self, index_name=WP_ST_INDEX_ID):
-        self.__elastic = ElasticCache(index_name)
+    def __init__(self, index_name=WP_ST_INDEX_ID, local_index_dir=None, tf_matrix_dir=None):
+        self.__elastic = open_index(index_name, local_index_dir)
+        self.__tf_matrix = SentenceTermMatrix(tf_matrix_dir) if tf_matrix_dir else None
 
     def gen_stats(self, prof, output_file):
         """Writes the stats into the file."""
@@ -37,6 +43,42 @@ class ProfStats():
         open(output_file, "a").write(out_str)
         return
 
+    def gen_all_stats(self, profs, output_file, start=0):
+        """Writes the stats of all professions into the file, using the sentence-term matrix. Professions are processed
+        one at a time, so that only the term frequencies of one profession are in memory. The output is in the same
+        format as gen_stats.
+
+        :param profs: list of professions (in the format stored in the index)
+        :param output_file: output file
+        :param start: index of the profession to start from
+        """
+        n_docs = self.__tf_matrix.num_sentences
+        terms = self.__tf_matrix.terms
+        with open(output_file, "w") as f:
+            for i, prof in enumerate(profs):
+                if i < start:
+                    continue
+                print("Computing stats for " + str(i + 1) + "th profession: [" + prof + "] ...")
+                term_ids, tf = self.__tf_matrix.profession_row_sum(prof)
+                if len(term_ids) == 0:
+                    continue
+                df = self.__tf_matrix.doc_freqs(term_ids)
+                # idf is computed with math.log for each distinct df, to get the same values as compute_tf_idf
+                dfs, inverse = np.unique(df, return_inverse=True)
+                idf = np.array([math.log(n_docs / d) for d in dfs.tolist()])[inverse]
+                tf_idf = (tf / np.sum(tf)) * idf
+                # top-K terms, sorted by decreasing tf-idf; ties are kept in term order (as the stable sort of
+                # gen_stats), also at the K-th value, so all the terms tied with it are sorted before cutting
+                top = np.arange(len(tf_idf))
+                if len(tf_idf) > self.K:
+                    top = np.flatnonzero(tf_idf >= np.partition(tf_idf, len(tf_idf) - self.K)[len(tf_idf) - self.K])
+                top = top[np.argsort(-tf_idf[top], kind="stable")][:self.K]
+                out_str = ""
+                for t, tf_t, df_t, tfidf in zip(term_ids[top].tolist(), tf[top].tolist(), df[top].tolist(),
+                                                tf_idf[top].tolist()):
+                    out_str += prof + "\t" + terms[t] + "\t" + str(tf_t) + "\t" + str(df_t) + "\t" + str(tfidf) + "\n"
+                f.write(out_str)
+
     def compute_tf_idf(self, tf, df):
         """Computes tf.idf = (tf/doc_len) * (log n(docs)/df)
 
@@ -66,10 +108,13 @@ class ProfStats():
         tf_agg = {}
         df = {}
         # doc_ids = self.__elastic.search(prof, self.PROF_FIELD, num=size).keys()
-        doc_ids = self.__elastic.search_scroll(prof, field=self.PROF_FIELD, num=size).keys()
+        doc_ids = list(self.__elastic.search_scroll(prof, field=self.PROF_FIELD, num=size).keys())
         print(len(doc_ids), "sentences")
-        for i, doc_id in enumerate(doc_ids):
-            tv = self.__elastic.get_termvector(doc_id, self.CONTENT_FIELD, term_stats=True)
+        if self.__tf_matrix:  # sparse row-sum over the profession's sentences
+            tf_agg = self.__tf_matrix.term_freqs(doc_ids)
+            return tf_agg, {t: self.__tf_matrix.doc_freq(t) for t in tf_agg}
+        # term vectors are fetched in chunks of sentences, and aggregated as soon as each chunk is received
+        for _, tv in self.__elastic.iter_mtermvectors(doc_ids, self.CONTENT_FIELD, term_stats=True, chunk_size=size):
             for t, val in tv.items():
                 tf_agg[t] = tf_agg.get(t, 0) + val["term_freq"]
                 if t not in df:
@@ -94,15 +139,28 @@ def arg_parser():
     parser.add_argument("-k", "--k", help="top-k temrs to be stored for each profession", type=int, default=0)
     parser.add_argument("-o", "--output_file", help="output file", type=str, required=True)
     parser.add_argument("-p", "--profession_id", help="profession id to start from", type=int)
+    parser.add_argument("-l", "--local_index_dir", help="uses the local index in this directory", type=str)
+    parser.add_argument("-m", "--tf_matrix_dir", help="uses the sentence-term matrix in this directory", type=str)
+    parser.add_argument("-s", "--single_scan", help="computes all professions from the matrix only (requires -m)",
+                        action="store_true", default=False)
+    parser.add_argument("-i", "--instrument", help="writes a report of index calls to <instrument>.json/.prom",
+                        type=str)
     args = parser.parse_args()
+    if args.single_scan and not args.tf_matrix_dir:
+        parser.error("-s requires the sentence-term matrix (-m)")
     return args
 
 
 def main(args):
     open(args.output_file, "w").write("")
+    if args.instrument:
+        instrumentation.enable(args.instrument)
 
-    prof_stats = ProfStats()
+    prof_stats = ProfStats(local_index_dir=args.local_index_dir, tf_matrix_dir=args.tf_matrix_dir)
     profs = get_profs(PROFESSIONS_F)
+    if args.single_scan:
+        prof_stats.gen_all_stats(profs, args.output_file, args.k)
+        return
     for i in range(args.k, len(profs)):
         print("Computing stats for " + str(i + 1) + "th profession: [" + profs[i] + "] ...")
         prof_stats.gen_stats(profs[i], args.output_file)
@@ -0,0 +1,200 @@
+"""
+Scoring server
+--------------
+
+Long-lived scoring service, which keeps the models, the ID maps and the instances of both relations in memory and
+scores batches of (person, item) pairs over HTTP, on a local port or a Unix socket. Requests are served one at a
+time, in a single thread.
+
+Endpoints:
+
+- ``GET /health``: ``{"status": "ok", "relations": [...]}``
+- ``POST /score`` with ``{"relation": "profession", "items": [[person, item], ...]}``:
+  ``{"scores": [[person, item, score], ...]}``, with one score per requested pair, in the order of the request
+  (repeated pairs are repeated, and pairs without an instance get a null score); persons are in the form of the ID
+  maps (see WSDMCupIDs)
+
+Usage::
+
+    python -m nordlys.core.wsdmcup_2017.scoring_server -s /tmp/wsdmcup.sock [-m] [-f]
+    python -m nordlys.core.wsdmcup_2017.uis_software -i <input> -o <output> -s /tmp/wsdmcup.sock
+
+@author: Faegheh Hasibi
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from nordlys.core.wsdmcup_2017.config import VALID_RELS
+from nordlys.core.wsdmcup_2017.triple_scorer import TripleScorer
+
+
+class ScoringService(object):
+    def __init__(self, relations=VALID_RELS, use_matrix=False, use_flat_forest=False):
+        """Creates the scorers and loads their models and instances.
+
+        :param relations: list of relations to serve
+        :param use_matrix: reads instances from the feature matrices (see TripleScorer)
+        :param use_flat_forest: scores with the flat forests (see TripleScorer)
+        """
+        self.__scorers = {}
+        for relation in relations:
+            scorer = TripleScorer(relation, use_matrix=use_matrix, use_flat_forest=use_flat_forest)
+            scorer.load_model()
+            scorer.load_instances()
+            self.__scorers[relation] = scorer
+
+    @property
+    def relations(self):
+        return sorted(self.__scorers)
+
+    def score(self, relation, person_items):
+        """Scores a batch of (person, item) pairs. Each distinct pair is scored once.
+
+        :return: list of [person, item, score], aligned with person_items (score is None for pairs without an
+            instance)
+        """
+        if relation not in self.__scorers:
+            raise ValueError("Unknown relation: " + str(relation))
+        person_items = [tuple(person_item) for person_item in person_items]
+        scored_items = self.__scorers[relation].score(list(dict.fromkeys(person_items)))
+        return [[person, item, float(scored_items[(person, item)]) if (person, item) in scored_items else None]
+                for person, item in person_items]
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    def address_string(self):
+        # the client address is not a (host, port) pair for Unix sockets
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+
+    def __reply(self, code, res):
+        body = json.dumps(res).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.__reply(404, {"error": "Unknown path " + self.path})
+            return
+        self.__reply(200, {"status": "ok", "relations": self.server.service.relations})
+
+    def do_POST(self):
+        if self.path != "/score":
+            self.__reply(404, {"error": "Unknown path " + self.path})
+            return
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+            scores = self.server.service.score(req["relation"], req["items"])
+        except (ValueError, KeyError, AssertionError) as e:  # bad request, or unknown persons/items
+            self.__reply(400, {"error": repr(e)})
+            return
+        except Exception as e:
+            self.__reply(500, {"error": repr(e)})
+            return
+        self.__reply(200, {"scores": scores})
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    """HTTP server on a Unix socket."""
+
+    def __init__(self, socket_file, handler_class):
+        if os.path.exists(socket_file):
+            os.remove(socket_file)
+        super(UnixHTTPServer, self).__init__(socket_file, handler_class)
+
+
+def serve(service, port=None, socket_file=None, host="localhost"):
+    """Serves the scoring service (until interrupted), on the Unix socket if given, otherwise on the port."""
+    if socket_file:
+        server = UnixHTTPServer(socket_file, ScoringRequestHandler)
+        print("Serving on", socket_file)
+    else:
+        server = HTTPServer((host, port), ScoringRequestHandler)
+        print("Serving on {}:{}".format(host, port))
+    server.service = service
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_file and os.path.exists(socket_file):
+            os.remove(socket_file)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_file, timeout=None):
+        super(UnixHTTPConnection, self).__init__("localhost", timeout=timeout)
+        self.__socket_file = socket_file
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.__socket_file)
+
+
+class ScoringClient(object):
+    def __init__(self, address, timeout=None):
+        """
+        :param address: path of the Unix socket (optionally prefixed with "unix:"), or host:port; a path without
+            the prefix is taken as a socket if it exists or has a directory part
+        """
+        if address.startswith("unix:"):
+            self.__conn = UnixHTTPConnection(address[len("unix:"):], timeout=timeout)
+        elif os.sep in address or os.path.exists(address):
+            self.__conn = UnixHTTPConnection(address, timeout=timeout)
+        else:
+            host, port = address.rsplit(":", 1)
+            self.__conn = http.client.HTTPConnection(host, int(port), timeout=timeout)
+
+    def __request(self, method, path, req=None):
+        body = json.dumps(req).encode("utf-8") if req is not None else None
+        self.__conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        res = json.loads(self.__conn.getresponse().read().decode("utf-8"))
+        if "error" in res:
+            raise RuntimeError("Scoring server error: " + res["error"])
+        return res
+
+    def health(self):
+        return self.__request("GET", "/health")
+
+    def score(self, relation, person_items):
+        """Scores a batch of (person, item) pairs.
+
+        :return: dictionary {(person, item): score}, as TripleScorer.score() (pairs without an instance are left out)
+        """
+        res = self.__request("POST", "/score", {"relation": relation, "items": [list(pi) for pi in person_items]})
+        return {(person, item): score for person, item, score in res["scores"] if score is not None}
+
+    def close(self):
+        self.__conn.close()
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--socket_file", help="serves on this Unix socket", type=str)
+    parser.add_argument("-p", "--port", help="serves on this port (if no socket is given)", type=int, default=8017)
+    parser.add_argument("-r", "--relations", help="relations to serve", nargs="+", choices=VALID_RELS,
+                        default=VALID_RELS)
+    parser.add_argument("-m", "--matrix", help="reads instances from the feature matrices (see agg_feat.py -m)",
+                        action="store_true", default=False)
+    parser.add_argument("-f", "--flat_forest", help="scores with the flat forests (see flat_forest.py)",
+                        action="store_true", default=False)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    service = ScoringService(args.relations, args.matrix, args.flat_forest)
+    serve(service, args.port, args.socket_file)
+
+
+if __name__ == "__main__":
+    main(arg_parser())
@@ -0,0 +1,178 @@
+"""
+Sentence-term matrix
+--------------------
+
+Sparse sentence x term matrix of term frequencies over the Wikipedia sentences (WP_ST_F), stored in CSR format:
+
+- ``vocab.txt``: terms, one per line, in term id order
+- ``indptr.npy``, ``indices.npy``, ``data.npy``: CSR arrays; row i holds the sentence with doc id i + 1
+- ``doc_freqs.npy``: number of sentences containing each term
+- ``professions.txt``, ``prof_indptr.npy``, ``prof_indices.npy``: professions of each sentence (CSR)
+
+The matrix is built in a single pass over WP_ST_F, with the same entity-link rewriting and analyzer as the sentence
+index, and is memory-mapped when loaded. Aggregating TFs over a set of sentences is then a sparse row-sum.
+
+@author: Shuo Zhang
+"""
+
+import argparse
+import os
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from nordlys.core.retrieval.local_index import analyze, raw_to_npy, concat_ranges
+from nordlys.core.wsdmcup_2017.config import WP_ST_F, WP_ST_TF_MATRIX_DIR
+from nordlys.core.wsdmcup_2017.wp_sentence_index import gen_mappings, parse_sentence
+from nordlys.core.wsdmcup_2017.wsdmcup_ids import WSDMCupIDs
+
+
+class SentenceTermMatrix(object):
+    def __init__(self, matrix_dir=WP_ST_TF_MATRIX_DIR):
+        with open(os.sep.join([matrix_dir, "vocab.txt"]), "r", encoding="utf-8") as f:
+            self.__terms = [line.rstrip("\n") for line in f]
+        self.__term_ids = {term: i for i, term in enumerate(self.__terms)}
+        self.__indptr = np.load(os.sep.join([matrix_dir, "indptr.npy"]), mmap_mode="r")
+        self.__indices = np.load(os.sep.join([matrix_dir, "indices.npy"]), mmap_mode="r")
+        self.__data = np.load(os.sep.join([matrix_dir, "data.npy"]), mmap_mode="r")
+        self.__doc_freqs = np.load(os.sep.join([matrix_dir, "doc_freqs.npy"]), mmap_mode="r")
+        with open(os.sep.join([matrix_dir, "professions.txt"]), "r", encoding="utf-8") as f:
+            self.__professions = [line.rstrip("\n") for line in f]
+        self.__prof_ids = {prof: i for i, prof in enumerate(self.__professions)}
+        self.__prof_indptr = np.load(os.sep.join([matrix_dir, "prof_indptr.npy"]), mmap_mode="r")
+        self.__prof_indices = np.load(os.sep.join([matrix_dir, "prof_indices.npy"]), mmap_mode="r")
+        self.__prof_rows = None  # sentence rows of each profession, computed when needed
+
+    @property
+    def num_sentences(self):
+        return len(self.__indptr) - 1
+
+    @property
+    def terms(self):
+        return self.__terms
+
+    def rows(self, doc_ids):
+        """Converts sentence doc ids to row numbers (unknown ids are dropped)."""
+        rows = np.array([int(doc_id) for doc_id in doc_ids], dtype=np.int64) - 1
+        return rows[(rows >= 0) & (rows < self.num_sentences)]
+
+    def row_sum(self, doc_ids):
+        """Sums up the rows of the given sentences.
+
+        :param doc_ids: list of sentence doc ids
+        :return: arrays of term ids and their aggregated frequencies
+        """
+        rows = self.rows(doc_ids)
+        idx = concat_ranges(self.__indptr[rows], self.__indptr[rows + 1])
+        term_ids, inverse = np.unique(self.__indices[idx], return_inverse=True)
+        freqs = np.bincount(inverse, weights=self.__data[idx], minlength=len(term_ids)).astype(np.int64)
+        return term_ids, freqs
+
+    def term_freqs(self, doc_ids):
+        """Returns term frequencies aggregated over the given sentences; {term: freq, ...}"""
+        term_ids, freqs = self.row_sum(doc_ids)
+        return {self.__terms[term_id]: freq for term_id, freq in zip(term_ids.tolist(), freqs.tolist())}
+
+    def doc_freq(self, term):
+        """Returns the number of sentences containing the term."""
+        term_id = self.__term_ids.get(term)
+        return int(self.__doc_freqs[term_id]) if term_id is not None else 0
+
+    def doc_freqs(self, term_ids):
+        """Returns the number of sentences containing each of the given term ids."""
+        return np.asarray(self.__doc_freqs[term_ids])
+
+    def __get_profession_rows(self):
+        """Returns the sentence rows of each profession, in CSR format (profession -> rows); computed once."""
+        if self.__prof_rows is None:
+            prof_indices = np.asarray(self.__prof_indices)
+            order = np.argsort(prof_indices, kind="stable")
+            rows = np.repeat(np.arange(self.num_sentences, dtype=np.int64), np.diff(self.__prof_indptr))[order]
+            indptr = np.searchsorted(prof_indices[order], np.arange(len(self.__professions) + 1))
+            self.__prof_rows = indptr, rows
+        return self.__prof_rows
+
+    def profession_row_sum(self, prof, chunk_rows=100000):
+        """Sums up the rows of the sentences of a profession. Frequencies are accumulated in a dense vector over the
+        vocabulary, so that memory is bounded by the vocabulary size, whatever the number of sentences.
+
+        :param prof: profession (in the format stored in the index)
+        :param chunk_rows: number of sentences processed at once
+        :return: arrays of term ids (sorted) and their aggregated frequencies
+        """
+        prof_id = self.__prof_ids.get(prof)
+        if prof_id is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        indptr, all_rows = self.__get_profession_rows()
+        rows = all_rows[indptr[prof_id]:indptr[prof_id + 1]]
+        freqs = np.zeros(len(self.__terms), dtype=np.int64)
+        for r0 in range(0, len(rows), chunk_rows):
+            chunk = rows[r0:r0 + chunk_rows]
+            idx = concat_ranges(self.__indptr[chunk], self.__indptr[chunk + 1])
+            freqs += np.bincount(self.__indices[idx], weights=self.__data[idx],
+                                 minlength=len(self.__terms)).astype(np.int64)
+        term_ids = np.flatnonzero(freqs)
+        return term_ids, freqs[term_ids]
+
+def build(mapper, matrix_dir=WP_ST_TF_MATRIX_DIR, chunk_size=1 << 26):
+    """Builds the sentence-term matrix in a single pass over WP_ST_F.
+
+    :param mapper: WSDMCupIDs object
+    :param matrix_dir: output directory
+    :param chunk_size: number of matrix entries processed at once when computing document frequencies
+    """
+    os.makedirs(matrix_dir, exist_ok=True)
+    pres_prof_mapping = gen_mappings()
+    vocab = {}
+    indptr = array("q", [0])
+    indices_file = os.sep.join([matrix_dir, "indices.tmp"])
+    data_file = os.sep.join([matrix_dir, "data.tmp"])
+    prof_vocab = {}
+    prof_indptr = array("q", [0])
+    prof_indices = array("i")
+    with open(WP_ST_F, "r") as f_in, open(indices_file, "wb") as f_indices, open(data_file, "wb") as f_data:
+        for doc_id, line in enumerate(f_in, 1):
+            doc = parse_sentence(line, mapper, pres_prof_mapping)[0]
+            tf = Counter(term for term, _ in analyze(doc["content"]))
+            f_indices.write(array("i", [vocab.setdefault(term, len(vocab)) for term in tf]).tobytes())
+            f_data.write(array("i", tf.values()).tobytes())
+            indptr.append(indptr[-1] + len(tf))
+            prof_indices.extend(prof_vocab.setdefault(prof, len(prof_vocab)) for prof in doc["professions"])
+            prof_indptr.append(len(prof_indices))
+            if doc_id % 100000 == 0:
+                print(doc_id / 1000, "K sentences processed.")
+
+    with open(os.sep.join([matrix_dir, "vocab.txt"]), "w", encoding="utf-8") as f:
+        for term in sorted(vocab, key=vocab.get):
+            f.write(term + "\n")
+    np.save(os.sep.join([matrix_dir, "indptr.npy"]), np.array(indptr, dtype=np.int64))
+    with open(os.sep.join([matrix_dir, "professions.txt"]), "w", encoding="utf-8") as f:
+        for prof in sorted(prof_vocab, key=prof_vocab.get):
+            f.write(prof + "\n")
+    np.save(os.sep.join([matrix_dir, "prof_indptr.npy"]), np.array(prof_indptr, dtype=np.int64))
+    np.save(os.sep.join([matrix_dir, "prof_indices.npy"]), np.array(prof_indices, dtype=np.int32))
+    raw_to_npy(indices_file, os.sep.join([matrix_dir, "indices.npy"]), np.int32)
+    raw_to_npy(data_file, os.sep.join([matrix_dir, "data.npy"]), np.int32)
+
+    indices = np.load(os.sep.join([matrix_dir, "indices.npy"]), mmap_mode="r")
+    doc_freqs = np.zeros(len(vocab), dtype=np.int64)
+    for start in range(0, len(indices), chunk_size):
+        doc_freqs += np.bincount(indices[start:start + chunk_size], minlength=len(vocab))
+    np.save(os.sep.join([matrix_dir, "doc_freqs.npy"]), doc_freqs)
+    print("Sentence-term matrix:", len(indptr) - 1, "sentences,", len(vocab), "terms,", len(indices), "entries")
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output_dir", help="output directory", type=str, default=WP_ST_TF_MATRIX_DIR)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    build(WSDMCupIDs(), args.output_dir)
+
+
+if __name__ == "__main__":
+    main(arg_parser())
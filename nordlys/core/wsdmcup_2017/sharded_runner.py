@@ -0,0 +1,200 @@
+"""
+Sharded runner
+--------------
+
+Runs a .kb-driven feature generator (feat_termstats, feat_w2v_sim, feat_freq) on a pool of worker processes.
+The .kb file is sharded by person id (so that all the lines of a person go to the same shard), each worker creates
+its own generator (with its own index connection) and generates the features of a shard into temporary TSV files,
+which are finally merged back in the order of the input, under the same header. With ``-i``, the index calls of
+each shard are reported into ``<instrument>.shard_<i>.json/.prom`` (see instrumentation).
+
+Usage::
+
+    python -m nordlys.core.wsdmcup_2017.sharded_runner -g termstats -k <kb_file> -o <output_file> -n 32
+
+@author: Shuo Zhang
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import zlib
+from multiprocessing import Pool, cpu_count
+
+from nordlys.core.retrieval import instrumentation
+from nordlys.core.utils.file_utils import FileUtils
+from nordlys.core.wsdmcup_2017.config import TF_IDF_F
+
+
+# generators are imported by their factories, so that only the dependencies of the generator in use are needed
+def _load_termstats(stats_file=TF_IDF_F, **kwargs):
+    from nordlys.core.wsdmcup_2017.feat_termstats import FeaturesTermStats
+    fts = FeaturesTermStats(**kwargs)
+    fts.load_termstats(stats_file)
+    return fts
+
+
+def _load_w2v_sim(stats_file=TF_IDF_F, **kwargs):
+    from nordlys.core.wsdmcup_2017.feat_w2v_sim import FeaturesW2VSim
+    fts = FeaturesW2VSim(**kwargs)
+    fts.load_termstats(stats_file)
+    return fts
+
+
+def _load_freq(**kwargs):
+    from nordlys.core.wsdmcup_2017.feat_freq import FeaturesTermStats as FeaturesFreq
+    return FeaturesFreq(**kwargs)
+
+
+# generator name -> (function creating the generator, number of output files)
+GENERATORS = {
+    "termstats": (_load_termstats, 1),
+    "w2v_sim": (_load_w2v_sim, 1),
+    "freq": (_load_freq, 2)
+}
+
+
+def get_shard(person_id, num_shards):
+    """Returns the shard of a person (stable across processes and runs)."""
+    return zlib.crc32(person_id.encode("utf-8")) % num_shards
+
+
+def count_lines(file_name):
+    with open(file_name, "r") as f:
+        return sum(1 for _ in f)
+
+
+def check_shard_outputs(tasks, shard_sizes):
+    """Checks that each shard output has a header and one line per line of the shard .kb file.
+
+    :param tasks: shard tasks (see _run_shard)
+    :param shard_sizes: number of .kb lines of each shard
+    :raises ValueError: if the number of lines of a shard output does not match its input
+    """
+    for i, (shard_kb_file, shard_output_files, _) in enumerate(tasks):
+        for shard_output_file in shard_output_files:
+            num_lines = count_lines(shard_output_file)
+            if num_lines != shard_sizes[i] + 1:
+                raise ValueError("Shard {}: {} has {} lines, expected {} ({} lines in {} + header)".format(
+                    i, shard_output_file, num_lines, shard_sizes[i] + 1, shard_sizes[i], shard_kb_file))
+
+
+def _init_worker(generator, kwargs, instrument=False):
+    """Creates the feature generator in each worker process."""
+    global _generator
+    if instrument:  # before creating the generator, so that its index is instrumented
+        instrumentation.enable()
+    _generator = GENERATORS[generator][0](**kwargs)
+
+
+def _run_shard(task):
+    """Generates the features of a shard.
+
+    :param task: (shard .kb file, list of shard output files, instrumentation report prefix or None)
+    """
+    shard_kb_file, shard_output_files, report_prefix = task
+    instrumentation.reset()
+    _generator.generate_features(shard_kb_file, *shard_output_files)
+    if report_prefix:
+        instrumentation.dump(report_prefix)
+    return shard_kb_file
+
+
+def run_sharded(generator, kb_file, output_files, num_workers=cpu_count(), num_shards=None, instrument=None,
+                **kwargs):
+    """Runs a feature generator on shards of the .kb file in parallel, and merges the outputs in input order.
+
+    :param generator: name of the generator (a key of GENERATORS)
+    :param kb_file: path to the file with person items (a '.kb'-extension file)
+    :param output_files: list of output files of the generator
+    :param num_workers: number of worker processes
+    :param num_shards: number of shards (default: num_workers)
+    :param instrument: path prefix of the instrumentation reports of the shards (no instrumentation if None)
+    :param kwargs: arguments for creating the generator (e.g. local_index_dir, stats_file)
+    """
+    if generator not in GENERATORS:
+        print("Error: Unknown generator", generator)
+        exit(0)
+    assert len(output_files) == GENERATORS[generator][1]
+    num_shards = num_shards or num_workers
+    work_dir = tempfile.mkdtemp(prefix="shards_", dir=os.path.dirname(os.path.abspath(output_files[0])))
+
+    try:
+        # shards the .kb file by person id; the shard of each line is kept for merging
+        line_shards = []
+        shard_sizes = [0] * num_shards
+        shard_files = [open(os.sep.join([work_dir, "shard_{}.kb".format(i)]), "w") for i in range(num_shards)]
+        with FileUtils.open_file_by_type(kb_file) as kb_f:
+            for line in kb_f:
+                if len(line.strip()) == 0:
+                    continue
+                shard = get_shard(line.split("\t", maxsplit=1)[0].strip(), num_shards)
+                shard_files[shard].write(line if line.endswith("\n") else line + "\n")
+                line_shards.append(shard)
+                shard_sizes[shard] += 1
+        for f in shard_files:
+            f.close()
+        print(len(line_shards), "lines in", num_shards, "shards")
+
+        tasks = [(os.sep.join([work_dir, "shard_{}.kb".format(i)]),
+                  [os.sep.join([work_dir, "shard_{}_{}.tsv".format(i, j)]) for j in range(len(output_files))],
+                  "{}.shard_{}".format(instrument, i) if instrument else None)
+                 for i in range(num_shards)]
+        with Pool(num_workers, initializer=_init_worker, initargs=(generator, kwargs, bool(instrument))) as pool:
+            for shard_kb_file in pool.imap_unordered(_run_shard, tasks):
+                print("Done:", shard_kb_file)
+
+        check_shard_outputs(tasks, shard_sizes)
+        # merges the shard outputs in input order (generators write one line per .kb line, in order)
+        for j, output_file in enumerate(output_files):
+            shard_outputs = [open(shard_output_files[j], "r") for _, shard_output_files, _ in tasks]
+            with open(output_file, "w") as f_out:
+                f_out.write(shard_outputs[0].readline())  # header
+                for f in shard_outputs[1:]:
+                    f.readline()
+                for shard in line_shards:
+                    f_out.write(shard_outputs[shard].readline())
+            for f in shard_outputs:
+                f.close()
+            print("Output:", output_file)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--generator", help="feature generator", choices=sorted(GENERATORS), required=True)
+    parser.add_argument("-k", "--kb_file", help=".kb file", type=str, required=True)
+    parser.add_argument("-o", "--output_files", help="output file(s) of the generator", nargs="+", required=True)
+    parser.add_argument("-n", "--num_workers", help="number of worker processes", type=int, default=cpu_count())
+    parser.add_argument("-s", "--stats_file", help="term statistics (termstats, w2v_sim)", type=str, default=TF_IDF_F)
+    parser.add_argument("-l", "--local_index_dir", help="uses the local index in this directory", type=str)
+    parser.add_argument("-m", "--tf_matrix_dir", help="uses the sentence-term matrix in this directory", type=str)
+    parser.add_argument("-p", "--person_sentences_dir", help="uses the person-sentence postings in this directory",
+                        type=str)
+    parser.add_argument("-t", "--person_tf_dir", help="uses the person TF store in this directory", type=str)
+    parser.add_argument("-w", "--w2v_matrix_dir", help="uses the word2vec matrix in this directory", type=str)
+    parser.add_argument("-c", "--local_cooccurrence", help="matches nationality phrases locally (freq)",
+                        action="store_true", default=False)
+    parser.add_argument("-i", "--instrument", help="writes a report of the index calls of each shard to "
+                                                   "<instrument>.shard_<i>.json/.prom", type=str)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    kwargs = {"local_index_dir": args.local_index_dir, "person_sentences_dir": args.person_sentences_dir}
+    if args.generator == "freq":
+        kwargs["local_cooccurrence"] = args.local_cooccurrence
+    else:
+        kwargs.update({"stats_file": args.stats_file, "tf_matrix_dir": args.tf_matrix_dir,
+                       "person_tf_dir": args.person_tf_dir})
+        if args.generator == "w2v_sim":
+            kwargs["w2v_matrix_dir"] = args.w2v_matrix_dir
+    run_sharded(args.generator, args.kb_file, args.output_files, num_workers=args.num_workers,
+                instrument=args.instrument, **kwargs)
+
+
+if __name__ == "__main__":
+    main(arg_parser())
@@ -0,0 +1,150 @@
+"""
+Significance testing
+--------------------
+
+Paired significance tests between two runs over subjects, for the measures of evaluator.py (accuracy, average score
+difference, average Kendall's tau). Per-subject measures of both runs are computed once (see multi_evaluator); each
+measure is then a ratio of per-subject sums (e.g. sum of score differences / number of triples for ASD, and sum of
+taus / number of subjects for tau), so that resampling the subjects is a matrix product or an index operation.
+
+- randomization: the runs of each subject are swapped at random; two-sided p-value of the observed difference
+- bootstrap: subjects are sampled with replacement; two-sided p-value of the (shifted) bootstrap differences
+
+Resamples are drawn in batches, each with its own seed (derived from the given seed), so results do not depend on the
+number of worker processes.
+
+Usage::
+
+    python -m nordlys.core.wsdmcup_2017.significance -t <truth_file> -r <run_file1> <run_file2> [-m bootstrap]
+
+@author: Faegheh Hasibi
+"""
+
+import argparse
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from nordlys.core.wsdmcup_2017.multi_evaluator import Truth
+
+MEASURES = ["acc", "asd", "tau"]
+METHODS = ["randomization", "bootstrap"]
+
+
+def get_paired_sums(truth, scores1, scores2):
+    """Returns the per-subject sums of the measures of two runs.
+
+    :return: matrices of #subjects x #measures: sums of the first run, sums of the second run, and normalizers (number
+        of triples for acc and asd, 1 for tau)
+    """
+    measures1 = truth.get_subject_measures(scores1)
+    measures2 = truth.get_subject_measures(scores2)
+    sums1 = np.column_stack([measures1[m] for m in MEASURES]).astype(np.float64)
+    sums2 = np.column_stack([measures2[m] for m in MEASURES]).astype(np.float64)
+    norms = np.column_stack([np.ones(truth.num_subjects) if m == "tau" else measures1["triples"]
+                             for m in MEASURES]).astype(np.float64)
+    return sums1, sums2, norms
+
+
+def resample(method, diffs, norms, num_samples, seed):
+    """Computes the differences of the measures for a batch of resamples.
+
+    :param method: randomization or bootstrap
+    :param diffs: matrix of #subjects x #measures, with the per-subject differences of sums between the runs
+    :param norms: matrix of #subjects x #measures, with the per-subject normalizers
+    :param num_samples: number of resamples
+    :param seed: seed (or SeedSequence) of the batch
+    :return: matrix of #samples x #measures
+    """
+    rng = np.random.default_rng(seed)
+    num_subjects = diffs.shape[0]
+    if method == "randomization":
+        # swapping the runs of a subject negates its difference: sum(sign * d) = 2 * sum(d of kept subjects) - sum(d)
+        keep = (rng.random((num_samples, num_subjects)) < 0.5).astype(np.float64)
+        return (2 * (keep @ diffs) - diffs.sum(axis=0)) / norms.sum(axis=0)
+    # number of times each subject is drawn in each resample
+    samples = rng.integers(0, num_subjects, size=(num_samples, num_subjects))
+    samples += np.arange(num_samples)[:, None] * num_subjects
+    counts = np.bincount(samples.ravel(), minlength=num_samples * num_subjects).reshape(num_samples, num_subjects)
+    counts = counts.astype(np.float64)
+    return (counts @ diffs) / (counts @ norms)
+
+
+def _init_worker(diffs, norms):
+    global _diffs, _norms
+    _diffs, _norms = diffs, norms
+
+
+def _resample(task):
+    method, num_samples, seed = task
+    return resample(method, _diffs, _norms, num_samples, seed)
+
+
+def paired_test(sums1, sums2, norms, method="randomization", num_samples=10000, seed=0, num_workers=cpu_count(),
+                batch_size=None):
+    """Performs a paired significance test between two runs.
+
+    :param sums1, sums2, norms: per-subject sums of the runs, and normalizers (see get_paired_sums)
+    :param method: randomization or bootstrap
+    :param num_samples: number of resamples
+    :param seed: random seed
+    :param num_workers: number of worker processes
+    :param batch_size: number of resamples per batch (default: about 10M subject draws per batch)
+    :return: dictionary {measure: {"run1": ..., "run2": ..., "diff": ..., "p_value": ...}}
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown method: " + str(method))
+    diffs = sums1 - sums2
+    observed = diffs.sum(axis=0) / norms.sum(axis=0)
+    batch_size = batch_size or max(1, 10000000 // max(diffs.shape[0], 1))
+    batches = [min(batch_size, num_samples - start) for start in range(0, num_samples, batch_size)]
+    tasks = [(method, n, seq) for n, seq in zip(batches, np.random.SeedSequence(seed).spawn(len(batches)))]
+    if num_workers > 1 and len(tasks) > 1:
+        with Pool(min(num_workers, len(tasks)), initializer=_init_worker, initargs=(diffs, norms)) as pool:
+            stats = np.concatenate(pool.map(_resample, tasks))
+    else:
+        stats = np.concatenate([resample(method, diffs, norms, n, seq) for _, n, seq in tasks])
+
+    # a small tolerance, so that resamples equal to the observed difference are not lost to rounding
+    eps = 1e-12
+    if method == "randomization":
+        extreme = np.abs(stats) >= np.abs(observed) - eps
+    else:  # bootstrap differences shifted by the observed difference, as the null distribution
+        extreme = np.abs(stats - observed) >= np.abs(observed) - eps
+    p_values = (extreme.sum(axis=0) + 1) / (num_samples + 1)
+    measures1 = sums1.sum(axis=0) / norms.sum(axis=0)
+    measures2 = sums2.sum(axis=0) / norms.sum(axis=0)
+    return {m: {"run1": float(measures1[j]), "run2": float(measures2[j]), "diff": float(observed[j]),
+                "p_value": float(p_values[j])} for j, m in enumerate(MEASURES)}
+
+
+def compare_runs(truth_file, run_file1, run_file2, method="randomization", num_samples=10000, seed=0,
+                 num_workers=cpu_count()):
+    """Tests the significance of the differences between two runs (see paired_test)."""
+    truth = Truth(truth_file)
+    sums1, sums2, norms = get_paired_sums(truth, truth.read_run(run_file1), truth.read_run(run_file2))
+    return paired_test(sums1, sums2, norms, method, num_samples, seed, num_workers)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", "--truth", help="ground truth file", type=str, required=True)
+    parser.add_argument("-r", "--runs", help="the two run files", nargs=2, required=True)
+    parser.add_argument("-m", "--method", help="test", choices=METHODS, default="randomization")
+    parser.add_argument("-n", "--num_samples", help="number of resamples", type=int, default=10000)
+    parser.add_argument("-s", "--seed", help="random seed", type=int, default=0)
+    parser.add_argument("-w", "--num_workers", help="number of worker processes", type=int, default=cpu_count())
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    res = compare_runs(args.truth, args.runs[0], args.runs[1], args.method, args.num_samples, args.seed,
+                       args.num_workers)
+    print("\t".join(["measure", "run1", "run2", "diff", "p_value"]))
+    for m in MEASURES:
+        print("\t".join([m] + ["{:.4f}".format(res[m][k]) for k in ["run1", "run2", "diff", "p_value"]]))
+
+
+if __name__ == "__main__":
+    main(arg_parser())
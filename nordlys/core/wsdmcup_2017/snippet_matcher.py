@@ -0,0 +1,97 @@
+r"""Multi-pattern matching of relation items (e.g. professions) in first Wikipedia snippets.
+
+An Aho-Corasick automaton is built once over all the (lowercased) items, so that a single linear scan of a snippet
+finds all the items occurring in it, with the same semantics as ``re.search(r"[,\s\.]({})[,\s\.]", snippet)``.
+
+@author: Dario Garigliotti
+"""
+
+from collections import deque
+
+
+def is_boundary(ch):
+    r"""Returns True for the characters delimiting items, i.e., [,\s\.]"""
+    return ch in ",." or ch.isspace()
+
+
+class AhoCorasick(object):
+    """Aho-Corasick automaton over a list of patterns."""
+
+    def __init__(self, patterns):
+        self.__patterns = patterns
+        self.__goto = [{}]  # state transitions
+        self.__fail = [0]  # failure links
+        self.__out = [[]]  # indices of the patterns ending at each state
+        for i, pattern in enumerate(patterns):
+            if len(pattern) == 0:
+                continue
+            state = 0
+            for ch in pattern:
+                if ch not in self.__goto[state]:
+                    self.__goto.append({})
+                    self.__fail.append(0)
+                    self.__out.append([])
+                    self.__goto[state][ch] = len(self.__goto) - 1
+                state = self.__goto[state][ch]
+            self.__out[state].append(i)
+
+        # failure links, in breadth-first order
+        queue = deque(self.__goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.__goto[state].items():
+                queue.append(next_state)
+                fail = self.__fail[state]
+                while fail and ch not in self.__goto[fail]:
+                    fail = self.__fail[fail]
+                self.__fail[next_state] = self.__goto[fail].get(ch, 0)
+                self.__out[next_state] = self.__out[next_state] + self.__out[self.__fail[next_state]]
+
+    def iter_matches(self, text):
+        """Yields (start, pattern index) for all occurrences of the patterns in the text."""
+        goto, fail, out, patterns = self.__goto, self.__fail, self.__out, self.__patterns
+        state = 0
+        for pos, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for i in out[state]:
+                yield pos - len(patterns[i]) + 1, i
+
+
+class SnippetMatcher(object):
+    r"""Finds the items occurring in a snippet as whole words, i.e., surrounded by [,\s\.] characters."""
+
+    def __init__(self, items):
+        self.__items = list(items)
+        self.__patterns = [item.lower() for item in self.__items]  # important to lowercase items
+        self.__automaton = AhoCorasick(self.__patterns)
+
+    def match(self, snippet):
+        """Returns the items occurring in the snippet.
+
+        :param snippet: snippet text
+        :return: dictionary {item: start index of its first occurrence}
+        """
+        positions = {}
+        for start, i in self.__automaton.iter_matches(snippet):
+            end = start + len(self.__patterns[i])
+            # item occurs not only as substring, but all its words (sometimes it's multiword) appear as words
+            # otherwise, it will count, e.g., "orator" as a profession when it's only a substring of "oratorio"
+            if start == 0 or end >= len(snippet) or not is_boundary(snippet[start - 1]) or \
+                    not is_boundary(snippet[end]):
+                continue
+            item = self.__items[i]
+            if start < positions.get(item, len(snippet)):
+                positions[item] = start
+        return positions
+
+    @staticmethod
+    def first(positions):
+        """Returns the first item occurring in the snippet (the longest one for ties), or "" if there is none.
+
+        :param positions: dictionary {item: start index}, as returned by match()
+        """
+        if len(positions) == 0:
+            return ""
+        return min(positions, key=lambda item: (positions[item], -len(item)))
@@ -0,0 +1,184 @@
+"""
+Hyperparameter sweep
+--------------------
+
+Cross-validates a grid of model configs of the triple scorer on the person-based splits of ``splits.json`` (see
+parallel_cv). (config, fold) jobs are run with ML on a pool of worker processes sharing the train instances, and the
+predictions of finished jobs are cached on disk, so an interrupted sweep resumes where it stopped. Each config is
+reported with the measures of evaluator.py (accuracy, average score difference, Kendall's tau) over all the folds.
+
+The grid is either the product of the given parameter values, or a json file with a list of
+``{"model": ..., "parameters": {...}}`` configs.
+
+Usage::
+
+    python -m nordlys.core.wsdmcup_2017.sweep -r profession -t 100 500 1000 -f 2 5 10 [-n 16] [-o <output_file>]
+
+@author: Faegheh Hasibi
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+from multiprocessing import cpu_count
+
+import numpy as np
+
+from nordlys.core.wsdmcup_2017 import parallel_cv
+from nordlys.core.wsdmcup_2017.config import *
+from nordlys.core.wsdmcup_2017.evaluator import compute_acc, compute_asd, compute_tau
+
+SWEEP_CACHE_DIR = sep.join([DATA_DIR, "sweep_cache"])
+
+
+def gen_grid(relation, trees, maxfeats, model="rf"):
+    """Generates the ML configs of all the combinations of the parameter values."""
+    from nordlys.core.wsdmcup_2017.triple_scorer import TripleScorer
+    return [TripleScorer.gen_ml_config(relation, model, {"tree": tree, "maxfeat": maxfeat})
+            for tree, maxfeat in itertools.product(trees, maxfeats)]
+
+
+def load_grid(relation, grid_file):
+    """Reads the ML configs of a grid file."""
+    from nordlys.core.wsdmcup_2017.triple_scorer import TripleScorer
+    return [TripleScorer.gen_ml_config(relation, config.get("model"), config.get("parameters"))
+            for config in json.load(open(grid_file, "r"))]
+
+
+def get_data_hash(train_file):
+    """Returns the md5 of the train instances file."""
+    m = hashlib.md5()
+    with open(train_file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            m.update(chunk)
+    return m.hexdigest()
+
+
+def get_job_key(data_hash, ml_config, train_ids, test_ids):
+    """Returns the cache key of a (config, fold) job, which changes with the train data, the config or the fold."""
+    m = hashlib.md5(data_hash.encode("utf-8"))
+    m.update(json.dumps(ml_config, sort_keys=True).encode("utf-8"))
+    m.update(json.dumps([train_ids, test_ids]).encode("utf-8"))
+    return m.hexdigest()
+
+
+def load_job(cache_dir, key):
+    """Loads the predictions and running time of a cached job (None if not cached)."""
+    cache_file = os.sep.join([cache_dir, key + ".npz"])
+    if not os.path.exists(cache_file):
+        return None
+    with np.load(cache_file) as data:
+        return data["predictions"], float(data["time"])
+
+
+def save_job(cache_dir, key, predictions, job_time):
+    """Caches the predictions of a job (written to a temporary file first, so that interrupted writes are ignored)."""
+    tmp_file = os.sep.join([cache_dir, key + ".tmp.npz"])
+    np.savez(tmp_file, predictions=predictions, time=job_time)
+    os.replace(tmp_file, os.sep.join([cache_dir, key + ".npz"]))
+
+
+def evaluate(inss, ins_ids, predictions):
+    """Evaluates the predictions of the given instances, with the scores rounded and grouped by person as in the run
+    files.
+
+    :return: accuracy, average score difference, Kendall's tau
+    """
+    groups = {}
+    for ins_id, score in zip(ins_ids, predictions.tolist()):
+        ins = inss.get_instance(ins_id)
+        groups.setdefault(ins.get_property("person"), []).append((min(max(int(round(score)), 0), 7),
+                                                                  int(round(float(ins.target)))))
+    scores_run = [[s for s, _ in group] for group in groups.values()]
+    scores_truth = [[s for _, s in group] for group in groups.values()]
+    return (compute_acc(scores_run, scores_truth), compute_asd(scores_run, scores_truth),
+            compute_tau(scores_run, scores_truth))
+
+
+def sweep(relation, ml_configs, num_workers=cpu_count(), splits_file=parallel_cv.SPLITS_F, cache_dir=SWEEP_CACHE_DIR):
+    """Cross-validates the ML configs.
+
+    :param relation: relation of the train instances
+    :param ml_configs: list of ML configs
+    :param num_workers: number of worker processes
+    :param splits_file: splits file (created if it does not exist)
+    :param cache_dir: directory of the cached jobs
+    :return: list of result dicts (config, acc, asd, tau, time, wall_time), in the order of the configs; time is the
+        total running time of the folds, and wall_time the elapsed time of the config in this sweep (0 if cached)
+    """
+    t_start = time.time()
+    inss = parallel_cv.load_train_instances(relation)
+    folds = parallel_cv.get_folds(parallel_cv.load_splits(inss, splits_file))
+    data_hash = get_data_hash(parallel_cv.get_train_file(relation))
+    cache_dir = os.sep.join([cache_dir, relation])
+    os.makedirs(cache_dir, exist_ok=True)
+    print("Train instances: {}, {} folds, {} configs".format(len(inss.get_all()), len(folds), len(ml_configs)))
+
+    # (config, fold) jobs, taken from the cache or run, in the order of configs
+    keys = {(i, fold): get_job_key(data_hash, ml_config, train_ids, test_ids)
+            for i, ml_config in enumerate(ml_configs) for fold, train_ids, test_ids in folds}
+    results = {job: load_job(cache_dir, key) for job, key in keys.items()}
+    tasks = [((i, fold), ml_config, train_ids, test_ids, None) for i, ml_config in enumerate(ml_configs)
+             for fold, train_ids, test_ids in folds if results[(i, fold)] is None]
+    print("{} jobs cached, {} to run".format(len(keys) - len(tasks), len(tasks)))
+    spans = {}  # config -> (start of its first fold, end of its last fold), for the jobs run now
+    for job, predictions, job_time in parallel_cv.run_tasks(tasks, inss, num_workers) if tasks else []:
+        save_job(cache_dir, keys[job], predictions, job_time)
+        results[job] = predictions, job_time
+        end = time.time()
+        start = min(spans[job[0]][0], end - job_time) if job[0] in spans else end - job_time
+        spans[job[0]] = start, end
+        print("Config {} fold {} done ({:.1f}s)".format(job[0], job[1], job_time))
+
+    sweep_results = []
+    for i, ml_config in enumerate(ml_configs):
+        ins_ids = [ins_id for _, _, test_ids in folds for ins_id in test_ids]
+        predictions = np.concatenate([results[(i, fold)][0] for fold, _, _ in folds])
+        acc, asd, tau = evaluate(inss, ins_ids, predictions)
+        sweep_results.append({"config": ml_config, "acc": acc, "asd": asd, "tau": tau,
+                              "time": sum(results[(i, fold)][1] for fold, _, _ in folds),
+                              "wall_time": spans[i][1] - spans[i][0] if i in spans else 0.0})
+    print("Sweep: {:.1f}s".format(time.time() - t_start))
+    return sweep_results
+
+
+def print_results(sweep_results, output_file=None):
+    """Prints the results as a table (and writes them to the output file, if given)."""
+    lines = ["\t".join(["model", "parameters", "acc", "asd", "tau", "time", "wall_time"])]
+    for res in sweep_results:
+        lines.append("\t".join([res["config"]["model"], json.dumps(res["config"]["parameters"], sort_keys=True),
+                                "{:.4f}".format(res["acc"]), "{:.4f}".format(res["asd"]), "{:.4f}".format(res["tau"]),
+                                "{:.1f}".format(res["time"]), "{:.1f}".format(res["wall_time"])]))
+    print("\n".join(lines))
+    if output_file:
+        with open(output_file, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        print("Output file:", output_file)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--relation", help="relation", choices=VALID_RELS, required=True)
+    parser.add_argument("-t", "--trees", help="numbers of trees", type=int, nargs="+", default=[1000])
+    parser.add_argument("-f", "--maxfeats", help="numbers of features per split", type=int, nargs="+")
+    parser.add_argument("-g", "--grid_file", help="json file with a list of configs (instead of -t/-f)", type=str)
+    parser.add_argument("-n", "--num_workers", help="number of worker processes", type=int, default=cpu_count())
+    parser.add_argument("-o", "--output_file", help="writes the results to this file", type=str)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    if args.grid_file:
+        ml_configs = load_grid(args.relation, args.grid_file)
+    else:
+        maxfeats = args.maxfeats or [5 if args.relation == REL_PROFESSION else 2]
+        ml_configs = gen_grid(args.relation, args.trees, maxfeats)
+    print_results(sweep(args.relation, ml_configs, args.num_workers), args.output_file)
+
+
+if __name__ == "__main__":
+    main(arg_parser())
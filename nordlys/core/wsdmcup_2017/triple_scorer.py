@@ -6,21 +6,39 @@
 import pickle
 import sys
 
+import numpy as np
+
+from nordlys.core.ml.instance import Instance
 from nordlys.core.ml.instances import Instances
 from nordlys.core.ml.ml import ML
 from nordlys.core.utils.file_utils import FileUtils
+from nordlys.core.wsdmcup_2017 import parallel_cv
 from nordlys.core.wsdmcup_2017.config import *
+from nordlys.core.wsdmcup_2017.feature_matrix import FeatureMatrix
+from nordlys.core.wsdmcup_2017.flat_forest import FlatForest, get_feature_matrix
 from nordlys.core.wsdmcup_2017.wsdmcup_ids import WSDMCupIDs
 
 
 class TripleScorer(object):
-    def __init__(self, relation, model=None, params=None):
+    def __init__(self, relation, model=None, params=None, use_matrix=False, use_flat_forest=False):
+        """
+        :param use_matrix: if True, instances to score are read from the feature matrix (see agg_feat -m), instead
+            of the json instances file
+        :param use_flat_forest: if True, scores with the model compiled into a flat forest (see flat_forest.py)
+        """
         self.__relation = relation
         self.__train_file = PROFESSION_INSS_TRAIN if relation == REL_PROFESSION else NATIONALITY_INSS_TRAIN
         self.__inss_file = PROFESSION_INSS_ALL if relation == REL_PROFESSION else NATIONALITY_INSS_ALL
+        self.__matrix_dir = PROFESSION_MATRIX_ALL if relation == REL_PROFESSION else NATIONALITY_MATRIX_ALL
+        self.__use_matrix = use_matrix
         self.__model_file = PROFESSION_MODEL if relation == REL_PROFESSION else NATIONALITY_MODEL
+        self.__flat_model_dir = PROFESSION_FLAT_MODEL if relation == REL_PROFESSION else NATIONALITY_FLAT_MODEL
+        self.__use_flat_forest = use_flat_forest
         self.__wsdmcup_ids = WSDMCupIDs()
         self.__ml_config = self.gen_ml_config(relation, model, params)
+        # loaded once, when needed
+        self.__model = None
+        self.__instances = None
 
     @staticmethod
     def gen_ml_config(relation, model=None, params=None):
@@ -35,27 +53,38 @@ class TripleScorer(object):
         """Converts instances to a list of (person, item, score) triples."""
         scored_items = {}
         for ins in inss.get_all():
-            person = self.__wsdmcup_ids.get_person_from_id(ins.get_property("person"))
-            item_id = ins.get_property(self.__relation)
-            if self.__relation == REL_PROFESSION:
-                item = self.__wsdmcup_ids.get_prof_from_id(item_id)
-            else:
-                item = self.__wsdmcup_ids.get_nation_from_id(item_id)
-            score = ins.score
-            scored_items[(person, item)] = score
+            scored_items[self.__ids2item(ins.get_property("person"), ins.get_property(self.__relation))] = ins.score
         return scored_items
 
-    def __items2inss(self, person_items):
-        """Converts (person, item) tuples to instances."""
-        all_inss = Instances.from_json(self.__inss_file)
-        print("Converting items to instances ...")
-        inss = Instances()
+    def __ids2item(self, person_id, item_id):
+        """Converts a (person id, item id) tuple to a (person, item) tuple."""
+        person = self.__wsdmcup_ids.get_person_from_id(person_id)
+        if self.__relation == REL_PROFESSION:
+            item = self.__wsdmcup_ids.get_prof_from_id(item_id)
+        else:
+            item = self.__wsdmcup_ids.get_nation_from_id(item_id)
+        return person, item
+
+    def __get_item_ids(self, person_items):
+        """Converts (person, item) tuples to (person id, item id) tuples."""
+        item_ids = []
         for person, item in person_items:
             person_id = self.__wsdmcup_ids.get_id_from_person(person)
             if self.__relation == REL_PROFESSION:
                 item_id = self.__wsdmcup_ids.get_id_from_prof(item)
             else:
                 item_id = self.__wsdmcup_ids.get_id_from_nation(item)
+            item_ids.append((person_id, item_id))
+        return item_ids
+
+    def __items2inss(self, person_items):
+        """Converts (person, item) tuples to instances."""
+        if self.__use_matrix:
+            return self.__items2inss_matrix(person_items)
+        all_inss = self.load_instances()
+        print("Converting items to instances ...")
+        inss = Instances()
+        for (person, item), (person_id, item_id) in zip(person_items, self.__get_item_ids(person_items)):
             ins_id = person_id + "_" + item_id
             ins = all_inss.get_instance(ins_id)
             if ins is None:
@@ -63,6 +92,24 @@ class TripleScorer(object):
             inss.add_instance(ins)
         return inss
 
+    def __items2inss_matrix(self, person_items):
+        """Converts (person, item) tuples to instances, reading only their rows from the feature matrix."""
+        matrix = self.load_instances()
+        print("Converting items to instances ...")
+        item_ids = self.__get_item_ids(person_items)
+        rows = matrix.get_rows(item_ids)
+        features = matrix.get_features(rows[rows >= 0])
+        inss = Instances()
+        j = 0
+        for (person, item), (person_id, item_id), row in zip(person_items, item_ids, rows.tolist()):
+            if row < 0:
+                print(person, item, "not found!")
+                continue
+            inss.add_instance(Instance(person_id + "_" + item_id, features=features[j],
+                                       properties={"person": person_id, self.__relation: item_id}))
+            j += 1
+        return inss
+
     def train(self):
         """Trains the model."""
         self.__ml_config["save_model"] = self.__model_file
@@ -73,22 +120,78 @@ class TripleScorer(object):
         # inss = ml.apply_model(ins_train, model)
         # return self.__inss2triples(inss)
 
-    def cross_validate(self):
-        """Performs cross validation on train instances and returns list of ranked items"""
+    def cross_validate(self, num_workers=1, k=5, create_splits=True):
+        """Performs person-based cross validation on train instances and returns the scored items.
+        With more than one worker, the folds are run in parallel (see parallel_cv, and its -v option to check that
+        the predictions are the same as ML.run()).
+
+        :param num_workers: number of worker processes (1: ML.run())
+        :param k: number of folds
+        :param create_splits: if True, creates new splits; otherwise, the splits in DATA_DIR/splits.json are used
+        :return: dictionary {(person, item): score}
+        """
+        if num_workers > 1:
+            scores = parallel_cv.cross_validate(self.__relation, self.__ml_config, num_workers=num_workers, k=k,
+                                                splits_file=parallel_cv.SPLITS_F, create_splits=create_splits)
+            return {self.__ids2item(person_id, item_id): score for (person_id, item_id), score in scores.items()}
         self.__ml_config["cross_validation"] = {
-            "create_splits": True,
-            "splits_file": DATA_DIR + "/splits.json",
-            "k": 5,
+            "create_splits": create_splits,
+            "splits_file": parallel_cv.SPLITS_F,
+            "k": k,
             "split_strategy": "person"
         }
         self.__ml_config["training_set"] = self.__train_file
         inss = ML(self.__ml_config).run()
         return self.__inss2items(inss)
 
+    def load_instances(self):
+        """Loads the instances to score (once): the feature matrix or the json instances."""
+        if self.__instances is None:
+            if self.__use_matrix:
+                self.__instances = FeatureMatrix(self.__matrix_dir)
+            else:
+                self.__instances = Instances.from_json(self.__inss_file)
+        return self.__instances
+
+    def load_model(self):
+        """Loads the trained model (once)."""
+        if self.__model is None:
+            print("Loading model ...")
+            if self.__use_flat_forest:
+                self.__model = FlatForest.load(self.__flat_model_dir)
+            else:
+                self.__model = pickle.load(open(self.__model_file, "rb"))
+        return self.__model
+
+    def __score_flat(self, person_items):
+        """Scores (person, item) tuples with the flat forest, in a single batch."""
+        forest = self.load_model()
+        instances = self.load_instances()
+        item_ids = self.__get_item_ids(person_items)
+        if self.__use_matrix:
+            rows = instances.get_rows(item_ids)
+            found = (rows >= 0).tolist()
+            x = instances.get_feature_matrix(rows[rows >= 0], forest.feature_names)
+            if np.isnan(x).any():  # as ML.apply_model, which requires all the features
+                raise ValueError("Missing feature values in the feature matrix")
+        else:
+            inss = [instances.get_instance(person_id + "_" + item_id) for person_id, item_id in item_ids]
+            found = [ins is not None for ins in inss]
+            x = get_feature_matrix([ins for ins in inss if ins is not None], forest.feature_names)
+        for (person, item), is_found in zip(person_items, found):
+            if not is_found:
+                print(person, item, "not found!")
+        scored_items = {}
+        for (person_id, item_id), score in zip([ids for ids, is_found in zip(item_ids, found) if is_found],
+                                               forest.predict(x).tolist()):
+            scored_items[self.__ids2item(person_id, item_id)] = score
+        return scored_items
+
     def score(self, items):
+        if self.__use_flat_forest:
+            return self.__score_flat(items)
         inss = self.__items2inss(items)
-        print("Loading model ...")
-        model = pickle.load(open(self.__model_file, "rb"))
+        model = self.load_model()
         inss = ML(self.__ml_config).apply_model(inss, model)
         return self.__inss2items(inss)
 
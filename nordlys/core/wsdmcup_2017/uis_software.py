@@ -8,6 +8,7 @@ import os
 import argparse
 
 from nordlys.core.wsdmcup_2017.config import *
+from nordlys.core.wsdmcup_2017.scoring_server import ScoringClient
 from nordlys.core.wsdmcup_2017.triple_scorer import TripleScorer
 
 
@@ -20,6 +21,12 @@ def arg_parser():
                    help="2-columns input file (can be specified more than once)",
                    required=True, action="append", type=str)
     r.add_argument("-o", "--output_path", help="Output directory", required=True, type=str)
+    parser.add_argument("-m", "--matrix", help="Reads instances from the feature matrices (see agg_feat.py -m)",
+                        action="store_true", default=False)
+    parser.add_argument("-f", "--flat_forest", help="Scores with the flat forests (see flat_forest.py)",
+                        action="store_true", default=False)
+    parser.add_argument("-s", "--server", type=str,
+                        help="Scores with a running scoring server (Unix socket path, unix:<path>, or host:port)")
     args = parser.parse_args()
     return args
 
@@ -76,13 +83,17 @@ def main(args):
     print(args.input)
     print(args.output_path)
 
+    client = ScoringClient(args.server) if args.server else None
     for input_file in args.input:
         relation = get_relation(input_file)
         input_items = read_input(input_file)
-        scorer = TripleScorer(relation)
-        # scored_items = scorer.cross_validate()
-        # scorer.train()
-        scored_items = scorer.score(input_items)
+        if client:
+            scored_items = client.score(relation, input_items)
+        else:
+            scorer = TripleScorer(relation, use_matrix=args.matrix, use_flat_forest=args.flat_forest)
+            # scored_items = scorer.cross_validate()
+            # scorer.train()
+            scored_items = scorer.score(input_items)
         output_file = os.sep.join([args.output_path, os.path.basename(input_file)])
         write_output(input_items, scored_items, output_file)
 
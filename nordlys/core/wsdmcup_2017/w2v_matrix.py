@@ -0,0 +1,140 @@
+"""
+Word2vec matrix
+---------------
+
+In-memory store of the word2vec vectors of a fixed vocabulary, as a contiguous float32 matrix with a term -> row index
+(with the same interface as Word2Vec).
+Weighted sums of term vectors are then a gather followed by a matrix-vector product, and the weighted sums of many
+term-weight dicts are computed at once as a sparse x dense product; sums are accumulated in float64. Files:
+
+- ``vocab.txt``: terms, one per line, in row order
+- ``vectors.npy``: float32 matrix of vocabulary size x dimension
+
+The matrix is built once from the Mongo-backed Word2Vec collection (see feat_w2v_sim_approx).
+
+@author: Dario Garigliotti
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+
+def vec_cos_sim(v1, v2):
+    """Cosine similarity of two NumPy vectors (0 if any of them is a zero vector)."""
+    denominator = float(np.linalg.norm(v1)) * float(np.linalg.norm(v2))
+    return float(np.dot(v1, v2)) / denominator if denominator != 0 else 0
+
+
+class W2VMatrix(object):
+    def __init__(self, terms, vectors):
+        """
+        :param terms: list of terms
+        :param vectors: matrix with the vector of each term in a row
+        """
+        assert len(terms) == vectors.shape[0]
+        self.__terms = terms
+        self.__rows = {term: i for i, term in enumerate(terms)}
+        self.__vectors = vectors
+
+    @staticmethod
+    def from_word2vec(word2vec, terms):
+        """Fetches the vectors of the given terms (those contained in word2vec) into a matrix.
+
+        :param word2vec: Word2Vec object
+        :param terms: iterable of terms
+        """
+        terms = sorted({term for term in terms if word2vec.contains_word(term)})
+        vectors = np.zeros((len(terms), word2vec.dimension), dtype=np.float32)
+        for i, term in enumerate(terms):
+            vectors[i] = word2vec.get_vector(term)
+            if (i + 1) % 100000 == 0:
+                print((i + 1) / 1000, "K vectors loaded.")
+        return W2VMatrix(terms, vectors)
+
+    @staticmethod
+    def load(matrix_dir):
+        with open(os.sep.join([matrix_dir, "vocab.txt"]), "r", encoding="utf-8") as f:
+            terms = [line.rstrip("\n") for line in f]
+        return W2VMatrix(terms, np.load(os.sep.join([matrix_dir, "vectors.npy"])))
+
+    def save(self, matrix_dir):
+        os.makedirs(matrix_dir, exist_ok=True)
+        with open(os.sep.join([matrix_dir, "vocab.txt"]), "w", encoding="utf-8") as f:
+            for term in self.__terms:
+                f.write(term + "\n")
+        np.save(os.sep.join([matrix_dir, "vectors.npy"]), self.__vectors)
+        print("Word2vec matrix:", len(self.__terms), "terms")
+
+    def checksum(self):
+        """Returns the MD5 checksum (hex) of the vocabulary and the vectors."""
+        m = hashlib.md5("\n".join(self.__terms).encode("utf-8"))
+        m.update(np.ascontiguousarray(self.__vectors).tobytes())
+        return m.hexdigest()
+
+    @property
+    def dimension(self):
+        return self.__vectors.shape[1]
+
+    @property
+    def vectors(self):
+        return self.__vectors
+
+    def get_rows(self, terms):
+        """Returns the row of each term (-1 for the terms not in the vocabulary)."""
+        return np.array([self.__rows.get(term, -1) for term in terms], dtype=np.int64)
+
+    def contains_word(self, term):
+        return term in self.__rows
+
+    def get_vector(self, term):
+        return self.__vectors[self.__rows[term]]
+
+    def get_zeros_vector(self, dimension=None):
+        return np.zeros(dimension or self.dimension, dtype=np.float64)
+
+    def __gather(self, terms_weights):
+        """Returns the rows and weights of the terms in the vocabulary."""
+        rows, weights = [], []
+        for term, weight in terms_weights.items():
+            row = self.__rows.get(term)
+            if row is not None:
+                rows.append(row)
+                weights.append(weight)
+        return rows, weights
+
+    def weighted_sum(self, terms_weights):
+        """Gets the weighted sum of the term vectors.
+
+        :param terms_weights: dict from terms to their weights
+        :return: vector (zeros if none of the terms is in the vocabulary)
+        """
+        rows, weights = self.__gather(terms_weights)
+        if len(rows) == 0:
+            return self.get_zeros_vector()
+        return np.asarray(weights, dtype=np.float64).dot(self.__vectors[rows].astype(np.float64))
+
+    def weighted_sums(self, terms_weights_list, batch_size=10000):
+        """Gets the weighted sums for a list of term-weight dicts, as a (sparse weights) x (term vectors) product.
+
+        :param terms_weights_list: list of dicts from terms to their weights
+        :param batch_size: number of dicts multiplied at once
+        :return: matrix with a vector in each row
+        """
+        res = np.zeros((len(terms_weights_list), self.dimension), dtype=np.float64)
+        for start in range(0, len(terms_weights_list), batch_size):
+            # CSR weights of the batch: rows of each dict are contiguous
+            indptr, rows, weights = [0], [], []
+            for terms_weights in terms_weights_list[start:start + batch_size]:
+                dict_rows, dict_weights = self.__gather(terms_weights)
+                rows += dict_rows
+                weights += dict_weights
+                indptr.append(len(rows))
+            if len(rows) == 0:
+                continue
+            indptr = np.array(indptr, dtype=np.int64)
+            weighted = self.__vectors[rows].astype(np.float64) * np.asarray(weights, dtype=np.float64)[:, None]
+            non_empty = np.flatnonzero(np.diff(indptr))
+            res[start + non_empty] = np.add.reduceat(weighted, indptr[non_empty], axis=0)
+        return res
@@ -7,15 +7,27 @@ Index wikipedia sentences in http://broccoli.cs.uni-freiburg.de/wsdm-cup-2017/wi
 @author: Shuo Zhang
 """
 
+import argparse
 from collections import defaultdict
+from itertools import islice
+from multiprocessing import Pool, cpu_count
 
 from nordlys.core.retrieval.elastic import Elastic
-from nordlys.core.wsdmcup_2017.config import WP_ST_INDEX_ID, PROF_KB_F, WP_ST_F
+from nordlys.core.retrieval.local_index import LocalIndexBuilder
+from nordlys.core.wsdmcup_2017.config import WP_ST_INDEX_ID, PROF_KB_F, WP_ST_F, PERSON_SENTENCES_DIR
+from nordlys.core.wsdmcup_2017.person_sentences import PersonSentencesBuilder
 from bs4 import BeautifulSoup
 from urllib.request import urlopen
 from nordlys.core.wsdmcup_2017.wsdmcup_ids import WSDMCupIDs
 import re
 
+LINK_RE = re.compile(r"\[(.*?)\]")  # entity links [A|B]
+
+MAPPINGS = {
+    "content": Elastic.analyzed_field(),
+    "professions": Elastic.notanalyzed_field()
+}
+
 
 def gen_mappings():
     """Creates json file containing profession as key and values as the list of names."""
@@ -28,32 +40,42 @@ def gen_mappings():
     return mappings
 
 
-def index(mapper, bulk_size=10000):
-    """Indexing"""
+def parse_sentence(line, mapper, pres_prof_mapping):
+    """Replaces entity links [A|B] with person ids and collects the professions of the linked persons.
+
+    :param line: sentence from WP_ST_F
+    :param mapper: WSDMCupIDs object
+    :param pres_prof_mapping: person to professions mapping
+    :return: document {"content": ..., "professions": [...]}, and the list of linked person ids
+    """
+    profs = set()
+    person_ids = []
+
+    def replace_link(match):  # replace [A|B] with the id of A, in a single pass over the line
+        name = match.group(1).split("|")[0].replace("_", " ")
+        entity_id = mapper.get_id_from_person(name)
+        person_ids.append(entity_id)
+        profs.update(mapper.get_id_from_prof(prof) for prof in pres_prof_mapping[name])
+        return entity_id
+
+    line = LINK_RE.sub(replace_link, line)
+    return {"content": line, "professions": list(profs)}, person_ids
+
+
+def index(mapper, bulk_size=10000, postings_dir=PERSON_SENTENCES_DIR):
+    """Indexing; person-sentence postings are written to postings_dir."""
     pres_prof_mapping = gen_mappings()
+    person_sentences = PersonSentencesBuilder()
     file = open(WP_ST_F, "r")
     index_name = WP_ST_INDEX_ID
-    mappings = {
-        "content": Elastic.analyzed_field(),
-        "professions": Elastic.notanalyzed_field()
-    }
     elastic = Elastic(index_name)
-    elastic.create_index(mappings, force=True)
+    elastic.create_index(MAPPINGS, force=True)
     doc_id = 0
     docs = {}
     for line in file:
         doc_id += 1
-        profs = []
-        while ("[" in line):  # replace [A|B] with A
-            matchObj = re.search('\[(.*?)\]', line)
-            entity = matchObj.group(1).split("|")[0]
-            name = entity.replace("_", " ")
-            entity_id = mapper.get_id_from_person(name)
-            prof_list = pres_prof_mapping[name]
-            prof_list = [mapper.get_id_from_prof(prof) for prof in prof_list]
-            profs += prof_list
-            line = line.replace("[" + matchObj.group(1) + "]", entity_id)
-        docs[doc_id] = {"content": line, "professions": list(set(profs))}
+        docs[doc_id], person_ids = parse_sentence(line, mapper, pres_prof_mapping)
+        person_sentences.add(doc_id, person_ids)
         if len(docs) == bulk_size:  # bulk add 10000 sentences into elastic
             elastic.add_docs_bulk(docs)
             docs = {}
@@ -61,8 +83,114 @@ def index(mapper, bulk_size=10000):
 
     # if len(docs) < 10000: # index the last butch of sentences
     elastic.add_docs_bulk(docs)
+    person_sentences.save(postings_dir)
 
 
-if __name__ == "__main__":
+def _init_worker():
+    """Loads the id mappings in each worker process of the parallel indexing."""
+    global _mapper, _pres_prof_mapping
+    _mapper = WSDMCupIDs()
+    _pres_prof_mapping = gen_mappings()
+
+
+def _parse_lines(task):
+    """Parses a chunk of lines in a worker process.
+
+    :param task: (doc id of the first line, list of lines)
+    :return: list of (doc_id, doc, person_ids)
+    """
+    first_doc_id, lines = task
+    parsed = []
+    for doc_id, line in enumerate(lines, first_doc_id):
+        doc, person_ids = parse_sentence(line, _mapper, _pres_prof_mapping)
+        parsed.append((doc_id, doc, person_ids))
+    return parsed
+
+
+def _read_chunks(file, lines_per_chunk):
+    """Reads the file in chunks of lines; doc ids are line numbers (starting from 1)."""
+    doc_id = 1
+    while True:
+        lines = list(islice(file, lines_per_chunk))
+        if len(lines) == 0:
+            break
+        yield doc_id, lines
+        doc_id += len(lines)
+
+
+def index_parallel(num_workers=cpu_count(), lines_per_chunk=10000, thread_count=4,
+                   max_chunk_bytes=Elastic.BULK_MAX_BYTES, postings_dir=PERSON_SENTENCES_DIR):
+    """Indexing with a pool of parsing processes and parallel bulk requests.
+    Refreshing is disabled during loading; afterwards it is restored and the index is force-merged.
+
+    :param num_workers: number of parsing processes
+    :param lines_per_chunk: number of lines sent to a parsing process at once
+    :param thread_count: number of threads sending bulk requests
+    :param max_chunk_bytes: max size of a bulk request (in bytes)
+    :param postings_dir: directory of the person-sentence postings
+    """
+    elastic = Elastic(WP_ST_INDEX_ID)
+    elastic.create_index(MAPPINGS, force=True)
+    refresh_interval = elastic.get_settings().get("refresh_interval", "1s")
+    elastic.update_refresh_interval("-1")
+    person_sentences = PersonSentencesBuilder()
+
+    def gen_docs():
+        with open(WP_ST_F, "r") as file, Pool(num_workers, initializer=_init_worker) as pool:
+            for parsed in pool.imap(_parse_lines, _read_chunks(file, lines_per_chunk)):  # keeps the line order
+                for doc_id, doc, person_ids in parsed:
+                    person_sentences.add(doc_id, person_ids)
+                    yield doc_id, doc
+
+    try:
+        num_docs = elastic.add_docs_parallel(gen_docs(), thread_count=thread_count, max_chunk_bytes=max_chunk_bytes)
+    finally:
+        elastic.update_refresh_interval(refresh_interval)
+    print(num_docs, "documents indexed; merging segments ...")
+    elastic.force_merge()
+    person_sentences.save(postings_dir)
+
+
+def index_local(mapper, index_dir, postings_dir=PERSON_SENTENCES_DIR):
+    """Builds the local (in-process) index, with the same documents and ids as the Elastic index.
+
+    :param mapper: WSDMCupIDs object
+    :param index_dir: directory of the local index
+    :param postings_dir: directory of the person-sentence postings
+    """
+    pres_prof_mapping = gen_mappings()
+    person_sentences = PersonSentencesBuilder()
+    builder = LocalIndexBuilder(index_dir, MAPPINGS)
+    with open(WP_ST_F, "r") as file:
+        for doc_id, line in enumerate(file, 1):
+            doc, person_ids = parse_sentence(line, mapper, pres_prof_mapping)
+            builder.add_doc(doc_id, doc)
+            person_sentences.add(doc_id, person_ids)
+            if doc_id % 100000 == 0:
+                print(doc_id / 1000, "K documents indexed.")
+    builder.close()
+    person_sentences.save(postings_dir)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", "--local_index_dir", help="builds a local index in this directory, instead of Elastic",
+                        type=str)
+    parser.add_argument("-p", "--parallel", help="indexes in parallel with this number of parsing processes",
+                        type=int)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
     mapper = WSDMCupIDs()
-    index(mapper)
+    if args.local_index_dir:
+        index_local(mapper, args.local_index_dir)
+    elif args.parallel:
+        index_parallel(num_workers=args.parallel)
+    else:
+        index(mapper)
+
+
+if __name__ == "__main__":
+    main(arg_parser())